@@ -0,0 +1,91 @@
+"""
+Reuse of age estimates for face crops that have not changed.
+
+A customer standing still in front of the camera gives the age network
+nearly the same crop every tick, and it answers with nearly the same
+probabilities. AgeCache remembers the network's output for the last few
+crops. Each crop is identified by a perceptual hash (DCT hash of the
+crop scaled to 32x32 grey; mean brightness does not enter it) together
+with its box. A new crop within a few bits of a remembered hash, whose
+box has moved or resized by no more than a fraction of its size, gets
+the remembered output instead of a forward pass.
+
+A remembered output is not new evidence, so the caller only adds
+forward passes to the verdict and consults the cache once the verdict
+has settled: the first verdict is still built from distinct inferences,
+and the cache saves the passes made while the customer stands waiting
+to confirm. An entry is reused `max_hits` times before the crop is run
+through the network again, so the verdict keeps being refreshed while
+someone stands still for a long time.
+"""
+
+import collections
+
+import cv2
+import numpy as np
+
+HASH_SIZE = 32          # crop side the DCT runs on
+HASH_BITS_SIDE = 8      # low-frequency block kept: 8x8 = 64 bits
+
+
+def phash(gray):
+    """64-bit perceptual hash of a grey crop."""
+    small = cv2.resize(gray, (HASH_SIZE, HASH_SIZE),
+                       interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:HASH_BITS_SIDE, :HASH_BITS_SIDE].ravel()
+    # The DC term is the mean brightness: leave it out of the median.
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def _near(a, b, tolerance):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    limit = tolerance * max(aw, ah)
+    return (abs(ax - bx) <= limit and abs(ay - by) <= limit
+            and abs(aw - bw) <= limit and abs(ah - bh) <= limit)
+
+
+class AgeCache:
+    """LRU of (hash, box) -> network output; lookups are newest first."""
+
+    def __init__(self, size=32, max_distance=5, box_tolerance=0.1,
+                 max_hits=10):
+        self.size = size
+        self.max_distance = max_distance
+        self.box_tolerance = box_tolerance
+        self.max_hits = max_hits
+        # id -> [hash, box, output, hits], least recently used first
+        self._entries = collections.OrderedDict()
+        self._next = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+    def lookup(self, gray, box):
+        """
+        Returns (key, output). `output` is the remembered network output
+        or None on a miss, in which case pass `key` to store().
+        """
+        x, y, w, h = box
+        key = (phash(gray[y:y + h, x:x + w]), tuple(box))
+        for entry_id in reversed(self._entries):
+            entry = self._entries[entry_id]
+            if (bin(entry[0] ^ key[0]).count("1") <= self.max_distance
+                    and _near(entry[1], key[1], self.box_tolerance)):
+                if entry[3] >= self.max_hits:
+                    del self._entries[entry_id]   # due for a fresh pass
+                    return key, None
+                entry[3] += 1
+                self._entries.move_to_end(entry_id)
+                return key, entry[2]
+        return key, None
+
+    def store(self, key, output):
+        self._entries[self._next] = [key[0], key[1], output, 0]
+        self._next += 1
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
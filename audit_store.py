@@ -0,0 +1,293 @@
+"""
+Local audit trail of age-verification decisions.
+
+Every camera verdict and NFC check is one row in a SQLite database
+(WAL mode, so compliance queries can run while the kiosk writes):
+timestamp, lane, checkout id, step, outcome, estimated age bucket and
+confidence, card id and verified age, plus an optional small JPEG of the
+face. Rows are written in batches by a background thread; the GUI thread
+only queues them.
+
+The same thread keeps the file inside its budget: rows past the
+retention period are deleted, and when the database is still over
+`max_bytes` the oldest thumbnails are dropped first, then the oldest
+rows, and the freed pages are returned to the filesystem. Thumbnails
+live in their own table so that dropping the oldest ones empties whole
+pages instead of leaving every decision page half full.
+
+    python audit_store.py query --db audit.db --since 2026-10-01 --lane 3
+    python audit_store.py stats --db audit.db
+"""
+
+import argparse
+import csv
+import datetime
+import json
+import logging
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+import cv2
+
+import metrics
+
+logger = logging.getLogger("pos.audit")
+
+RECORDS = metrics.counter(
+    "pos_audit_records_total", "Verification decisions written")
+WRITE_SECONDS = metrics.histogram(
+    "pos_audit_write_seconds", "One batched audit transaction")
+
+COLUMNS = ("id", "ts", "lane", "checkout_id", "step", "outcome",
+           "age_bucket", "confidence", "card_id", "verified_age")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS decisions (
+    id           INTEGER PRIMARY KEY,
+    ts           REAL NOT NULL,
+    lane         TEXT NOT NULL,
+    checkout_id  TEXT,
+    step         TEXT NOT NULL,
+    outcome      TEXT NOT NULL,
+    age_bucket   TEXT,
+    confidence   REAL,
+    card_id      TEXT,
+    verified_age INTEGER
+);
+CREATE TABLE IF NOT EXISTS thumbnails (
+    decision_id  INTEGER PRIMARY KEY,
+    jpeg         BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS decisions_ts ON decisions (ts);
+CREATE INDEX IF NOT EXISTS decisions_lane_ts ON decisions (lane, ts);
+CREATE INDEX IF NOT EXISTS decisions_checkout ON decisions (checkout_id);
+"""
+
+THUMBNAIL_PX = 64
+BATCH = 256
+MAINTAIN_EVERY = 600.0   # seconds between retention/budget passes
+PRUNE_CHUNK = 500        # rows or thumbnails released per budget step
+
+
+def connect(path):
+    # auto_vacuum only takes effect on a new database; it lets the budget
+    # pass hand pages back without a full VACUUM.
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def db_bytes(conn):
+    """Pages in use, excluding the free list."""
+    page = conn.execute("PRAGMA page_size").fetchone()[0]
+    count = conn.execute("PRAGMA page_count").fetchone()[0]
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return (count - free) * page
+
+
+def encode_thumbnail(face):
+    """Small JPEG of a BGR face crop, or None."""
+    if face is None or not face.size:
+        return None
+    thumb = cv2.resize(face, (THUMBNAIL_PX, THUMBNAIL_PX),
+                       interpolation=cv2.INTER_AREA)
+    ok, buf = cv2.imencode(".jpg", thumb, [cv2.IMWRITE_JPEG_QUALITY, 70])
+    return buf.tobytes() if ok else None
+
+
+def query(conn, since=None, until=None, lane=None, checkout_id=None,
+          step=None, limit=1000):
+    """Decisions in [since, until) as dicts, oldest first (no thumbnails)."""
+    where, args = [], []
+    for clause, value in (("ts >= ?", since), ("ts < ?", until),
+                          ("lane = ?", lane),
+                          ("checkout_id = ?", checkout_id),
+                          ("step = ?", step)):
+        if value is not None:
+            where.append(clause)
+            args.append(value)
+    sql = f"SELECT {', '.join(COLUMNS)} FROM decisions"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY ts LIMIT ?"
+    args.append(limit)
+    return [dict(zip(COLUMNS, row)) for row in conn.execute(sql, args)]
+
+
+class AuditStore:
+    """Owns the writer connection and thread; record() from any thread."""
+
+    def __init__(self, path, lane, max_bytes=200 * 2**20,
+                 retention_days=365, thumbnails=False):
+        self.path = path
+        self.lane = lane
+        self.max_bytes = max_bytes
+        self.retention_days = retention_days
+        self.thumbnails = thumbnails
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._last_maintain = 0.0
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout=5.0):
+        """Write what is queued and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def record(self, step, outcome, checkout_id=None, age_bucket=None,
+               confidence=None, card_id=None, verified_age=None, face=None):
+        """Queue one decision; `face` is a BGR crop, kept if enabled."""
+        if self._thread is None:
+            return
+        self._queue.put((time.time(), self.lane, checkout_id, step, outcome,
+                         age_bucket, confidence, card_id, verified_age,
+                         face if self.thumbnails else None))
+
+    def query(self, **kwargs):
+        """Run query() on a fresh read connection (safe while writing)."""
+        conn = sqlite3.connect(self.path)
+        try:
+            return query(conn, **kwargs)
+        finally:
+            conn.close()
+
+    # ── writer thread ──
+    def _run(self):
+        conn = connect(self.path)
+        self._maintain(conn)
+        running = True
+        while running:
+            try:
+                item = self._queue.get(timeout=MAINTAIN_EVERY)
+            except queue.Empty:
+                item = ()
+            batch = []
+            while item is not None:
+                if item:
+                    batch.append(item)
+                if len(batch) >= BATCH:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            running = item is not None
+            if batch:
+                self._write(conn, batch)
+            if time.monotonic() - self._last_maintain >= MAINTAIN_EVERY:
+                self._maintain(conn)
+        conn.close()
+
+    def _write(self, conn, batch):
+        thumbs = [encode_thumbnail(row[-1]) for row in batch]
+        try:
+            with WRITE_SECONDS.time(), conn:
+                for row, thumb in zip(batch, thumbs):
+                    cur = conn.execute(
+                        "INSERT INTO decisions (ts, lane, checkout_id, step, "
+                        "outcome, age_bucket, confidence, card_id, "
+                        "verified_age) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        row[:-1])
+                    if thumb is not None:
+                        conn.execute("INSERT INTO thumbnails VALUES (?, ?)",
+                                     (cur.lastrowid, thumb))
+            RECORDS.inc(len(batch))
+        except sqlite3.Error:
+            logger.exception("Audit write failed (%d rows lost)", len(batch))
+
+    def _maintain(self, conn):
+        """Apply retention, then squeeze the file under its budget."""
+        self._last_maintain = time.monotonic()
+        try:
+            with conn:
+                if self.retention_days:
+                    cutoff = time.time() - self.retention_days * 86400
+                    conn.execute(
+                        "DELETE FROM thumbnails WHERE decision_id IN "
+                        "(SELECT id FROM decisions WHERE ts < ?)", (cutoff,))
+                    conn.execute("DELETE FROM decisions WHERE ts < ?",
+                                 (cutoff,))
+                while self.max_bytes and db_bytes(conn) > self.max_bytes:
+                    # Row ids grow with time, so the lowest are the oldest.
+                    cur = conn.execute(
+                        "DELETE FROM thumbnails WHERE decision_id IN (SELECT "
+                        "decision_id FROM thumbnails ORDER BY decision_id "
+                        "LIMIT ?)", (PRUNE_CHUNK,))
+                    if cur.rowcount:
+                        continue
+                    cur = conn.execute(
+                        "DELETE FROM decisions WHERE id IN (SELECT id "
+                        "FROM decisions ORDER BY id LIMIT ?)", (PRUNE_CHUNK,))
+                    if not cur.rowcount:
+                        break
+                    logger.warning("Audit budget: dropped %d oldest rows",
+                                   cur.rowcount)
+            # Through sqlite3_exec: a plain execute() steps the pragma once,
+            # which releases a single page.
+            conn.executescript("PRAGMA incremental_vacuum;")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        except sqlite3.Error:
+            logger.exception("Audit maintenance failed")
+
+
+# ================= CLI =================
+def _parse_time(text):
+    """Unix seconds, or an ISO date/datetime in local time."""
+    if text is None:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.datetime.fromisoformat(text).timestamp()
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Query the verification audit")
+    p.add_argument("command", choices=("query", "stats"))
+    p.add_argument("--db", default=os.environ.get("POS_AUDIT_DB", "audit.db"))
+    p.add_argument("--since", help="ISO date/datetime or unix seconds")
+    p.add_argument("--until", help="ISO date/datetime or unix seconds")
+    p.add_argument("--lane")
+    p.add_argument("--checkout")
+    p.add_argument("--step", choices=("camera", "nfc"))
+    p.add_argument("--limit", type=int, default=1000)
+    p.add_argument("--csv", action="store_true", help="CSV instead of JSON")
+    args = p.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    if args.command == "stats":
+        total, first, last = conn.execute(
+            "SELECT COUNT(*), MIN(ts), MAX(ts) FROM decisions").fetchone()
+        thumbs = conn.execute(
+            "SELECT COUNT(*) FROM thumbnails").fetchone()[0]
+        print(json.dumps({"rows": total, "thumbnails": thumbs,
+                          "first_ts": first, "last_ts": last,
+                          "bytes": db_bytes(conn)}, indent=2))
+        return
+
+    rows = query(conn, _parse_time(args.since), _parse_time(args.until),
+                 args.lane, args.checkout, args.step, args.limit)
+    if args.csv:
+        writer = csv.DictWriter(sys.stdout, COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        print(json.dumps(rows, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
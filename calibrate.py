@@ -0,0 +1,316 @@
+"""
+Per-terminal tuning of the face detector against a latency budget.
+
+The detector settings the kiosk ships with (cascade scale factor and
+min-neighbours, capture resolution, camera tick) suit no terminal in
+particular. This sweeps them on recorded clips and/or frames grabbed
+from the terminal's own camera, timing what the camera tick spends
+detecting (grey conversion plus detector, as in the "detect" frame
+stage) on this machine:
+
+* every detector backend given, each Haar cascade at every scale factor
+  and min-neighbours value (the DNN backends have neither);
+* every capture mode up to the resolution of the frames, by cropping
+  each frame to the mode's aspect ratio around its centre and scaling it
+  down, as a camera configured for that mode would deliver it (faces
+  keep their proportions; a 16:9 grab is not squashed into 4:3).
+
+Frames are expected to show one customer facing the camera, as for
+detector_bench.py, so a frame with a face counts as detected and a frame
+with more than one box as spurious. Among the settings whose p95 latency
+fits the budget, the highest detection rate net of spurious frames wins,
+then the fastest. The camera tick is set to leave headroom over that
+p95 for the rest of the tick (age inference, drawing), but never below
+the camera's frame interval, since a faster tick only finds no new frame.
+
+The profile is written as JSON and read by main.py at start-up; explicit
+POS_FACE_DETECTOR and POS_CAMERA_MODE settings still take precedence.
+
+    python calibrate.py --clips clips/ --camera 0 --budget-ms 25
+    python calibrate.py --clips clips/ --dry-run
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import socket
+import time
+
+import cv2
+import numpy as np
+
+import capture
+import detector_bench
+import face_detectors
+
+logger = logging.getLogger("pos.calibrate")
+
+PROFILE_VERSION = 1
+PROFILE_KEYS = ("detector", "scale_factor", "min_neighbors", "camera_mode",
+                "camera_interval_ms")
+
+SCALE_FACTORS = (1.05, 1.1, 1.2, 1.3, 1.4)
+MIN_NEIGHBORS = (3, 4, 5, 6)
+CAMERA_MODES = ("1280x720", "640x480", "480x360", "320x240")
+
+# Frames timed before a setting far over budget is abandoned
+PRUNE_AFTER = 10
+
+
+def default_detectors():
+    found = face_detectors.available()
+    return [b for b in ("haar", "haar_alt2", "dnn", "yunet") if b in found]
+
+
+def grab_frames(spec, frames, config, timeout=30.0):
+    """
+    Frames from the terminal's camera at the largest mode in `config`,
+    plus the frame rate it actually delivered.
+    """
+    source = capture.open_source(spec, config, "realtime", loop=False)
+    if not source.isOpened():
+        raise OSError(f"cannot open camera {spec}")
+    grabbed = []
+    started = time.perf_counter()
+    try:
+        while len(grabbed) < frames and \
+                time.perf_counter() - started < timeout:
+            ok, frame = source.read()
+            if ok:
+                grabbed.append(frame.copy())
+            else:
+                time.sleep(0.001)
+    finally:
+        source.release()
+    seconds = time.perf_counter() - started
+    return grabbed, (len(grabbed) / seconds if seconds else None)
+
+
+def fit(frame, width, height):
+    """
+    Centre crop of `frame` with the aspect ratio of width x height,
+    scaled to that size; None if that would mean scaling up.
+    """
+    h, w = frame.shape[:2]
+    if w * height > h * width:
+        cw, ch = h * width // height, h      # wider: trim the sides
+    else:
+        cw, ch = w, w * height // width      # taller: trim top and bottom
+    if cw < width or ch < height:
+        return None   # no upscaling: that is not what the camera sees
+    x, y = (w - cw) // 2, (h - ch) // 2
+    frame = frame[y:y + ch, x:x + cw]
+    if (cw, ch) != (width, height):
+        frame = cv2.resize(frame, (width, height),
+                           interpolation=cv2.INTER_AREA)
+    return frame
+
+
+def at_mode(frames, mode):
+    """`frames` as the camera would deliver them in `mode`, or None."""
+    width, height, _ = capture.parse_mode(mode)
+    out = []
+    for frame in frames:
+        frame = fit(frame, width, height)
+        if frame is None:
+            return None
+        out.append(frame)
+    return out
+
+
+def settings(detectors, scale_factors, min_neighbors):
+    """(detector, scale_factor, min_neighbors) combinations to try."""
+    for spec in detectors:
+        if spec in face_detectors.CASCADES or spec in face_detectors.MODES:
+            for sf in scale_factors:
+                for mn in min_neighbors:
+                    yield spec, sf, mn
+        else:
+            yield spec, None, None
+
+
+def measure(detector, frames, budget_ms):
+    """Detect time per frame (ms) and boxes; stops early if hopeless."""
+    detector.detect(frames[0], cv2.cvtColor(frames[0], cv2.COLOR_BGR2GRAY))
+    times, boxes = [], []
+    for frame in frames:
+        start = time.perf_counter()
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        found = detector.detect(frame, gray)
+        times.append((time.perf_counter() - start) * 1000.0)
+        boxes.append(found)
+        if len(times) == PRUNE_AFTER and \
+                np.median(times) > 2 * budget_ms:
+            break
+    return np.asarray(times), boxes
+
+
+def sweep(frames, budget_ms, detectors, scale_factors=SCALE_FACTORS,
+          min_neighbors=MIN_NEIGHBORS, modes=CAMERA_MODES):
+    """One result dict per setting tried, in sweep order."""
+    results = []
+    for mode in modes:
+        scaled = at_mode(frames, mode)
+        if scaled is None:
+            continue
+        for spec, sf, mn in settings(detectors, scale_factors,
+                                     min_neighbors):
+            try:
+                detector, backend = face_detectors.create(
+                    spec, sf or 1.3, mn or 5)
+            except (ValueError, OSError) as e:
+                logger.warning("Skipping %s: %s", spec, e)
+                continue
+            ms, boxes = measure(detector, scaled, budget_ms)
+            complete = len(boxes) == len(scaled)
+            result = {
+                "detector": spec, "backend": backend, "scale_factor": sf,
+                "min_neighbors": mn, "camera_mode": mode,
+                "p50_ms": round(float(np.percentile(ms, 50)), 3),
+                "p95_ms": round(float(np.percentile(ms, 95)), 3),
+                "detection_rate": round(
+                    sum(1 for b in boxes if len(b)) / len(boxes), 4),
+                "spurious_rate": round(
+                    sum(1 for b in boxes if len(b) > 1) / len(boxes), 4),
+                "within_budget": complete and
+                float(np.percentile(ms, 95)) <= budget_ms,
+            }
+            if not complete:
+                result["pruned_after"] = len(boxes)
+            results.append(result)
+            logger.info("%-9s sf=%-4s mn=%-4s %-8s p95 %7.2f ms  "
+                        "detected %.3f  spurious %.3f", spec, sf, mn, mode,
+                        result["p95_ms"], result["detection_rate"],
+                        result["spurious_rate"])
+    return results
+
+
+def choose(results):
+    """Best detection within budget, else the fastest setting."""
+    fitting = [r for r in results if r["within_budget"]]
+    if fitting:
+        return max(fitting, key=lambda r: (
+            r["detection_rate"] - r["spurious_rate"], -r["p95_ms"]))
+    return min(results, key=lambda r: r["p95_ms"]) if results else None
+
+
+def tick_interval(p95_ms, headroom, fps=None, floor_ms=10):
+    """Camera tick for a detect p95, never faster than frames arrive."""
+    interval = p95_ms * (1.0 + headroom)
+    if fps:
+        interval = max(interval, 1000.0 / fps)
+    return max(floor_ms, int(math.ceil(interval)))
+
+
+def make_profile(best, budget_ms, headroom, frames, fps=None):
+    return {
+        "version": PROFILE_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "host": socket.gethostname(),
+        "budget_ms": budget_ms,
+        "detector": best["detector"],
+        "scale_factor": best["scale_factor"],
+        "min_neighbors": best["min_neighbors"],
+        "camera_mode": best["camera_mode"],
+        "camera_interval_ms": tick_interval(best["p95_ms"], headroom, fps),
+        "within_budget": best["within_budget"],
+        "measured": {"frames": frames, "p95_ms": best["p95_ms"],
+                     "detection_rate": best["detection_rate"],
+                     "spurious_rate": best["spurious_rate"]},
+    }
+
+
+def save_profile(profile, path):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+    os.replace(tmp, path)
+
+
+def load_profile(path):
+    """The saved profile, or None if there is none or it is unusable."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            profile = json.load(f)
+        if profile.get("version") != PROFILE_VERSION:
+            raise ValueError(f"version {profile.get('version')!r}")
+        missing = [k for k in PROFILE_KEYS if k not in profile]
+        if missing:
+            raise ValueError(f"missing {', '.join(missing)}")
+        capture.parse_mode(profile["camera_mode"])
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        logger.warning("Ignoring terminal profile %s: %s", path, e,
+                       extra={"path": path})
+        return None
+    return profile
+
+
+# ================= CLI =================
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--clips", nargs="*", default=[],
+                   help="video files, images or directories of them")
+    p.add_argument("--camera",
+                   help="also grab frames from this camera source")
+    p.add_argument("--camera-frames", type=int, default=90)
+    p.add_argument("--max-frames", type=int, default=60,
+                   help="frames decoded per video")
+    p.add_argument("--budget-ms", type=float, default=float(
+        os.environ.get("POS_FRAME_BUDGET_MS", "25")),
+        help="p95 detect time allowed per camera frame")
+    p.add_argument("--headroom", type=float, default=0.5,
+                   help="camera tick margin over the detect p95, as a "
+                        "fraction of it")
+    p.add_argument("--detectors", nargs="*", default=default_detectors())
+    p.add_argument("--modes", nargs="*", default=list(CAMERA_MODES))
+    p.add_argument("--profile", default=os.environ.get(
+        "POS_TERMINAL_PROFILE", "terminal_profile.json"))
+    p.add_argument("--report", help="also write every result here")
+    p.add_argument("--dry-run", action="store_true",
+                   help="print the chosen profile without saving it")
+    args = p.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    frames = detector_bench.load_frames(args.clips, args.max_frames)
+    config = capture.config_from_env(os.environ)
+    fps = config.fps
+    if args.camera is not None:
+        width, height = max((capture.parse_mode(m)[:2] for m in args.modes),
+                            key=lambda wh: wh[0] * wh[1])
+        config = config._replace(width=width, height=height)
+        live, fps = grab_frames(args.camera, args.camera_frames, config)
+        logger.info("Grabbed %d camera frames (%.1f fps)", len(live),
+                    fps or 0.0)
+        frames += live
+    if not frames:
+        p.exit(1, "no frames: give --clips and/or --camera\n")
+    # Clips and camera frames of different sizes or shapes are each
+    # brought to every mode by at_mode().
+    results = sweep(frames, args.budget_ms, args.detectors,
+                    modes=args.modes)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    best = choose(results)
+    if best is None:
+        p.exit(1, "no detector could be run\n")
+    if not best["detection_rate"]:
+        logger.warning("No face found with any setting; the frames should "
+                       "show someone facing the camera")
+    if not best["within_budget"]:
+        logger.warning("Nothing fits %.1f ms; using the fastest setting",
+                       args.budget_ms)
+    profile = make_profile(best, args.budget_ms, args.headroom, len(frames),
+                           fps)
+    print(json.dumps(profile, indent=2))
+    if not args.dry_run:
+        save_profile(profile, args.profile)
+        print(f"saved {args.profile}")
+
+
+if __name__ == "__main__":
+    main()
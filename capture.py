@@ -0,0 +1,471 @@
+"""
+Camera capture: sources, setup and pacing.
+
+open_source() turns a source spec into a VideoCapture-like object
+(isOpened / read / release), so the verification pipeline runs the same
+against lane hardware and against recorded traffic:
+
+    0, 2, /dev/video2          camera device (index or path)
+    rtsp://..., http://...     network stream
+    clip.mp4                   video file (looped)
+    frames/                    directory of images, in name order (looped)
+    shm:lane1                  frames published into shared memory by
+                               another process (see SharedMemoryWriter)
+
+Pacing is "realtime" or "fast". Realtime reads live sources through
+LatestFrameGrabber, and plays recorded ones at their own frame rate
+against the wall clock, skipping frames the consumer is too slow for;
+fast hands out every frame as quickly as it is asked for, for
+throughput tests.
+
+Left to driver defaults a webcam picks its own resolution, frame rate
+and pixel format (often uncompressed YUYV, which saturates USB 2.0 at
+higher resolutions), and the driver queues several frames, so a slow
+consumer is handed frames that are already a few ticks old.
+CaptureConfig pins the mode per terminal; configure() applies it and
+reports what the device actually accepted. LatestFrameGrabber reads the
+device on its own thread at the camera's pace and keeps only the newest
+frame, so the GUI tick always analyses the freshest picture and never
+the same one twice.
+
+    python capture.py probe 0 --frames 120
+    python capture.py publish clips/lane3.mp4 --shm lane3
+"""
+
+import argparse
+import collections
+import json
+import logging
+import os
+import signal
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+import metrics
+
+logger = logging.getLogger("pos.camera")
+
+FRAME_AGE = metrics.histogram(
+    "pos_frame_age_seconds", "Frame grabbed to frame handed to analysis")
+GRABBED = {
+    result: metrics.counter(
+        "pos_capture_frames_total", "Frames read from the camera",
+        {"result": result})
+    for result in ("used", "skipped")
+}
+
+CaptureConfig = collections.namedtuple(
+    "CaptureConfig", "width height fps fourcc buffer exposure")
+
+PACINGS = ("realtime", "fast")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+DEFAULT_FPS = 30.0
+
+# Shared-memory frame: sequence number (odd while a write is in
+# progress), height, width, channels, then the pixels.
+SHM_HEADER = struct.Struct("<QIII")
+SHM_OFFSET = 64
+
+
+def parse_mode(text):
+    """'640x480@30' -> (640, 480, 30); any part may be left out."""
+    size, _, fps = text.partition("@")
+    width = height = None
+    if size:
+        w, _, h = size.lower().partition("x")
+        width, height = int(w), int(h)
+    return width, height, float(fps) if fps else None
+
+
+def config_from_env(env):
+    """CaptureConfig from POS_CAMERA_* variables (see README)."""
+    width, height, fps = parse_mode(env.get("POS_CAMERA_MODE", "640x480@30"))
+    exposure = env.get("POS_CAMERA_EXPOSURE", "")
+    return CaptureConfig(
+        width, height, fps,
+        env.get("POS_CAMERA_FOURCC", "MJPG").upper() or None,
+        int(env.get("POS_CAMERA_BUFFER", "1")),
+        float(exposure) if exposure else None)
+
+
+def configure(cap, config):
+    """
+    Apply `config` to an opened VideoCapture and return the settings the
+    device reports back; drivers silently round or ignore what they
+    don't support.
+    """
+    # The pixel format has to be chosen before the frame size on V4L2.
+    if config.fourcc:
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*config.fourcc))
+    if config.width:
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, config.width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, config.height)
+    if config.fps:
+        cap.set(cv2.CAP_PROP_FPS, config.fps)
+    if config.buffer:
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, config.buffer)
+    if config.exposure is not None:
+        # Manual mode is 1 on V4L2 (0.25 on DirectShow); the exposure
+        # value itself is backend specific.
+        cap.set(cv2.CAP_PROP_AUTO_EXPOSURE, 1)
+        cap.set(cv2.CAP_PROP_EXPOSURE, config.exposure)
+
+    code = int(cap.get(cv2.CAP_PROP_FOURCC))
+    actual = {
+        "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        "fps": cap.get(cv2.CAP_PROP_FPS),
+        "fourcc": "".join(chr((code >> 8 * i) & 0xFF) for i in range(4))
+        if code else None,
+        "buffer": int(cap.get(cv2.CAP_PROP_BUFFERSIZE)),
+    }
+    if config.width and (actual["width"], actual["height"]) != (
+            config.width, config.height):
+        logger.warning("Camera gave %dx%d instead of %dx%d",
+                       actual["width"], actual["height"],
+                       config.width, config.height, extra=actual)
+    logger.info("Camera configured", extra=actual)
+    return actual
+
+
+class LatestFrameGrabber:
+    """
+    VideoCapture stand-in that drains `cap` on a background thread.
+
+    read() returns the newest frame not handed out yet, or (False, None)
+    when nothing new arrived since the last call; callers on a timer
+    simply skip that tick.
+    """
+
+    def __init__(self, cap):
+        self._cap = cap
+        self._lock = threading.Lock()
+        self._frame = None
+        self._grabbed_at = 0.0
+        self._fresh = False
+        self._running = cap.isOpened()
+        self._thread = None
+        if self._running:
+            self._thread = threading.Thread(
+                target=self._run, name="camera-grabber", daemon=True)
+            self._thread.start()
+
+    def isOpened(self):
+        return self._running
+
+    def read(self):
+        with self._lock:
+            if not self._fresh:
+                return False, None
+            frame, grabbed_at = self._frame, self._grabbed_at
+            self._fresh = False
+        GRABBED["used"].inc()
+        FRAME_AGE.observe(time.perf_counter() - grabbed_at)
+        return True, frame
+
+    def release(self, timeout=1.0):
+        self._running = False
+        if self._thread is None:
+            self._cap.release()
+            return
+        # The grabber releases the device itself once its read returns,
+        # so a camera stuck in read() is never closed under its feet.
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        try:
+            while self._running:
+                ok, frame = self._cap.read()
+                if not ok:
+                    logger.error("Camera stopped delivering frames")
+                    self._running = False
+                    break
+                with self._lock:
+                    if self._fresh:
+                        GRABBED["skipped"].inc()
+                    self._frame = frame
+                    self._grabbed_at = time.perf_counter()
+                    self._fresh = True
+        finally:
+            self._cap.release()
+
+
+# ================= SOURCES =================
+def open_source(spec, config=None, pacing="realtime", loop=True):
+    """VideoCapture-like reader for a source spec (see module docstring)."""
+    spec = str(spec)
+    if pacing not in PACINGS:
+        raise ValueError(f"unknown pacing {pacing!r}")
+    if spec.startswith("shm:"):
+        return SharedMemorySource(spec[4:])
+
+    if spec.isdigit() or spec.startswith("/dev/") or "://" in spec:
+        cap = cv2.VideoCapture(int(spec) if spec.isdigit() else spec)
+        if not cap.isOpened():
+            return cap
+        if config is not None and "://" not in spec:
+            configure(cap, config)
+        return LatestFrameGrabber(cap) if pacing == "realtime" else cap
+
+    if os.path.isdir(spec):
+        source = ImageSequence(spec, loop)
+        fps = (config.fps if config is not None else None) or DEFAULT_FPS
+    else:
+        source = LoopingVideo(spec, loop)
+        fps = source.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+    if pacing == "realtime" and source.isOpened():
+        return Paced(source, fps)
+    return source
+
+
+class LoopingVideo:
+    """Video file reader that starts over at the end."""
+
+    def __init__(self, path, loop=True):
+        self.path = path
+        self.loop = loop
+        self._cap = cv2.VideoCapture(path)
+
+    def isOpened(self):
+        return self._cap.isOpened()
+
+    def get(self, prop):
+        return self._cap.get(prop)
+
+    def grab(self):
+        if self._cap.grab():
+            return True
+        if not self.loop:
+            return False
+        self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        return self._cap.grab()
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self._cap.retrieve()
+
+    def release(self):
+        self._cap.release()
+
+
+class ImageSequence:
+    """Directory of still images read in name order."""
+
+    def __init__(self, path, loop=True):
+        self.loop = loop
+        self.files = sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if name.lower().endswith(IMAGE_EXTENSIONS))
+        self._index = -1
+
+    def isOpened(self):
+        return bool(self.files)
+
+    def grab(self):
+        if self._index + 1 >= len(self.files):
+            if not self.loop or not self.files:
+                return False
+            self._index = -1
+        self._index += 1
+        return True
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        frame = cv2.imread(self.files[self._index])
+        return frame is not None, frame
+
+    def release(self):
+        pass
+
+
+class Paced:
+    """
+    Plays a recorded source at `fps` against the wall clock. Frames the
+    consumer is too slow for are skipped with grab() (no colour
+    conversion, no image decode for stills); asking again before the
+    next frame is due returns (False, None).
+    """
+
+    def __init__(self, source, fps):
+        self._source = source
+        self._period = 1.0 / fps
+        self._started = None
+        self._next = 0
+
+    def isOpened(self):
+        return self._source.isOpened()
+
+    def read(self):
+        now = time.perf_counter()
+        if self._started is None:
+            self._started = now
+        due = int((now - self._started) / self._period)
+        if due < self._next:
+            return False, None
+        while self._next < due:
+            if not self._source.grab():
+                return False, None
+            GRABBED["skipped"].inc()
+            self._next += 1
+        ok, frame = self._source.read()
+        self._next += 1
+        if ok:
+            GRABBED["used"].inc()
+        return ok, frame
+
+    def release(self):
+        self._source.release()
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 every attach is tracked, and the tracker
+        # would unlink the publisher's segment when this process exits.
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class SharedMemoryWriter:
+    """Publishes BGR frames of one fixed shape for SharedMemorySource."""
+
+    def __init__(self, name, shape):
+        self.shape = tuple(shape)
+        self._shm = shared_memory.SharedMemory(
+            name=name, create=True,
+            size=SHM_OFFSET + int(np.prod(self.shape)))
+        self._pixels = np.ndarray(self.shape, np.uint8, self._shm.buf,
+                                  SHM_OFFSET)
+        self._seq = 0
+        SHM_HEADER.pack_into(self._shm.buf, 0, 0, *self.shape)
+
+    def write(self, frame):
+        self._seq += 1
+        SHM_HEADER.pack_into(self._shm.buf, 0, self._seq, *self.shape)
+        self._pixels[...] = frame
+        self._seq += 1
+        SHM_HEADER.pack_into(self._shm.buf, 0, self._seq, *self.shape)
+
+    def close(self):
+        del self._pixels
+        self._shm.close()
+        self._shm.unlink()
+
+
+class SharedMemorySource:
+    """
+    Reads the newest frame from a SharedMemoryWriter segment; like the
+    grabber, each frame is handed out once.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._last = 0
+        self._pixels = None
+        try:
+            self._shm = _attach(name)
+        except FileNotFoundError:
+            logger.error("No shared-memory camera %r", name)
+            self._shm = None
+            return
+        shape = SHM_HEADER.unpack_from(self._shm.buf, 0)[1:]
+        self._pixels = np.ndarray(shape, np.uint8, self._shm.buf,
+                                  SHM_OFFSET)
+
+    def isOpened(self):
+        return self._shm is not None
+
+    def read(self):
+        seq = SHM_HEADER.unpack_from(self._shm.buf, 0)[0]
+        if seq == self._last or seq & 1:
+            return False, None
+        frame = self._pixels.copy()
+        if SHM_HEADER.unpack_from(self._shm.buf, 0)[0] != seq:
+            return False, None   # overwritten while copying
+        self._last = seq
+        return True, frame
+
+    def release(self):
+        if self._shm is not None:
+            self._pixels = None
+            self._shm.close()
+            self._shm = None
+
+
+# ================= CLI =================
+def probe(source, frames, timeout=10.0):
+    """Read `frames` frames and report what the source really delivers."""
+    started = time.perf_counter()
+    got, shape = 0, None
+    while got < frames and time.perf_counter() - started < timeout:
+        ok, frame = source.read()
+        if ok:
+            got += 1
+            shape = frame.shape
+        else:
+            time.sleep(0.001)
+    seconds = time.perf_counter() - started
+    return {"frames": got, "shape": shape, "seconds": round(seconds, 3),
+            "fps": round(got / seconds, 1) if seconds else None}
+
+
+def publish(source, name):
+    """Copy frames from `source` into shared memory until interrupted."""
+    writer = None
+    try:
+        while source.isOpened():
+            ok, frame = source.read()
+            if not ok:
+                time.sleep(0.002)
+                continue
+            if writer is None:
+                writer = SharedMemoryWriter(name, frame.shape)
+                print(f"publishing {frame.shape} as shm:{name}")
+            writer.write(frame)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Camera sources")
+    p.add_argument("command", choices=("probe", "publish"))
+    p.add_argument("source", help="device, path, URL, directory or shm:NAME")
+    p.add_argument("--pacing", choices=PACINGS, default="realtime")
+    p.add_argument("--frames", type=int, default=120)
+    p.add_argument("--shm", help="segment name to publish into")
+    args = p.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    source = open_source(args.source, config_from_env(os.environ),
+                         args.pacing)
+    if not source.isOpened():
+        p.exit(1, f"cannot open {args.source}\n")
+    try:
+        if args.command == "probe":
+            print(json.dumps(probe(source, args.frames), indent=2))
+        else:
+            if not args.shm:
+                p.error("publish needs --shm")
+            # Unlink the segment on a plain kill too, not only on Ctrl+C.
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            publish(source, args.shm)
+    finally:
+        source.release()
+
+
+if __name__ == "__main__":
+    main()
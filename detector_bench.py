@@ -0,0 +1,129 @@
+"""
+Latency and recall of the face detector backends on recorded clips.
+
+Every detector sees the same frames, decoded once up front. Clips are
+expected to show a customer facing the camera throughout, so recall is
+the share of frames with at least one face; with --reference, each
+backend is also scored on how many of the reference backend's boxes it
+finds (IoU >= 0.5).
+
+    python detector_bench.py --clips clips/ --reference dnn
+    python detector_bench.py --clips clips/ --detectors haar fast accurate
+"""
+
+import argparse
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+import face_detectors
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mkv", ".mov", ".webm")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+
+def load_frames(paths, max_frames):
+    """Decode up to `max_frames` frames per video, plus loose images."""
+    frames = []
+    for path in paths:
+        if os.path.isdir(path):
+            names = sorted(os.listdir(path))
+            frames += load_frames(
+                [os.path.join(path, n) for n in names
+                 if n.lower().endswith(VIDEO_EXTENSIONS + IMAGE_EXTENSIONS)],
+                max_frames)
+        elif path.lower().endswith(IMAGE_EXTENSIONS):
+            frame = cv2.imread(path)
+            if frame is not None:
+                frames.append(frame)
+        else:
+            cap = cv2.VideoCapture(path)
+            for _ in range(max_frames):
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                frames.append(frame)
+            cap.release()
+    return frames
+
+
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union else 0.0
+
+
+def run_detector(detector, frames, grays):
+    boxes, times = [], []
+    for frame, gray in zip(frames, grays):
+        start = time.perf_counter()
+        found = detector.detect(frame, gray)
+        times.append(time.perf_counter() - start)
+        boxes.append(found)
+    return boxes, np.asarray(times) * 1000.0
+
+
+def bench(specs, frames, reference=None):
+    grays = [cv2.cvtColor(f, cv2.COLOR_BGR2GRAY) for f in frames]
+    results, all_boxes = {}, {}
+    for spec in specs:
+        try:
+            detector, backend = face_detectors.create(spec)
+        except (ValueError, OSError) as e:
+            results[spec] = {"error": str(e)}
+            continue
+        boxes, ms = run_detector(detector, frames, grays)
+        all_boxes[spec] = boxes
+        results[spec] = {
+            "backend": backend,
+            "mean_ms": round(float(ms.mean()), 3),
+            "p50_ms": round(float(np.percentile(ms, 50)), 3),
+            "p95_ms": round(float(np.percentile(ms, 95)), 3),
+            "recall": round(sum(1 for b in boxes if b) / len(frames), 4),
+        }
+
+    if reference in all_boxes:
+        ref = all_boxes[reference]
+        total = sum(len(b) for b in ref)
+        for spec, boxes in all_boxes.items():
+            hit = sum(1 for got, want in zip(boxes, ref) for w in want
+                      if any(iou(g, w) >= 0.5 for g in got))
+            results[spec]["match_reference"] = (
+                round(hit / total, 4) if total else None)
+    return results
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--clips", nargs="+", required=True,
+                   help="video files, images or directories of them")
+    p.add_argument("--detectors", nargs="*",
+                   default=face_detectors.available() + list(
+                       face_detectors.MODES),
+                   help="backend names or modes (default: all available)")
+    p.add_argument("--reference",
+                   help="backend whose boxes count as ground truth")
+    p.add_argument("--max-frames", type=int, default=300,
+                   help="frames decoded per video")
+    p.add_argument("--report", help="also write the JSON report here")
+    args = p.parse_args()
+
+    frames = load_frames(args.clips, args.max_frames)
+    if not frames:
+        raise SystemExit("no frames decoded")
+    specs = list(dict.fromkeys(
+        args.detectors + ([args.reference] if args.reference else [])))
+    report = {"frames": len(frames),
+              "detectors": bench(specs, frames, args.reference)}
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            f.write(text)
@@ -0,0 +1,173 @@
+"""
+Face detector backends for the verification camera.
+
+Every backend takes the BGR frame plus its grey conversion and returns
+face boxes as ``(x, y, w, h)`` in frame pixels. Backends are chosen by
+name per terminal:
+
+* ``haar`` — the frontal-face Haar cascade the kiosk has always used;
+* ``haar_alt``, ``haar_alt2``, ``haar_alt_tree`` — the other frontal
+  cascades bundled with opencv-python (``cv2.data.haarcascades``);
+* ``dnn`` — OpenCV's ResNet-10 SSD face detector, when its Caffe model
+  files are present locally;
+* ``yunet`` — the YuNet ONNX detector via ``cv2.FaceDetectorYN``, when
+  its model file is present locally.
+
+Three modes map onto those by latency/accuracy trade-off: ``fast`` runs
+the Haar cascade on a half-resolution frame, ``balanced`` is plain
+``haar`` and ``accurate`` takes the first DNN backend whose model is
+available, falling back to ``haar_alt2``.
+"""
+
+import os
+
+import cv2
+import numpy as np
+
+CASCADES = {
+    "haar": "haarcascade_frontalface_default.xml",
+    "haar_alt": "haarcascade_frontalface_alt.xml",
+    "haar_alt2": "haarcascade_frontalface_alt2.xml",
+    "haar_alt_tree": "haarcascade_frontalface_alt_tree.xml",
+}
+
+DNN_PROTOTXT = "deploy.prototxt"
+DNN_MODEL = "res10_300x300_ssd_iter_140000.caffemodel"
+YUNET_MODEL = "face_detection_yunet_2023mar.onnx"
+
+BACKENDS = tuple(CASCADES) + ("dnn", "yunet")
+
+# mode: candidate (backend, options) in order of preference
+MODES = {
+    "fast": (("haar", {"downscale": 0.5}),),
+    "balanced": (("haar", {}),),
+    "accurate": (("dnn", {}), ("yunet", {}), ("haar_alt2", {})),
+}
+
+
+def _cascade_path(filename):
+    """Local copy first, then the one bundled with opencv-python."""
+    if os.path.exists(filename):
+        return filename
+    data = getattr(cv2, "data", None)
+    if data is not None:
+        path = os.path.join(data.haarcascades, filename)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+class HaarDetector:
+    """Cascade classifier, optionally run on a downscaled frame."""
+
+    def __init__(self, path, scale_factor=1.3, min_neighbors=5,
+                 downscale=1.0):
+        self.cascade = cv2.CascadeClassifier(path)
+        if self.cascade.empty():
+            raise ValueError(f"cannot load cascade: {path}")
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.downscale = downscale
+
+    def detect(self, frame, gray):
+        if self.downscale != 1.0:
+            small = cv2.resize(gray, None, fx=self.downscale,
+                               fy=self.downscale,
+                               interpolation=cv2.INTER_AREA)
+            boxes = self.cascade.detectMultiScale(
+                small, self.scale_factor, self.min_neighbors)
+            return [tuple(int(v / self.downscale) for v in b) for b in boxes]
+        boxes = self.cascade.detectMultiScale(
+            gray, self.scale_factor, self.min_neighbors)
+        return [tuple(int(v) for v in b) for b in boxes]
+
+
+class SsdDetector:
+    """ResNet-10 SSD face detector (OpenCV dnn, 300x300 input)."""
+
+    MEAN = (104.0, 177.0, 123.0)
+
+    def __init__(self, prototxt=DNN_PROTOTXT, model=DNN_MODEL,
+                 confidence=0.6):
+        self.net = cv2.dnn.readNetFromCaffe(prototxt, model)
+        self.confidence = confidence
+
+    def detect(self, frame, gray):
+        h, w = frame.shape[:2]
+        blob = cv2.dnn.blobFromImage(
+            cv2.resize(frame, (300, 300)), 1.0, (300, 300), self.MEAN)
+        self.net.setInput(blob)
+        out = self.net.forward()[0, 0]
+        keep = out[out[:, 2] >= self.confidence]
+        boxes = []
+        for x1, y1, x2, y2 in keep[:, 3:7] * np.array([w, h, w, h]):
+            x1, y1 = max(int(x1), 0), max(int(y1), 0)
+            x2, y2 = min(int(x2), w), min(int(y2), h)
+            if x2 > x1 and y2 > y1:
+                boxes.append((x1, y1, x2 - x1, y2 - y1))
+        return boxes
+
+
+class YuNetDetector:
+    """YuNet ONNX face detector through cv2.FaceDetectorYN."""
+
+    def __init__(self, model=YUNET_MODEL, confidence=0.7):
+        self.detector = cv2.FaceDetectorYN.create(
+            model, "", (320, 320), confidence)
+        self._size = None
+
+    def detect(self, frame, gray):
+        h, w = frame.shape[:2]
+        if self._size != (w, h):
+            self.detector.setInputSize((w, h))
+            self._size = (w, h)
+        _, faces = self.detector.detect(frame)
+        if faces is None:
+            return []
+        return [tuple(int(v) for v in f[:4]) for f in faces]
+
+
+def available():
+    """Backend names whose model files can be found from here."""
+    names = [name for name, filename in CASCADES.items()
+             if _cascade_path(filename)]
+    if os.path.exists(DNN_PROTOTXT) and os.path.exists(DNN_MODEL):
+        names.append("dnn")
+    if os.path.exists(YUNET_MODEL) and hasattr(cv2, "FaceDetectorYN"):
+        names.append("yunet")
+    return names
+
+
+def _build(backend, options, scale_factor, min_neighbors):
+    if backend in CASCADES:
+        path = _cascade_path(CASCADES[backend])
+        if path is None:
+            raise FileNotFoundError(CASCADES[backend])
+        return HaarDetector(path, scale_factor, min_neighbors, **options)
+    if backend == "dnn":
+        return SsdDetector(**options)
+    if backend == "yunet":
+        return YuNetDetector(**options)
+    raise ValueError(f"unknown face detector: {backend!r}")
+
+
+def create(spec="haar", scale_factor=1.3, min_neighbors=5):
+    """
+    Build the detector for a backend name or mode.
+
+    Returns ``(detector, backend name)``. A mode takes its first candidate
+    whose model files are available; an explicit backend name must be.
+    """
+    spec = spec.strip().lower()
+    if spec in MODES:
+        found = set(available())
+        for backend, options in MODES[spec]:
+            if backend in found:
+                return (_build(backend, options, scale_factor, min_neighbors),
+                        backend)
+        raise FileNotFoundError(f"no model available for mode {spec!r}")
+    if spec not in BACKENDS:
+        raise ValueError(f"unknown face detector: {spec!r}")
+    if spec not in available():
+        raise FileNotFoundError(f"model files missing for {spec!r}")
+    return _build(spec, {}, scale_factor, min_neighbors), spec
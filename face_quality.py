@@ -0,0 +1,154 @@
+"""
+Cheap face quality scoring for the verification camera.
+
+Every box the detector returns is scored before it may reach the age
+network. Boxes that are too small, clipped by the frame edge, badly
+proportioned, blurred or badly exposed are rejected with a reason the UI
+can turn into a hint; the rest get a weight in (0, 1] so that sharp,
+well-lit, frontal faces count for more in the verdict than marginal ones.
+
+The checks run cheapest first on a fixed-size grey patch, so a rejected
+box costs a resize and a Laplacian at most.
+"""
+
+import collections
+import os
+
+import cv2
+import numpy as np
+
+# Patch the sharpness / exposure / eye checks run on, independent of the
+# box size so thresholds mean the same thing near and far.
+PATCH_SIZE = 96
+
+MIN_FACE_PX = 80        # shorter box side below which the net guesses
+GOOD_FACE_PX = 160
+EDGE_MARGIN_PX = 2      # box this close to the border is clipped
+MIN_ASPECT = 0.75
+MAX_ASPECT = 1.33
+MIN_SHARPNESS = 40.0    # Laplacian variance on the patch
+GOOD_SHARPNESS = 200.0
+MIN_BRIGHTNESS = 50.0
+MAX_BRIGHTNESS = 210.0
+MIN_CONTRAST = 20.0     # grey-level standard deviation
+GOOD_CONTRAST = 45.0
+NO_EYES_WEIGHT = 0.4    # a frontal box where no eye is found
+EYE_MIN_PX = 14         # eye search window on the patch; a coarse scale
+EYE_MAX_PX = 36         # step keeps this well under one age inference
+
+REASONS = ("small", "edge", "aspect", "blur", "dark", "bright", "flat")
+
+FaceQuality = collections.namedtuple(
+    "FaceQuality", "score reason sharpness brightness contrast eyes")
+
+
+def default_eye_cascade():
+    """Path of the eye cascade bundled with opencv-python, if any."""
+    data = getattr(cv2, "data", None)
+    if data is None:
+        return None
+    path = os.path.join(data.haarcascades, "haarcascade_eye.xml")
+    return path if os.path.exists(path) else None
+
+
+def _ramp(value, lo, hi, floor=0.2):
+    """Map `lo`..`hi` onto `floor`..1, clamped."""
+    t = (value - lo) / (hi - lo)
+    return floor + (1.0 - floor) * min(max(t, 0.0), 1.0)
+
+
+def _rejected(reason, sharpness=0.0, brightness=0.0, contrast=0.0):
+    return FaceQuality(0.0, reason, sharpness, brightness, contrast, None)
+
+
+class FaceQualityScorer:
+    """Scores detector boxes; holds the optional eye cascade."""
+
+    def __init__(self, eye_cascade_path=None):
+        self.eye_cascade = None
+        if eye_cascade_path:
+            cascade = cv2.CascadeClassifier(eye_cascade_path)
+            if not cascade.empty():
+                self.eye_cascade = cascade
+
+    def score(self, gray, box):
+        """Return a FaceQuality for `box` (x, y, w, h) in the grey frame."""
+        x, y, w, h = (int(v) for v in box)
+        frame_h, frame_w = gray.shape[:2]
+
+        if min(w, h) < MIN_FACE_PX:
+            return _rejected("small")
+        if (x < EDGE_MARGIN_PX or y < EDGE_MARGIN_PX
+                or x + w > frame_w - EDGE_MARGIN_PX
+                or y + h > frame_h - EDGE_MARGIN_PX):
+            return _rejected("edge")
+        if not MIN_ASPECT <= w / h <= MAX_ASPECT:
+            return _rejected("aspect")
+
+        patch = cv2.resize(gray[y:y + h, x:x + w], (PATCH_SIZE, PATCH_SIZE),
+                           interpolation=cv2.INTER_AREA)
+        sharpness = float(cv2.Laplacian(patch, cv2.CV_64F).var())
+        if sharpness < MIN_SHARPNESS:
+            return _rejected("blur", sharpness)
+
+        mean, std = cv2.meanStdDev(patch)
+        brightness, contrast = float(mean[0, 0]), float(std[0, 0])
+        if brightness < MIN_BRIGHTNESS:
+            return _rejected("dark", sharpness, brightness, contrast)
+        if brightness > MAX_BRIGHTNESS:
+            return _rejected("bright", sharpness, brightness, contrast)
+        if contrast < MIN_CONTRAST:
+            return _rejected("flat", sharpness, brightness, contrast)
+
+        score = (_ramp(min(w, h), MIN_FACE_PX, GOOD_FACE_PX)
+                 * _ramp(sharpness, MIN_SHARPNESS, GOOD_SHARPNESS)
+                 * _ramp(contrast, MIN_CONTRAST, GOOD_CONTRAST))
+
+        eyes = None
+        if self.eye_cascade is not None:
+            upper = patch[:PATCH_SIZE * 3 // 5]
+            eyes = len(self.eye_cascade.detectMultiScale(
+                upper, 1.2, 3, minSize=(EYE_MIN_PX, EYE_MIN_PX),
+                maxSize=(EYE_MAX_PX, EYE_MAX_PX)))
+            if not eyes:
+                score *= NO_EYES_WEIGHT
+
+        return FaceQuality(score, None, sharpness, brightness, contrast, eyes)
+
+
+class VerdictAccumulator:
+    """
+    Quality-weighted average of the age network's class probabilities.
+
+    A verdict is only offered once `min_weight` worth of accepted faces
+    has been seen: two or three good frames, or more marginal ones.
+    """
+
+    def __init__(self, classes, min_weight=2.0):
+        self.min_weight = min_weight
+        self._sum = np.zeros(classes, np.float64)
+        self.weight = 0.0
+        self.frames = 0
+
+    def reset(self):
+        self._sum[:] = 0.0
+        self.weight = 0.0
+        self.frames = 0
+
+    def add(self, probs, weight):
+        self._sum += np.asarray(probs, np.float64).ravel() * weight
+        self.weight += weight
+        self.frames += 1
+
+    @property
+    def ready(self):
+        return self.weight >= self.min_weight
+
+    @property
+    def progress(self):
+        return min(self.weight / self.min_weight, 1.0)
+
+    def best(self):
+        """(class index, weighted mean probability) of the leading class."""
+        idx = int(self._sum.argmax())
+        return idx, float(self._sum[idx] / self.weight)
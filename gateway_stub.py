@@ -0,0 +1,197 @@
+"""
+Stand-in for the card payment gateway, for exercising payment_gateway.
+
+Approves authorisations with a random six-digit code, replays the stored
+answer for a repeated Idempotency-Key and accepts voids. It can misbehave
+on purpose: added latency, random 503s (with Retry-After), decisions
+whose response is lost (the connection drops after the authorisation is
+stored), declines at random or above a card limit, and periods of being
+down.
+
+    python gateway_stub.py --port 8766 --latency-ms 800 --fail-rate 0.2
+    POS_GATEWAY_URL=http://127.0.0.1:8766 python main.py
+
+GET /stats returns what has been received so far.
+"""
+
+import argparse
+import json
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class GatewayState:
+    def __init__(self, fail_rate=0.0, drop_rate=0.0, latency_ms=0,
+                 decline_rate=0.0, decline_over=None, seed=None):
+        self.fail_rate = fail_rate
+        self.drop_rate = drop_rate
+        self.latency_ms = latency_ms
+        self.decline_rate = decline_rate
+        self.decline_over = decline_over
+        self.down_until = 0.0
+        self.rng = random.Random(seed)
+        self.answers = {}   # Idempotency-Key -> (status, payload)
+        self.voided = set()
+        self.requests = 0
+        self.replayed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    def stats(self):
+        with self.lock:
+            decisions = [p["status"] for s, p in self.answers.values()]
+            return {"requests": self.requests,
+                    "approved": decisions.count("approved"),
+                    "declined": decisions.count("declined"),
+                    "voided": len(self.voided), "replayed": self.replayed,
+                    "failed": self.failed, "dropped": self.dropped,
+                    "connections": self.connections}
+
+    def decide(self, request):
+        amount = request.get("amount")
+        if not isinstance(amount, int) or amount <= 0:
+            return 400, {"status": "declined", "reason": "bad_amount"}
+        if self.decline_over is not None and amount > self.decline_over:
+            return 402, {"status": "declined", "reason": "limit"}
+        if self.rng.random() < self.decline_rate:
+            return 402, {"status": "declined", "reason": "card_declined"}
+        return 200, {"status": "approved",
+                     "auth_code": f"{self.rng.randrange(10**6):06d}"}
+
+
+class GatewayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive
+    state = None
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out as separate writes; without this the
+        # client's delayed ACK adds ~40 ms to every keep-alive reply.
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.state.lock:
+            self.state.connections += 1
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._reply(200, {"ok": True})
+        elif self.path == "/stats":
+            self._reply(200, self.state.stats())
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        state = self.state
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if state.latency_ms:
+            time.sleep(state.latency_ms / 1000.0)
+        key = self.headers.get("Idempotency-Key")
+        with state.lock:
+            state.requests += 1
+            roll = state.rng.random()
+            down = time.time() < state.down_until
+        if down:
+            self._drop()
+            return
+        if roll < state.fail_rate:
+            with state.lock:
+                state.failed += 1
+            self._reply(503, {"error": "unavailable"}, {"Retry-After": "1"})
+            return
+        try:
+            request = json.loads(body)
+        except ValueError:
+            self._reply(400, {"error": "bad request"})
+            return
+        if self.path == "/authorize":
+            self._authorize(key, request, roll)
+        elif self.path == "/void":
+            self._void(request)
+        else:
+            self.send_error(404)
+
+    def _authorize(self, key, request, roll):
+        state = self.state
+        if not key:
+            self._reply(400, {"error": "Idempotency-Key required"})
+            return
+        with state.lock:
+            answer = state.answers.get(key)
+            if answer is None:
+                answer = state.answers[key] = state.decide(request)
+            else:
+                state.replayed += 1
+        if roll < state.fail_rate + state.drop_rate:
+            self._drop()   # decided, but the answer never arrives
+            return
+        self._reply(*answer)
+
+    def _void(self, request):
+        state = self.state
+        auth_key = f"auth:{request.get('checkout_id')}"
+        with state.lock:
+            answer = state.answers.get(auth_key)
+            if answer is not None and answer[1]["status"] == "approved":
+                state.voided.add(auth_key)
+        if answer is None:
+            self._reply(404, {"error": "unknown authorisation"})
+        else:
+            self._reply(200, {"voided": True})
+
+    def _drop(self):
+        with self.state.lock:
+            self.state.dropped += 1
+        self.close_connection = True
+        self.connection.close()
+
+    def _reply(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def serve(port=0, host="127.0.0.1", state=None):
+    """Start the stub on a daemon thread; returns (server, state)."""
+    state = state or GatewayState()
+    handler = type("Handler", (GatewayHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="gateway-stub",
+                     daemon=True).start()
+    return server, state
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--port", type=int, default=8766)
+    p.add_argument("--fail-rate", type=float, default=0.0,
+                   help="share of requests answered with 503")
+    p.add_argument("--drop-rate", type=float, default=0.0,
+                   help="share of authorisations whose answer is lost")
+    p.add_argument("--decline-rate", type=float, default=0.0)
+    p.add_argument("--decline-over", type=int, default=None,
+                   help="decline amounts above this many yen")
+    p.add_argument("--latency-ms", type=int, default=0)
+    args = p.parse_args()
+    server, state = serve(args.port, state=GatewayState(
+        args.fail_rate, args.drop_rate, args.latency_ms, args.decline_rate,
+        args.decline_over))
+    print(f"listening on 127.0.0.1:{server.server_address[1]}")
+    try:
+        while True:
+            time.sleep(10)
+            print(json.dumps(state.stats()))
+    except KeyboardInterrupt:
+        server.shutdown()
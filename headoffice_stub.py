@@ -0,0 +1,144 @@
+"""
+Stand-in for the head-office ingest service, for exercising the outbox.
+
+Accepts gzip JSON batches on POST, de-duplicates records by their
+idempotency key and can misbehave on purpose: added latency, random 503s
+(with Retry-After), dropped connections and periods of being down.
+
+    python headoffice_stub.py --port 8765 --fail-rate 0.2 --latency-ms 50
+    POS_OUTBOX_URL=http://127.0.0.1:8765/ingest python main.py
+
+GET /stats returns what has been received so far.
+"""
+
+import argparse
+import gzip
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class IngestState:
+    def __init__(self, fail_rate=0.0, drop_rate=0.0, latency_ms=0,
+                 seed=None):
+        self.fail_rate = fail_rate
+        self.drop_rate = drop_rate
+        self.latency_ms = latency_ms
+        self.down_until = 0.0
+        self.rng = random.Random(seed)
+        self.keys = set()
+        self.batches = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.dropped = 0
+        self.bytes = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    def stats(self):
+        with self.lock:
+            return {"records": len(self.keys), "batches": self.batches,
+                    "duplicates": self.duplicates, "failed": self.failed,
+                    "dropped": self.dropped, "bytes": self.bytes,
+                    "connections": self.connections}
+
+
+class IngestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive
+    state = None
+
+    def setup(self):
+        super().setup()
+        with self.state.lock:
+            self.state.connections += 1
+
+    def do_GET(self):
+        if self.path != "/stats":
+            self.send_error(404)
+            return
+        self._reply(200, self.state.stats())
+
+    def do_POST(self):
+        state = self.state
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if state.latency_ms:
+            time.sleep(state.latency_ms / 1000.0)
+        with state.lock:
+            roll = state.rng.random()
+            down = time.time() < state.down_until
+        if down or roll < state.drop_rate:
+            with state.lock:
+                state.dropped += 1
+            self.close_connection = True
+            self.connection.close()
+            return
+        if roll < state.drop_rate + state.fail_rate:
+            with state.lock:
+                state.failed += 1
+            self._reply(503, {"error": "unavailable"}, {"Retry-After": "1"})
+            return
+        try:
+            if self.headers.get("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            batch = json.loads(body)
+        except (OSError, ValueError):
+            self._reply(400, {"error": "bad batch"})
+            return
+        new = dup = 0
+        with state.lock:
+            state.batches += 1
+            state.bytes += len(body)
+            for record in batch.get("records", ()):
+                if record["key"] in state.keys:
+                    dup += 1
+                else:
+                    state.keys.add(record["key"])
+                    new += 1
+            state.duplicates += dup
+        self._reply(200, {"accepted": new, "duplicates": dup})
+
+    def _reply(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def serve(port=0, host="127.0.0.1", state=None):
+    """Start the stub on a daemon thread; returns (server, state)."""
+    state = state or IngestState()
+    handler = type("Handler", (IngestHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="headoffice-stub",
+                     daemon=True).start()
+    return server, state
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--fail-rate", type=float, default=0.0,
+                   help="share of batches answered with 503")
+    p.add_argument("--drop-rate", type=float, default=0.0,
+                   help="share of batches whose connection is dropped")
+    p.add_argument("--latency-ms", type=int, default=0)
+    args = p.parse_args()
+    server, state = serve(args.port, state=IngestState(
+        args.fail_rate, args.drop_rate, args.latency_ms))
+    print(f"listening on 127.0.0.1:{server.server_address[1]}")
+    try:
+        while True:
+            time.sleep(10)
+            print(json.dumps(state.stats()))
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,347 @@
+"""
+Stock levels, decremented by completed sales.
+
+The GUI thread owns the live levels: sell() adjusts them at once and
+reports products crossing into "low" (at or below their threshold) or
+"out" (nothing left), checking only the products in that sale. The store
+database is brought up to date in batches by a background thread, which
+adds up the changes of many sales and writes one UPDATE per product per
+batch instead of one per line sold.
+
+Crash consistency comes from a journal of completed sales. Before
+sell() returns, the sale is appended to the journal file with a sequence
+number (a single unbuffered write, so it survives the process dying).
+Every batch stores the highest sequence number it covers in the same
+transaction as the stock changes. On start-up, journal entries past that
+number are replayed, so each sale is applied exactly once however the
+previous run ended. The writer fsyncs the journal before each batch,
+which bounds what a power cut can lose to one flush interval. Once every
+entry is applied and the journal is over its size limit, it is emptied.
+
+    python inventory.py report --db store.db --low
+"""
+
+import argparse
+import collections
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger("pos.inventory")
+
+LEVELS = ("ok", "low", "out")
+
+FLUSH_SECONDS = metrics.histogram(
+    "pos_inventory_flush_seconds", "One batched stock update")
+SALES_APPLIED = metrics.counter(
+    "pos_inventory_sales_applied_total",
+    "Journalled stock changes written to the store database")
+PENDING = metrics.gauge(
+    "pos_inventory_pending", "Stock changes journalled but not yet written")
+JOURNAL_ERRORS = metrics.counter(
+    "pos_inventory_journal_errors_total",
+    "Stock changes that could not be journalled (not crash-safe)")
+LOW_STOCK = metrics.gauge(
+    "pos_inventory_low_products", "Products at or below their threshold")
+ALERTS = {
+    level: metrics.counter(
+        "pos_inventory_alerts_total", "Products crossing into a stock level",
+        {"level": level})
+    for level in LEVELS
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stock (
+    sku        TEXT PRIMARY KEY,
+    qty        INTEGER NOT NULL,
+    threshold  INTEGER NOT NULL,
+    updated    REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS journal_state (
+    id         INTEGER PRIMARY KEY CHECK (id = 0),
+    applied    INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO journal_state VALUES (0, 0);
+"""
+
+# sku, quantity on hand, alert threshold, level (one of LEVELS)
+StockLevel = collections.namedtuple("StockLevel", "sku qty threshold level")
+
+
+def level(qty, threshold):
+    if qty <= 0:
+        return "out"
+    return "low" if qty <= threshold else "ok"
+
+
+def connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def read_journal(path, after=0):
+    """Entries with a sequence number above `after`, in order."""
+    entries = []
+    try:
+        with open(path, encoding="utf-8") as f:
+            for n, line in enumerate(f, 1):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A write torn by a crash can only be the last line.
+                    logger.warning("Journal line %d unreadable; skipped", n,
+                                   extra={"path": path})
+                    continue
+                if entry["seq"] > after:
+                    entries.append(entry)
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def apply_changes(conn, changes, seq):
+    """Add per-sku deltas and mark the journal applied up to `seq`."""
+    now = time.time()
+    conn.executemany(
+        "UPDATE stock SET qty = qty + ?, updated = ? WHERE sku = ?",
+        [(delta, now, sku) for sku, delta in changes.items() if delta])
+    conn.execute("UPDATE journal_state SET applied = ? WHERE id = 0", (seq,))
+
+
+class Inventory:
+    """
+    Live stock levels plus journal and writer thread. sell() and
+    receive() belong to the GUI thread.
+
+    `on_alert(sku, qty, level)` is called when a product changes level.
+    Products missing from the database are added with `initial` units
+    and the given alert threshold.
+    """
+
+    def __init__(self, path, journal_path, skus, initial=100, threshold=10,
+                 on_alert=None, batch_size=50, flush_seconds=5.0,
+                 journal_max_bytes=1 << 20):
+        self.path = path
+        self.journal_path = journal_path
+        self.skus = list(skus)
+        self.initial = initial
+        self.threshold = threshold
+        self.on_alert = on_alert
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.journal_max_bytes = journal_max_bytes
+        self.levels = {}    # sku -> StockLevel
+        self._low = set()
+        self._seq = 0       # last journalled
+        self._applied = 0   # last written to the database
+        self._fd = None
+        self._lock = threading.Lock()   # journal appends vs truncation
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+
+    def start(self):
+        """
+        Recover from the journal, load levels and start the writer.
+        Raises OSError or sqlite3.Error when the store cannot be used.
+        """
+        conn = connect(self.path)
+        try:
+            self._recover(conn)
+        except BaseException:
+            conn.close()
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            raise
+        self._thread = threading.Thread(
+            target=self._run, args=(conn,), name="inventory-writer",
+            daemon=True)
+        self._thread.start()
+
+    def _recover(self, conn):
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO stock VALUES (?, ?, ?, ?)",
+                [(sku, self.initial, self.threshold, time.time())
+                 for sku in self.skus])
+        applied = conn.execute(
+            "SELECT applied FROM journal_state").fetchone()[0]
+        entries = read_journal(self.journal_path, applied)
+        if entries:
+            changes = collections.Counter()
+            for entry in entries:
+                changes.update(entry["delta"])
+            with conn:
+                apply_changes(conn, changes, entries[-1]["seq"])
+            applied = entries[-1]["seq"]
+            logger.warning("Replayed %d journalled stock changes",
+                           len(entries), extra={"entries": len(entries)})
+        self._seq = self._applied = applied
+        for sku, qty, threshold in conn.execute(
+                "SELECT sku, qty, threshold FROM stock"):
+            self.levels[sku] = StockLevel(sku, qty, threshold,
+                                          level(qty, threshold))
+        self._low = {s for s, lv in self.levels.items() if lv.level != "ok"}
+        LOW_STOCK.set(len(self._low))
+
+        # Everything is in the database now; start the journal afresh.
+        self._fd = os.open(self.journal_path,
+                           os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        os.ftruncate(self._fd, 0)
+
+    def close(self, timeout=5.0):
+        """Write what is pending and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+        os.close(self._fd)
+        self._fd = None
+
+    def low(self):
+        """Products currently low or out, least stock first."""
+        return sorted((self.levels[s] for s in self._low),
+                      key=lambda lv: lv.qty)
+
+    def sell(self, ref, items):
+        """Record a completed sale; `items` maps sku -> units sold."""
+        self._change(ref, {sku: -n for sku, n in items.items()})
+
+    def receive(self, ref, items):
+        """Record a delivery; `items` maps sku -> units received."""
+        self._change(ref, dict(items))
+
+    def _change(self, ref, delta):
+        if self._thread is None:
+            return
+        delta = {sku: n for sku, n in delta.items()
+                 if n and sku in self.levels}
+        if not delta:
+            return
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            try:
+                os.write(self._fd, (json.dumps(
+                    {"seq": seq, "ts": time.time(), "ref": ref,
+                     "delta": delta}, ensure_ascii=False) + "\n"
+                ).encode("utf-8"))
+            except OSError:
+                # Never fail the sale over stock: the change still goes to
+                # the database with the next batch, it just would not
+                # survive a crash before then.
+                JOURNAL_ERRORS.inc()
+                logger.exception("Stock change for %s not journalled", ref,
+                                 extra={"ref": ref})
+        self._queue.put((seq, delta))
+        PENDING.set(seq - self._applied)
+        for sku, n in delta.items():
+            self._adjust(sku, n)
+
+    def _adjust(self, sku, n):
+        old = self.levels[sku]
+        qty = old.qty + n
+        new = old._replace(qty=qty, level=level(qty, old.threshold))
+        self.levels[sku] = new
+        if new.level == old.level:
+            return
+        if new.level == "ok":
+            self._low.discard(sku)
+        else:
+            self._low.add(sku)
+        LOW_STOCK.set(len(self._low))
+        ALERTS[new.level].inc()
+        if new.level != "ok":
+            logger.warning("Stock %s: %s (%d left)", new.level, sku, qty,
+                           extra={"sku": sku, "qty": qty,
+                                  "stock_level": new.level})
+        if self.on_alert is not None:
+            self.on_alert(sku, qty, new.level)
+
+    # ── writer thread ──
+    def _run(self, conn):
+        changes = collections.Counter()
+        count = last = 0
+        oldest = None
+        running = True
+        while running:
+            timeout = None if oldest is None else max(
+                0.0, oldest + self.flush_seconds - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+                while item is not None:
+                    seq, delta = item
+                    changes.update(delta)
+                    count, last = count + 1, seq
+                    if oldest is None:
+                        oldest = time.monotonic()
+                    if count >= self.batch_size:
+                        break
+                    item = self._queue.get_nowait()
+                running = item is not None
+            except queue.Empty:
+                pass
+            due = (count >= self.batch_size or not running or
+                   oldest is not None
+                   and time.monotonic() - oldest >= self.flush_seconds)
+            if count and due:
+                if self._flush(conn, changes, last, count):
+                    changes.clear()
+                    count, oldest = 0, None
+                else:
+                    oldest = time.monotonic()   # try again next interval
+        conn.close()
+
+    def _flush(self, conn, changes, seq, count):
+        try:
+            os.fsync(self._fd)
+            with FLUSH_SECONDS.time(), conn:
+                apply_changes(conn, changes, seq)
+        except (OSError, sqlite3.Error):
+            logger.exception("Stock update failed; %d changes kept in the "
+                             "journal", count)
+            return False
+        SALES_APPLIED.inc(count)
+        self._applied = seq
+        with self._lock:
+            PENDING.set(self._seq - seq)
+            # Nothing newer has been journalled: every entry is applied.
+            if self._seq == seq and \
+                    os.fstat(self._fd).st_size > self.journal_max_bytes:
+                os.ftruncate(self._fd, 0)
+        return True
+
+
+# ================= CLI =================
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Report stock levels")
+    p.add_argument("command", choices=("report",))
+    p.add_argument("--db", default=os.environ.get("POS_INVENTORY_DB",
+                                                  "store.db"))
+    p.add_argument("--low", action="store_true",
+                   help="only products at or below their threshold")
+    args = p.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    rows = [StockLevel(sku, qty, threshold, level(qty, threshold))
+            for sku, qty, threshold in conn.execute(
+                "SELECT sku, qty, threshold FROM stock ORDER BY qty")]
+    if args.low:
+        rows = [r for r in rows if r.level != "ok"]
+    applied = conn.execute("SELECT applied FROM journal_state").fetchone()[0]
+    print(json.dumps({"applied_seq": applied,
+                      "stock": [r._asdict() for r in rows]},
+                     indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+"""
+Headless end-to-end checkout driver.
+
+Runs MyMart on Qt's offscreen platform and scripts checkout sessions the
+way a customer would: pick products, press pay, face the camera (recorded
+clips fed through the normal camera path), tap an NFC card and dismiss
+the result. Reports checkout latency, dialog open/close times and memory
+growth.
+
+    python loadtest.py --sessions 2000 --clips clips/ \\
+        --cards NFC-001-TANAKA,NFC-003-SATO --report load.json
+
+As a soak test it samples RSS, live Python objects and Qt objects every
+--memory-every sessions, measures growth from the sample taken after
+--warmup sessions and exits non-zero past --max-growth-mb:
+
+    python loadtest.py --sessions 20000 --warmup 200 --max-growth-mb 20
+
+--gateway-stub authorises every payment against a local gateway_stub,
+optionally slow or failing, and --cancel-ratio has some customers cancel
+while authorisation is in flight:
+
+    python loadtest.py --gateway-stub --gateway-latency-ms 800 \\
+        --gateway-fail-rate 0.1 --cancel-ratio 0.05
+"""
+
+import os
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import argparse
+import collections
+import gc
+import json
+import random
+import resource
+import sys
+import time
+
+import numpy as np
+
+from PyQt6.QtCore import QEvent, QObject, QTimer
+from PyQt6.QtWidgets import QApplication, QDialog, QMessageBox
+
+import capture
+import gateway_stub
+import main
+import metrics
+from pos_logging import setup_logging
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mkv", ".mov", ".webm")
+
+
+def rss_bytes():
+    """Current resident set size (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+MemorySample = collections.namedtuple(
+    "MemorySample", "sessions rss py_objects qt_objects widgets")
+
+
+def sample_memory(sessions, root):
+    """
+    RSS plus live object counts after a full collection. Qt objects are
+    everything parented under `root` and every widget the app knows of,
+    which catches dialogs, timers and pixmaps held by labels alike.
+    Returns the sample and the per-type Python object counts.
+    """
+    gc.collect()
+    objects = gc.get_objects()
+    types = collections.Counter(type(o).__name__ for o in objects)
+    sample = MemorySample(sessions, rss_bytes(), len(objects),
+                          len(root.findChildren(QObject)),
+                          len(QApplication.allWidgets()))
+    del objects
+    return sample, types
+
+
+def find_clips(paths):
+    """
+    Source specs for capture.open_source: video files (directories of
+    them are expanded), image-sequence directories, streams or shm:NAME.
+    """
+    clips = []
+    for path in paths:
+        videos = []
+        if os.path.isdir(path):
+            videos = sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.lower().endswith(VIDEO_EXTENSIONS))
+        clips += videos or [path]
+    return clips
+
+
+class BlankCapture:
+    """Faceless frames, for exercising the flow without any clips."""
+
+    def __init__(self, width=640, height=480):
+        self._frame = np.full((height, width, 3), 40, np.uint8)
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        return True, self._frame.copy()
+
+    def release(self):
+        pass
+
+
+def summarize(values):
+    if not values:
+        return {"n": 0}
+    arr = np.asarray(values) * 1000.0
+    return {
+        "n": int(arr.size),
+        "mean_ms": round(float(arr.mean()), 2),
+        "p50_ms": round(float(np.percentile(arr, 50)), 2),
+        "p90_ms": round(float(np.percentile(arr, 90)), 2),
+        "p99_ms": round(float(np.percentile(arr, 99)), 2),
+        "max_ms": round(float(arr.max()), 2),
+    }
+
+
+class CheckoutDriver(QObject):
+    """Plays the customer; polls visible dialogs and answers them."""
+
+    def __init__(self, win, args):
+        super().__init__()
+        self.win = win
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.clips = find_clips(args.clips)
+        self.cards = [c.strip() for c in args.cards.split(",") if c.strip()]
+
+        self.done = 0
+        self.outcomes = {}
+        self.checkout_times = []
+        self.dialog_open = {}
+        self.dialog_close = {}
+        self.memory = []
+        self._baseline_types = None
+        self._types = None
+
+        self._session_start = 0.0
+        self._last_action = 0.0
+        self._dialog_seen = {}
+        self._card_sent = set()
+        self._cancel_payment = False
+
+        win.camera_factory = self._open_camera
+        win.checkout_finished.connect(self._on_finished)
+        QApplication.instance().installEventFilter(self)
+
+        self.poll = QTimer(self)
+        self.poll.timeout.connect(self._answer_dialogs)
+
+    # ── session loop ──
+    def start(self):
+        self._sample()
+        self._started = time.perf_counter()
+        self.poll.start(self.args.poll_ms)
+        QTimer.singleShot(0, self._next_session)
+
+    def _next_session(self):
+        if self.done >= self.args.sessions:
+            self._finish()
+            return
+        win = self.win
+        win._empty_cart()
+        rows = win.product_list.count()
+        restricted = self.rng.random() < self.args.restricted_ratio
+        for _ in range(self.rng.randint(1, self.args.max_items)):
+            row = self.rng.randrange(rows)
+            win.product_list.setCurrentRow(row)
+            if (not restricted and win.product_list.currentItem().data(
+                    main.Qt.ItemDataRole.UserRole) in main.AGE_RESTRICTED):
+                continue
+            win._add_item()
+        if restricted:
+            win.product_list.setCurrentRow(0)
+            win._add_item()
+        if not win.cart:
+            win.product_list.setCurrentRow(rows - 1)
+            win._add_item()
+
+        self._dialog_seen.clear()
+        self._card_sent.clear()
+        self._cancel_payment = self.rng.random() < self.args.cancel_ratio
+        QTimer.singleShot(self.args.browse_ms, self._pay)
+
+    def _pay(self):
+        self._session_start = self._last_action = time.perf_counter()
+        # The payment flow opens its dialogs and returns; the poll timer
+        # answers them until checkout_finished arrives.
+        self.win._process_payment()
+
+    def _on_finished(self, outcome):
+        self.checkout_times.append(time.perf_counter() - self._session_start)
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        self.done += 1
+        if self.done == self.args.warmup or \
+                self.done % self.args.memory_every == 0:
+            self._sample()
+        if self.done % 100 == 0:
+            print(f"{self.done}/{self.args.sessions} sessions",
+                  file=sys.stderr)
+        QTimer.singleShot(0, self._next_session)
+
+    def _finish(self):
+        self.poll.stop()
+        if self.memory[-1].sessions != self.done:
+            self._sample()
+        QApplication.instance().quit()
+
+    def _sample(self):
+        sample, self._types = sample_memory(self.done, self.win)
+        self.memory.append(sample)
+        if self.done == min(self.args.warmup, self.args.sessions):
+            self._baseline_types = self._types
+
+    # ── customer behaviour ──
+    def _open_camera(self):
+        if self.clips:
+            return capture.open_source(self.rng.choice(self.clips),
+                                       pacing=self.args.pacing)
+        return BlankCapture()
+
+    def _act(self, fn):
+        self._last_action = time.perf_counter()
+        fn()
+
+    def _answer_dialogs(self):
+        now = time.perf_counter()
+        for widget in QApplication.topLevelWidgets():
+            if not widget.isVisible():
+                continue
+            if isinstance(widget, QMessageBox):
+                self._act(lambda: widget.done(0))
+            elif isinstance(widget, main.CameraVerificationDialog):
+                opened = self._dialog_seen.get(widget, now)
+                if widget.confirm_btn.isEnabled():
+                    self._act(widget.confirm_btn.click)
+                elif now - opened > self.args.camera_timeout:
+                    self._act(widget.reject)
+            elif isinstance(widget, main.NFCScanDialog):
+                self._answer_nfc(widget)
+            elif isinstance(widget, main.PaymentProgressDialog):
+                # Waits out the gateway unless this customer gives up.
+                if widget.failed or self._cancel_payment:
+                    self._act(widget.reject)
+            elif isinstance(widget, (main.UnderageAlertDialog,
+                                     main.PaymentSuccessDialog)):
+                self._act(widget.accept)
+
+    def _answer_nfc(self, dialog):
+        if dialog.proceed_btn.isVisible():
+            self._act(dialog.proceed_btn.click)
+        elif dialog not in self._card_sent:
+            # While the camera is still estimating the customer only gets
+            # their card out after a while.
+            waited = time.perf_counter() - self._dialog_seen.get(
+                dialog, time.perf_counter())
+            if self.win.flow.camera is not None and \
+                    waited < self.args.tap_after:
+                return
+            self._card_sent.add(dialog)
+            card = self.rng.choice(self.cards) if self.cards else ""
+            dialog.nfc_input.setText(card)
+            self._act(dialog.scan_btn.click)
+        elif dialog.result_frame.isVisible() and dialog.scan_btn.isEnabled():
+            # Unknown or underage card: the customer walks away.
+            self._act(dialog.reject)
+
+    # ── dialog timing ──
+    def eventFilter(self, obj, event):
+        kind = event.type()
+        if kind in (QEvent.Type.Show, QEvent.Type.Hide) and \
+                isinstance(obj, QDialog):
+            elapsed = time.perf_counter() - self._last_action
+            name = type(obj).__name__
+            if kind == QEvent.Type.Show:
+                self._dialog_seen[obj] = time.perf_counter()
+                self.dialog_open.setdefault(name, []).append(elapsed)
+            else:
+                self.dialog_close.setdefault(name, []).append(elapsed)
+        return False
+
+    # ── report ──
+    def memory_report(self):
+        """Growth from the post-warmup sample to the last one."""
+        base = next(m for m in self.memory
+                    if m.sessions >= min(self.args.warmup, self.done))
+        end = self.memory[-1]
+        growth_mb = (end.rss - base.rss) / 2**20
+        grown = (self._types - self._baseline_types
+                 if self._baseline_types else collections.Counter())
+        return {
+            "baseline_sessions": base.sessions,
+            "rss_start_mb": round(self.memory[0].rss / 2**20, 1),
+            "rss_baseline_mb": round(base.rss / 2**20, 1),
+            "rss_end_mb": round(end.rss / 2**20, 1),
+            "rss_growth_mb": round(growth_mb, 1),
+            "py_objects_growth": end.py_objects - base.py_objects,
+            "qt_objects_growth": end.qt_objects - base.qt_objects,
+            "widgets_growth": end.widgets - base.widgets,
+            "kb_per_1000_sessions": (
+                round(growth_mb * 1024 * 1000 / (end.sessions - base.sessions),
+                      1) if end.sessions > base.sessions else 0.0),
+            "growing_types": grown.most_common(10),
+            "max_growth_mb": self.args.max_growth_mb,
+            "passed": (self.args.max_growth_mb is None
+                       or growth_mb <= self.args.max_growth_mb),
+            "samples": [(m.sessions, round(m.rss / 2**20, 1), m.py_objects,
+                         m.qt_objects, m.widgets) for m in self.memory],
+        }
+
+    def report(self):
+        wall = time.perf_counter() - self._started
+        return {
+            "sessions": self.done,
+            "wall_s": round(wall, 2),
+            "sessions_per_s": round(self.done / wall, 2) if wall else 0.0,
+            "outcomes": self.outcomes,
+            "checkout": summarize(self.checkout_times),
+            "dialog_open": {k: summarize(v)
+                            for k, v in sorted(self.dialog_open.items())},
+            "dialog_close": {k: summarize(v)
+                             for k, v in sorted(self.dialog_close.items())},
+            "memory": self.memory_report(),
+            "metrics": metrics.REGISTRY.summary_lines(),
+        }
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--sessions", type=int, default=1000)
+    p.add_argument("--clips", nargs="*", default=[],
+                   help="recorded face clips: video files, directories of "
+                        "videos or images, streams or shm:NAME")
+    p.add_argument("--pacing", choices=capture.PACINGS, default="fast",
+                   help="fast feeds every clip frame to the camera tick; "
+                        "realtime plays clips at their own frame rate")
+    p.add_argument("--cards", default=",".join(main.NFC_DATABASE),
+                   help="comma-separated NFC card IDs to tap")
+    p.add_argument("--restricted-ratio", type=float, default=0.5)
+    p.add_argument("--max-items", type=int, default=5)
+    p.add_argument("--camera-timeout", type=float, default=3.0,
+                   help="seconds before giving up on a face verdict")
+    p.add_argument("--browse-ms", type=int, default=0,
+                   help="time between filling the cart and pressing pay")
+    p.add_argument("--tap-after", type=float, default=1.0,
+                   help="seconds before tapping an ID card while the "
+                        "camera has not decided yet")
+    p.add_argument("--nfc-delay-ms", type=int, default=0,
+                   help="simulated NFC read time (the kiosk uses 1500)")
+    p.add_argument("--poll-ms", type=int, default=5)
+    p.add_argument("--memory-every", type=int, default=100,
+                   help="sessions between memory samples")
+    p.add_argument("--warmup", type=int, default=100,
+                   help="sessions before the memory baseline is taken, "
+                        "so caches and lazily built dialogs settle first")
+    p.add_argument("--max-growth-mb", type=float,
+                   help="fail when RSS grows more than this after warmup")
+    p.add_argument("--gateway-stub", action="store_true",
+                   help="authorise payments against a local gateway stub")
+    p.add_argument("--gateway-latency-ms", type=int, default=0)
+    p.add_argument("--gateway-fail-rate", type=float, default=0.0,
+                   help="share of gateway requests answered with 503")
+    p.add_argument("--cancel-ratio", type=float, default=0.0,
+                   help="share of customers who cancel during authorisation")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--report", help="also write the JSON report here")
+    return p.parse_args(argv)
+
+
+def run(args):
+    main.NFC_READ_DELAY_MS = args.nfc_delay_ms
+    metrics.REGISTRY.enabled = True
+    stub = None
+    if args.gateway_stub:
+        server, stub = gateway_stub.serve(state=gateway_stub.GatewayState(
+            fail_rate=args.gateway_fail_rate,
+            latency_ms=args.gateway_latency_ms, seed=args.seed))
+        main.GATEWAY_URL = f"http://127.0.0.1:{server.server_address[1]}"
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    win = main.MyMart()
+    if win._init_error:
+        return None
+    win.show()
+
+    driver = CheckoutDriver(win, args)
+    driver.start()
+    app.exec()
+    win.close()
+    report = driver.report()
+    if stub is not None:
+        report["gateway"] = stub.stats()
+    return report
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    listener = setup_logging(level=os.environ.get("POS_LOG_LEVEL", "WARNING"))
+    report = run(args)
+    listener.stop()
+    if report is None:
+        sys.exit(1)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            f.write(text)
+    memory = report["memory"]
+    if not memory["passed"]:
+        print(f"RSS grew {memory['rss_growth_mb']} MB after warmup "
+              f"(limit {args.max_growth_mb} MB)", file=sys.stderr)
+        sys.exit(2)
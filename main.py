@@ -1,8 +1,31 @@
 import sys
+import collections
 import cv2
+import numpy as np
 import os
 import logging
+import signal
+import sqlite3
 import time
+import uuid
+
+import face_detectors
+import face_quality
+import analytics
+import age_cache
+import audit_store
+import calibrate
+import inventory
+import capture
+import metrics
+import outbox
+import payment_gateway
+import presence
+import pricing
+import profiling
+import receipts
+import session_recorder
+from pos_logging import setup_logging
 
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QLabel, QPushButton,
@@ -12,11 +35,78 @@ from PyQt6.QtWidgets import (
     QDialog, QStackedWidget, QLineEdit
 )
 
-from PyQt6.QtGui import QFont, QColor, QImage, QPixmap, QFontDatabase
-from PyQt6.QtCore import Qt, QTimer, QSize, QPropertyAnimation, QEasingCurve
+from PyQt6.QtGui import (
+    QFont, QColor, QImage, QPixmap, QFontDatabase, QKeySequence, QShortcut
+)
+from PyQt6.QtCore import (
+    Qt, QObject, QTimer, QSize, QPropertyAnimation, QEasingCurve, pyqtSignal
+)
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+logger = logging.getLogger("pos")
+ui_logger = logging.getLogger("pos.ui")
+camera_logger = logging.getLogger("pos.camera")
+frame_logger = logging.getLogger("pos.camera.frame")
+payment_logger = logging.getLogger("pos.payment")
+
+# ================= METRICS =================
+FRAME_TICK = metrics.histogram(
+    "pos_frame_seconds", "Whole camera tick")
+FRAME_STAGE = {
+    stage: metrics.histogram(
+        "pos_frame_stage_seconds", "Camera tick stage", {"stage": stage})
+    for stage in ("capture", "presence", "detect", "quality", "infer",
+                  "render")
+}
+CAMERA_ACTIVE = metrics.gauge(
+    "pos_camera_active", "1 while the camera runs full-rate analysis, 0 "
+    "while idle or off")
+PAYMENT_PHASE = {
+    phase: metrics.histogram(
+        "pos_payment_phase_seconds", "Payment flow phase", {"phase": phase})
+    for phase in ("camera", "nfc", "authorise", "complete")
+}
+CHECKOUT_SECONDS = metrics.histogram(
+    "pos_checkout_seconds", "Pay button to end of payment flow")
+MODEL_LOAD_SECONDS = metrics.histogram(
+    "pos_model_load_seconds", "Face detector and age model load")
+NFC_LOOKUP_SECONDS = metrics.histogram(
+    "pos_nfc_lookup_seconds", "NFC card lookup")
+PRICING_SECONDS = metrics.histogram(
+    "pos_pricing_update_seconds", "Cart line change to updated totals",
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01))
+CHECKOUTS = {
+    outcome: metrics.counter(
+        "pos_checkouts_total", "Finished payment flows", {"outcome": outcome})
+    for outcome in ("paid", "cancelled", "denied", "declined", "failed")
+}
+VERIFIED_BY = {
+    source: metrics.counter(
+        "pos_verified_by_total", "Restricted checkouts passed, by the "
+        "check that answered first", {"source": source})
+    for source in ("camera", "nfc")
+}
+SPECULATIONS = {
+    result: metrics.counter(
+        "pos_speculation_total", "Speculative camera runs, by how they "
+        "ended", {"result": result})
+    for result in ("ready", "pending", "expired", "dropped")
+}
+FACES_DETECTED = metrics.counter(
+    "pos_faces_detected_total", "Frames with at least one face")
+FACES_REJECTED = {
+    reason: metrics.counter(
+        "pos_faces_rejected_total", "Faces kept from age inference",
+        {"reason": reason})
+    for reason in face_quality.REASONS
+}
+VERDICT_SECONDS = metrics.histogram(
+    "pos_verdict_seconds", "Camera start to first age verdict")
+AGE_CACHE_LOOKUPS = {
+    result: metrics.counter(
+        "pos_age_cache_lookups_total", "Accepted faces, by whether the age "
+        "estimate came from the cache", {"result": result})
+    for result in ("hit", "miss")
+}
 
 # ================= CONSTANTS =================
 PRODUCTS = {
@@ -31,6 +121,17 @@ PRODUCTS = {
 
 AGE_RESTRICTED = ["🚬 たばこ", "🍺 アルコール"]
 
+# Consumption tax: food and non-alcoholic drinks take the reduced rate,
+# everything else (alcohol and tobacco included) the standard one
+REDUCED_TAX_ITEMS = ["💧 水", "🍟 ポテトチップス", "🧃 ジュース", "🍞 パン",
+                     "🍫 チョコレート"]
+CATALOGUE = {
+    name: pricing.Product(name, price, pricing.REDUCED_RATE
+                          if name in REDUCED_TAX_ITEMS
+                          else pricing.STANDARD_RATE)
+    for name, price in PRODUCTS.items()
+}
+
 MODEL_MEAN_VALUES = (78.4263377603, 87.7689143744, 114.895847746)
 
 AGE_LIST = [
@@ -41,9 +142,113 @@ AGE_LIST = [
 FACE_SCALE_FACTOR = 1.3
 FACE_MIN_NEIGHBORS = 5
 CAMERA_INTERVAL_MS = 30
+NFC_READ_DELAY_MS = 1500
 LEGAL_AGE = 20
 CONFIDENT_AGE = 25
 
+# Quality-weighted faces needed before an age verdict (see face_quality)
+VERDICT_MIN_WEIGHT = 2.0
+# Evidence is dropped after this long without a usable face in view
+FACE_LOST_SECONDS = 2.0
+# Age estimates remembered for unchanged face crops (see age_cache.py);
+# 0 runs the age network on every accepted face
+AGE_CACHE_SIZE = int(os.environ.get("POS_AGE_CACHE", "32"))
+
+# Low-power camera: with nobody in front of it (no motion, no face for
+# PRESENCE_HOLD_SECONDS) the camera only checks for presence, at a slow tick
+PRESENCE = os.environ.get("POS_PRESENCE", "1") == "1"
+PRESENCE_HOLD_SECONDS = float(os.environ.get("POS_PRESENCE_HOLD_SECONDS", "3"))
+IDLE_INTERVAL_MS = int(os.environ.get("POS_IDLE_INTERVAL_MS", "250"))
+
+# Status line shown while the best face in view is rejected
+QUALITY_HINTS = {
+    "small":  "もう少しカメラに近づいてください",
+    "edge":   "顔を枠の中央に合わせてください",
+    "aspect": "カメラの正面を向いてください",
+    "blur":   "そのまま動かずにお待ちください",
+    "dark":   "顔が暗すぎます ─ 照明の下へどうぞ",
+    "bright": "逆光です ─ 少し位置をずらしてください",
+    "flat":   "顔がはっきり映っていません",
+}
+
+# Camera device, stream, recording or shared-memory feed (see capture.py),
+# its capture mode, and "realtime" or "fast" pacing
+CAMERA_SOURCE = os.environ.get("POS_CAMERA_SOURCE", "0")
+CAMERA_CONFIG = capture.config_from_env(os.environ)
+CAMERA_PACING = os.environ.get("POS_CAMERA_PACING", "realtime")
+
+# Backend name or mode from face_detectors ("haar", "dnn", "fast", ...)
+FACE_DETECTOR = os.environ.get("POS_FACE_DETECTOR", "haar")
+
+# Detector settings, capture size and camera tick measured on this terminal
+# by calibrate.py; replaces the defaults above at start-up
+TERMINAL_PROFILE = os.environ.get("POS_TERMINAL_PROFILE",
+                                  "terminal_profile.json")
+
+METRICS_ENABLED = os.environ.get("POS_METRICS", "0") == "1"
+METRICS_PORT = int(os.environ.get("POS_METRICS_PORT", "0"))
+
+# "full" draws drop shadows with QGraphicsDropShadowEffect; "lite" skips
+# graphics effects (each one forces an offscreen blur pass per repaint) and
+# marks buttons with a flat bottom edge instead.
+RENDER_PROFILES = ("full", "lite")
+RENDER_PROFILE = os.environ.get("POS_RENDER_PROFILE", "full")
+
+# Lane / terminal number, stamped on audit records
+LANE = os.environ.get("POS_LANE", "1")
+
+AUDIT_DB = os.environ.get("POS_AUDIT_DB", "audit.db")
+AUDIT_MAX_MB = float(os.environ.get("POS_AUDIT_MAX_MB", "200"))
+AUDIT_RETENTION_DAYS = int(os.environ.get("POS_AUDIT_RETENTION_DAYS", "365"))
+AUDIT_THUMBNAILS = os.environ.get("POS_AUDIT_THUMBNAILS", "0") == "1"
+
+# Head-office ingest endpoint; unset keeps the outbox off
+OUTBOX_URL = os.environ.get("POS_OUTBOX_URL", "")
+OUTBOX_DB = os.environ.get("POS_OUTBOX_DB", "outbox.db")
+
+# Card payment gateway (see payment_gateway.py); unset takes payment as
+# settled the moment the customer confirms
+GATEWAY_URL = os.environ.get("POS_GATEWAY_URL", "")
+GATEWAY_TIMEOUT = float(os.environ.get("POS_GATEWAY_TIMEOUT", "5"))
+GATEWAY_DEADLINE = float(os.environ.get("POS_GATEWAY_DEADLINE", "20"))
+
+# Columnar record of every finished checkout (see analytics.py); empty
+# disables
+ANALYTICS_DIR = os.environ.get("POS_ANALYTICS_DIR", "analytics")
+
+# Stock levels decremented by sales (see inventory.py); empty disables.
+# Products new to the database start with POS_INITIAL_STOCK units.
+INVENTORY_DB = os.environ.get("POS_INVENTORY_DB", "store.db")
+INVENTORY_JOURNAL = os.environ.get("POS_INVENTORY_JOURNAL", "sales.journal")
+INITIAL_STOCK = int(os.environ.get("POS_INITIAL_STOCK", "100"))
+LOW_STOCK_THRESHOLD = int(os.environ.get("POS_LOW_STOCK", "10"))
+STOCK_NOTES = {"ok": "", "low": "   ⚠ 残りわずか", "out": "   ✕ 在庫切れ"}
+
+# Start the camera (hidden) as soon as a restricted item is in the cart,
+# so the verdict is usually settled by the time the customer pays
+SPECULATIVE = os.environ.get("POS_SPECULATIVE", "0") == "1"
+SPECULATIVE_SECONDS = float(os.environ.get("POS_SPECULATIVE_SECONDS", "120"))
+
+# Multi-buy, set and time-of-day promotions (see pricing.py)
+PROMOTIONS_FILE = os.environ.get("POS_PROMOTIONS", "promotions.json")
+
+# Receipt formats (text, escpos, png, pdf; empty disables) written to
+# RECEIPT_DIR, or queued as print jobs in RECEIPT_SPOOL when that is set
+RECEIPT_FORMATS = [f.strip() for f in
+                   os.environ.get("POS_RECEIPTS", "text").split(",")
+                   if f.strip()]
+RECEIPT_DIR = os.environ.get("POS_RECEIPT_DIR", "receipts")
+RECEIPT_SPOOL = os.environ.get("POS_RECEIPT_SPOOL", "")
+STORE_NAME = os.environ.get("POS_STORE_NAME", "My Mart")
+# Qualified invoice issuer registration number (T + 13 digits)
+INVOICE_NUMBER = os.environ.get("POS_INVOICE_NUMBER", "")
+
+RECORD_SESSIONS = os.environ.get("POS_RECORD", "0") == "1"
+RECORD_DIR = os.environ.get("POS_RECORD_DIR", "recordings")
+
+PROFILE_SPEC = os.environ.get("POS_PROFILE", "")
+PROFILE_DIR = os.environ.get("POS_PROFILE_DIR", "profiles")
+
 # NFC simulation database (card_id -> age)
 NFC_DATABASE = {
     "NFC-001-TANAKA": {"name": "田中太郎", "age": 22, "dob": "2003-03-15"},
@@ -97,17 +302,84 @@ COLORS = {
     "list_bg":        "#0F172A",
 }
 
-# ================= STYLESHEET =================
-GLOBAL_STYLE = f"""
+# ================= THEME =================
+# Widgets are tagged with an objectName or the dynamic properties "variant",
+# "role", "tone" and "state"; all of their styling lives in one application
+# stylesheet compiled from COLORS. A runtime look change is then a property
+# flip plus re-polish of that one widget (set_style_prop) rather than a new
+# stylesheet being parsed on every update.
+
+# variant: (background, hover, pressed)
+BUTTON_VARIANTS = {
+    "accent":  ("accent", "accent_hover", "accent_pressed"),
+    "success": ("success", "success_hover", "success_pressed"),
+    "danger":  ("danger", "danger_hover", "danger_pressed"),
+    "nfc":     ("nfc_blue", "nfc_blue_hover", "nfc_blue_pressed"),
+    "muted":   ("text_muted", "text_dim", "text_muted"),
+}
+
+LABEL_TONES = {
+    "dim":        COLORS["text_dim"],
+    "muted":      COLORS["text_muted"],
+    "success":    COLORS["success"],
+    "warning":    COLORS["warning"],
+    "danger":     COLORS["danger"],
+    "nfc":        COLORS["nfc_blue"],
+    "restricted": COLORS["restricted_fg"],
+    "white":      "white",
+    "white_dim":  "rgba(255, 255, 255, 0.65)",
+}
+
+# role: {state: (background, border)}
+FRAME_STATES = {
+    "status": {
+        "idle":    (COLORS["list_bg"], f"2px solid {COLORS['panel_border']}"),
+        "success": ("rgba(16, 185, 129, 0.08)", f"2px solid {COLORS['success']}"),
+        "warning": ("rgba(245, 158, 11, 0.08)", f"2px solid {COLORS['warning']}"),
+        "danger":  ("rgba(239, 68, 68, 0.08)", f"2px solid {COLORS['danger']}"),
+    },
+    "scan": {
+        "idle":    (COLORS["nfc_bg"], f"3px dashed {COLORS['nfc_blue']}"),
+        "success": ("rgba(16, 185, 129, 0.06)", f"3px solid {COLORS['success']}"),
+        "danger":  ("rgba(239, 68, 68, 0.06)", f"3px solid {COLORS['danger']}"),
+    },
+    "result": {
+        "missing": ("rgba(239, 68, 68, 0.08)", f"2px solid {COLORS['danger_border']}"),
+        "success": ("rgba(16, 185, 129, 0.08)", f"2px solid {COLORS['success']}"),
+        "danger":  ("rgba(239, 68, 68, 0.08)", f"2px solid {COLORS['danger']}"),
+    },
+}
+
+# card tone: (background, border colour)
+CARD_TONES = {
+    "nfc":     (COLORS["panel"], COLORS["nfc_blue"]),
+    "camera":  (COLORS["panel"], COLORS["camera_border"]),
+    "success": (COLORS["panel"], COLORS["success"]),
+    "danger":  (COLORS["danger_bg"], COLORS["danger"]),
+}
+
+
+def _gradient(start, stop):
+    return (f"qlineargradient(x1:0, y1:0, x2:1, y2:0, "
+            f"stop:0 {start}, stop:1 {stop})")
+
+
+def build_stylesheet(c=COLORS, profile="full"):
+    """Compile the palette into the single application stylesheet."""
+    rules = [f"""
     QWidget {{
-        background: {COLORS['bg']};
-        color: {COLORS['text']};
+        background: {c['bg']};
+        color: {c['text']};
         font-family: 'Segoe UI', 'Noto Sans JP', 'Meiryo', 'Yu Gothic UI',
                      'Helvetica Neue', Arial, sans-serif;
     }}
+    QLabel {{
+        background: transparent;
+        border: none;
+    }}
     QListWidget {{
-        background: {COLORS['list_bg']};
-        border: 2px solid {COLORS['panel_border']};
+        background: {c['list_bg']};
+        border: 2px solid {c['panel_border']};
         border-radius: 12px;
         padding: 8px;
         outline: 0;
@@ -120,33 +392,231 @@ GLOBAL_STYLE = f"""
         border: 1px solid transparent;
     }}
     QListWidget::item:selected {{
-        background: {COLORS['accent']};
+        background: {c['accent']};
         color: white;
-        border: 1px solid {COLORS['accent_hover']};
+        border: 1px solid {c['accent_hover']};
     }}
     QListWidget::item:hover:!selected {{
-        border: 1px solid {COLORS['accent']};
+        border: 1px solid {c['accent']};
         background: rgba(139, 92, 246, 0.12);
     }}
     QScrollBar:vertical {{
-        background: {COLORS['panel']};
+        background: {c['panel']};
         width: 10px;
         margin: 4px 2px;
         border-radius: 5px;
     }}
     QScrollBar::handle:vertical {{
-        background: {COLORS['text_muted']};
+        background: {c['text_muted']};
         min-height: 30px;
         border-radius: 5px;
     }}
     QScrollBar::handle:vertical:hover {{
-        background: {COLORS['text_dim']};
+        background: {c['text_dim']};
     }}
     QScrollBar::add-line:vertical,
     QScrollBar::sub-line:vertical {{
         height: 0;
     }}
-"""
+
+    QPushButton[variant] {{
+        color: white;
+        border: none;
+        border-radius: 12px;
+        padding: 16px 24px;
+        font-size: 15px;
+        font-weight: 700;
+        letter-spacing: 0.5px;
+    }}
+    QPushButton[weight="normal"] {{
+        font-weight: 500;
+    }}
+    QPushButton[variant="id_pay"] {{
+        background: {_gradient(c['nfc_blue'], c['info'])};
+    }}
+    QPushButton[variant="id_pay"]:hover {{
+        background: {_gradient(c['nfc_blue_hover'], c['info_hover'])};
+    }}
+    QPushButton[variant="id_pay"]:pressed {{
+        background: {c['nfc_blue_pressed']};
+    }}
+
+    QFrame[role="panel"] {{
+        background: {c['panel']};
+        border: 1px solid {c['panel_border']};
+        border-radius: 16px;
+    }}
+    QFrame[role="panel"] QListWidget {{
+        background: {c['panel']};
+        border: 1px solid {c['panel_border']};
+        border-radius: 16px;
+    }}
+    QFrame[role="panel"] QLabel[role="section"] {{
+        background: {c['panel']};
+        border: 1px solid {c['panel_border']};
+    }}
+    QFrame[role="header"] {{
+        background: {_gradient(c['header_bg'], c['header_bg2'])};
+        border-radius: 16px;
+        border: 1px solid rgba(255, 255, 255, 0.08);
+    }}
+    QFrame[role="card"] {{
+        border-radius: 20px;
+    }}
+    QFrame[role="banner"] {{
+        border-radius: 14px;
+        border: none;
+    }}
+    QFrame[role="banner"][tone="nfc"] {{
+        background: {_gradient(c['nfc_blue'], c['info'])};
+    }}
+    QFrame[role="banner"][tone="camera"] {{
+        background: {_gradient(c['header_bg'], c['header_bg2'])};
+    }}
+    QFrame[role="banner"][tone="danger"] {{
+        background: {c['danger']};
+    }}
+    QFrame[role="reason"] {{
+        background: rgba(14, 165, 233, 0.08);
+        border: 2px solid {c['nfc_border']};
+        border-radius: 12px;
+    }}
+    QFrame[role="total"] {{
+        background: {c['list_bg']};
+        border: 2px solid {c['panel_border']};
+        border-radius: 12px;
+        padding: 4px;
+    }}
+    QFrame[role="total"] QLabel {{
+        padding: 4px;
+    }}
+    QFrame#cameraFrame {{
+        background: #000;
+        border: 3px solid {c['camera_border']};
+        border-radius: 14px;
+    }}
+    QLabel#cameraView {{
+        background: #000;
+        border-radius: 10px;
+        color: #64748B;
+    }}
+
+    QLabel[role="section"] {{
+        color: {c['text_dim']};
+        letter-spacing: 2px;
+        padding: 4px 8px;
+        margin-bottom: 2px;
+        font-size: 13px;
+    }}
+    QLabel[role="title"] {{
+        letter-spacing: 1px;
+    }}
+    QLabel[role="caps"] {{
+        letter-spacing: 3px;
+    }}
+    QLabel[role="person"] {{
+        color: {c['danger']};
+        background: rgba(239, 68, 68, 0.1);
+        border: 2px solid {c['danger_border']};
+        border-radius: 10px;
+        padding: 14px;
+    }}
+    QLabel#note {{
+        padding: 6px 10px;
+    }}
+    QLabel#footer {{
+        color: {c['text_muted']};
+        padding: 8px;
+    }}
+    QLabel#diagnostics {{
+        background: rgba(15, 23, 42, 0.88);
+        color: {c['success_hover']};
+        border: 1px solid {c['panel_border']};
+        border-radius: 8px;
+        padding: 10px;
+    }}
+
+    QLineEdit#nfcInput {{
+        background: {c['bg']};
+        color: {c['text']};
+        border: 2px solid {c['nfc_border']};
+        border-radius: 10px;
+        padding: 14px 18px;
+        font-size: 14px;
+        letter-spacing: 1px;
+    }}
+    QLineEdit#nfcInput:focus {{
+        border: 2px solid {c['nfc_blue']};
+        background: rgba(14, 165, 233, 0.05);
+    }}
+    """]
+
+    for variant, (bg, hover, pressed) in BUTTON_VARIANTS.items():
+        rules.append(f"""
+    QPushButton[variant="{variant}"] {{ background: {c[bg]}; }}
+    QPushButton[variant="{variant}"]:hover {{ background: {c[hover]}; }}
+    QPushButton[variant="{variant}"]:pressed {{ background: {c[pressed]}; }}
+    """)
+    if profile == "lite":
+        # Flat bottom edge standing in for the button drop shadow
+        for variant, (_, _, pressed) in BUTTON_VARIANTS.items():
+            rules.append(f"""
+    QPushButton[variant="{variant}"] {{
+        border-bottom: 3px solid {c[pressed]};
+    }}""")
+        rules.append(f"""
+    QPushButton[variant="id_pay"] {{
+        border-bottom: 3px solid {c['nfc_blue_pressed']};
+    }}""")
+    rules.append(f"""
+    QPushButton[variant]:disabled {{
+        background: {c['text_muted']};
+        color: {c['panel']};
+    }}""")
+
+    for tone, color in LABEL_TONES.items():
+        rules.append(f"""
+    QLabel[tone="{tone}"] {{ color: {color}; }}""")
+    for role, states in FRAME_STATES.items():
+        radius = 16 if role == "scan" else 12
+        for state, (bg, border) in states.items():
+            rules.append(f"""
+    QFrame[role="{role}"][state="{state}"] {{
+        background: {bg};
+        border: {border};
+        border-radius: {radius}px;
+    }}""")
+    for tone, (bg, border) in CARD_TONES.items():
+        rules.append(f"""
+    QFrame[role="card"][tone="{tone}"] {{
+        background: {bg};
+        border: 3px solid {border};
+    }}""")
+    return "".join(rules)
+
+
+def apply_theme():
+    QApplication.instance().setStyleSheet(
+        build_stylesheet(COLORS, RENDER_PROFILE))
+
+
+def themed(widget, name=None, **props):
+    """Tag a new widget with its objectName and theme properties."""
+    if name:
+        widget.setObjectName(name)
+    for key, value in props.items():
+        widget.setProperty(key, value)
+    return widget
+
+
+def set_style_prop(widget, key, value):
+    """Flip one theme property at runtime and re-polish only that widget."""
+    if widget.property(key) == value:
+        return
+    widget.setProperty(key, value)
+    style = widget.style()
+    style.unpolish(widget)
+    style.polish(widget)
 
 
 # ================= HELPERS =================
@@ -158,120 +628,196 @@ def make_shadow(color="#00000060", blur=24, ox=0, oy=6):
     return shadow
 
 
-def make_btn(text, color, hover, pressed, bold=True, padding="16px 24px"):
-    btn = QPushButton(text)
+def apply_shadow(widget, color="#00000060", blur=24, ox=0, oy=6):
+    if RENDER_PROFILE == "full":
+        widget.setGraphicsEffect(make_shadow(color, blur, ox, oy))
+
+
+def make_btn(text, variant, bold=True):
+    btn = themed(QPushButton(text), variant=variant)
     btn.setCursor(Qt.CursorShape.PointingHandCursor)
     btn.setFont(
         QFont("Segoe UI", 14, QFont.Weight.Bold if bold else QFont.Weight.Normal))
-    btn.setStyleSheet(f"""
-        QPushButton {{
-            background: {color};
-            color: white;
-            border: none;
-            border-radius: 12px;
-            padding: {padding};
-            font-size: 15px;
-            font-weight: {'700' if bold else '500'};
-            letter-spacing: 0.5px;
-        }}
-        QPushButton:hover {{
-            background: {hover};
-        }}
-        QPushButton:pressed {{
-            background: {pressed};
-        }}
-        QPushButton:disabled {{
-            background: {COLORS['text_muted']};
-            color: {COLORS['panel']};
-        }}
-    """)
-    btn.setGraphicsEffect(make_shadow(color + "50", 16, 0, 4))
+    if not bold:
+        btn.setProperty("weight", "normal")
+    color = COLORS[BUTTON_VARIANTS[variant][0]]
+    apply_shadow(btn, color + "50", 16, 0, 4)
     return btn
 
 
-def make_section_label(text, size=13):
-    lbl = QLabel(text)
-    lbl.setFont(QFont("Segoe UI", size, QFont.Weight.Bold))
-    lbl.setStyleSheet(f"""
-        color: {COLORS['text_dim']};
-        letter-spacing: 2px;
-        padding: 4px 8px;
-        margin-bottom: 2px;
-        font-size: {size}px;
-    """)
+def make_section_label(text):
+    lbl = themed(QLabel(text), role="section")
+    lbl.setFont(QFont("Segoe UI", 13, QFont.Weight.Bold))
     return lbl
 
 
 def make_panel():
-    panel = QFrame()
-    panel.setStyleSheet(f"""
-        QFrame {{
-            background: {COLORS['panel']};
-            border: 1px solid {COLORS['panel_border']};
-            border-radius: 16px;
-        }}
-    """)
-    panel.setGraphicsEffect(make_shadow("#00000040", 20, 0, 4))
+    panel = themed(QFrame(), role="panel")
+    apply_shadow(panel, "#00000040", 20, 0, 4)
     return panel
 
 
+def open_camera():
+    return capture.open_source(CAMERA_SOURCE, CAMERA_CONFIG, CAMERA_PACING)
+
+
+def apply_terminal_profile(path):
+    """
+    Adopt the calibrated settings in `path`, if any. POS_FACE_DETECTOR
+    and POS_CAMERA_MODE, when set, still win over the profile, and the
+    settings measured for the detector or mode they replace are dropped.
+    """
+    global FACE_DETECTOR, FACE_SCALE_FACTOR, FACE_MIN_NEIGHBORS
+    global CAMERA_INTERVAL_MS, CAMERA_CONFIG
+    profile = calibrate.load_profile(path) if path else None
+    if profile is None:
+        return
+    ignored = []
+    if "POS_FACE_DETECTOR" not in os.environ:
+        FACE_DETECTOR = profile["detector"]
+    same_detector = FACE_DETECTOR.strip().lower() == profile["detector"]
+    if same_detector:
+        if profile["scale_factor"] is not None:
+            FACE_SCALE_FACTOR = profile["scale_factor"]
+        if profile["min_neighbors"] is not None:
+            FACE_MIN_NEIGHBORS = profile["min_neighbors"]
+    else:
+        ignored.append(f"scale factor and min neighbours (tuned for "
+                       f"{profile['detector']})")
+    width, height, _ = capture.parse_mode(profile["camera_mode"])
+    if "POS_CAMERA_MODE" not in os.environ:
+        CAMERA_CONFIG = CAMERA_CONFIG._replace(width=width, height=height)
+    # The tick comes from the detect time of that detector at that size.
+    if same_detector and \
+            (CAMERA_CONFIG.width, CAMERA_CONFIG.height) == (width, height):
+        CAMERA_INTERVAL_MS = profile["camera_interval_ms"]
+    else:
+        ignored.append(f"camera tick (measured for {profile['detector']} "
+                       f"at {profile['camera_mode']})")
+    if ignored:
+        logger.warning("Terminal profile %s partly ignored: %s",
+                       path, "; ".join(ignored), extra={"profile": path})
+    logger.info("Terminal profile %s: %s sf=%s mn=%s %sx%s every %d ms",
+                path, FACE_DETECTOR, FACE_SCALE_FACTOR, FACE_MIN_NEIGHBORS,
+                CAMERA_CONFIG.width, CAMERA_CONFIG.height, CAMERA_INTERVAL_MS,
+                extra={"profile": path,
+                       "within_budget": profile.get("within_budget")})
+
+
+# ================= DIALOG BASE =================
+class KioskDialog(QDialog):
+    """
+    Frameless, translucent dialog that is built once and reused.
+    Subclasses create their widgets in __init__ and put every piece of
+    per-customer state back in reset(), which is called before each show.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowFlags(
+            Qt.WindowType.Dialog | Qt.WindowType.FramelessWindowHint
+        )
+        self.setAttribute(Qt.WidgetAttribute.WA_TranslucentBackground)
+        self._open_hist = metrics.histogram(
+            "pos_dialog_open_seconds", "Dialog reset to first paint",
+            {"dialog": type(self).__name__})
+        self._mark_open()
+
+    def _mark_open(self):
+        self._open_started = time.perf_counter()
+
+    def paintEvent(self, event):
+        if self._open_started is not None:
+            self._open_hist.observe(time.perf_counter() - self._open_started)
+            self._open_started = None
+        super().paintEvent(event)
+
+
 # ================= NFC SCAN DIALOG =================
-class NFCScanDialog(QDialog):
+class NFCScanDialog(KioskDialog):
     """
     NFC ID card scanning dialog.
     Shown when AI detects age < 25 for age-restricted items.
     Simulates NFC scan with a text input for demo purposes.
     """
 
-    def __init__(self, detected_age_text, parent=None):
+    # Emitted after every card lookup: "verified", "denied" or
+    # "unknown_card"
+    card_read = pyqtSignal(str)
+
+    def __init__(self, detected_age_text="", parent=None):
         super().__init__(parent)
         self.setWindowTitle("🪪 NFC ID Scan")
         self.setFixedSize(600, 720)
-        self.setWindowFlags(
-            Qt.WindowType.Dialog | Qt.WindowType.FramelessWindowHint
-        )
-        self.setAttribute(Qt.WidgetAttribute.WA_TranslucentBackground)
 
         self.verified_age = None
         self.verified_name = None
+        self.card_id = None
         self.detected_age_text = detected_age_text
         self.scan_animation_timer = None
         self.pulse_state = 0
+        self._scan_seq = 0
 
         self._build()
-        self._start_pulse_animation()
+        self.reset(detected_age_text)
+
+    def reset(self, detected_age_text=""):
+        """Back to the waiting-for-card state for a new customer."""
+        self._mark_open()
+        self._scan_seq += 1
+        self.verified_age = None
+        self.verified_name = None
+        self.card_id = None
+        self.detected_age_text = detected_age_text
+        self.pulse_state = 0
+
+        self.show_estimate(detected_age_text)
+        self.nfc_icon.setText("📡")
+        self.scan_status.setText("NFCリーダーにカードをかざしてください")
+        set_style_prop(self.scan_status, "tone", "nfc")
+        self.scan_sub.setText("Place your ID card on the NFC reader")
+        set_style_prop(self.scan_frame, "state", "idle")
+        self.nfc_input.clear()
+        self.result_frame.setVisible(False)
+        self.scan_btn.setEnabled(True)
+        self.scan_btn.setText("📡  スキャン")
+        self.scan_btn.setVisible(True)
+        self.proceed_btn.setVisible(False)
+
+    def show_estimate(self, detected_age_text):
+        """Explain why an ID is asked for; empty while still estimating."""
+        self.detected_age_text = detected_age_text
+        if detected_age_text:
+            self.reason_title.setText(f"AI推定年齢: {detected_age_text}")
+            self.reason_msg.setText(
+                "25歳未満と推定されたため、\n"
+                "本人確認書類のNFCスキャンが必要です"
+            )
+        else:
+            self.reason_title.setText("AI年齢推定中...")
+            self.reason_msg.setText(
+                "年齢確認が必要な商品があります。\n"
+                "IDカードをかざすとすぐに確認できます"
+            )
+
+    def show_camera_unavailable(self):
+        self.detected_age_text = None
+        self.reason_title.setText("カメラを使用できません")
+        self.reason_msg.setText("本人確認書類のNFCスキャンが必要です")
 
     def _build(self):
         outer = QVBoxLayout(self)
         outer.setContentsMargins(0, 0, 0, 0)
 
-        self.card = QFrame()
-        self.card.setStyleSheet(f"""
-            QFrame {{
-                background: {COLORS['panel']};
-                border: 3px solid {COLORS['nfc_blue']};
-                border-radius: 20px;
-            }}
-        """)
-        self.card.setGraphicsEffect(make_shadow("#0EA5E960", 40, 0, 8))
+        self.card = themed(QFrame(), role="card", tone="nfc")
+        apply_shadow(self.card, "#0EA5E960", 40, 0, 8)
 
         layout = QVBoxLayout(self.card)
         layout.setContentsMargins(32, 28, 32, 28)
         layout.setSpacing(14)
 
         # ── Header Banner ──
-        banner = QFrame()
-        banner.setStyleSheet(f"""
-            QFrame {{
-                background: qlineargradient(
-                    x1:0, y1:0, x2:1, y2:0,
-                    stop:0 {COLORS['nfc_blue']},
-                    stop:1 {COLORS['info']}
-                );
-                border-radius: 14px;
-                border: none;
-            }}
-        """)
+        banner = themed(QFrame(), role="banner", tone="nfc")
         banner_layout = QVBoxLayout(banner)
         banner_layout.setContentsMargins(20, 18, 20, 18)
         banner_layout.setSpacing(6)
@@ -279,113 +825,74 @@ class NFCScanDialog(QDialog):
         icon_lbl = QLabel("🪪")
         icon_lbl.setFont(QFont("Segoe UI", 44))
         icon_lbl.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        icon_lbl.setStyleSheet("background:transparent; border:none;")
 
         title = QLabel("IDカードをスキャン")
         title.setFont(QFont("Segoe UI", 22, QFont.Weight.Bold))
         title.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        title.setStyleSheet(
-            "color:white; background:transparent; border:none; letter-spacing:1px;")
+        title.setProperty("tone", "white")
+        title.setProperty("role", "title")
 
         sub = QLabel("SCAN YOUR ID CARD (NFC)")
         sub.setFont(QFont("Segoe UI", 11, QFont.Weight.Bold))
         sub.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        sub.setStyleSheet(
-            "color:rgba(255,255,255,0.65); background:transparent; border:none; letter-spacing:3px;")
+        sub.setProperty("tone", "white_dim")
+        sub.setProperty("role", "caps")
 
         banner_layout.addWidget(icon_lbl)
         banner_layout.addWidget(title)
         banner_layout.addWidget(sub)
 
         # ── Reason Section ──
-        reason_frame = QFrame()
-        reason_frame.setStyleSheet(f"""
-            QFrame {{
-                background: rgba(14, 165, 233, 0.08);
-                border: 2px solid {COLORS['nfc_border']};
-                border-radius: 12px;
-            }}
-        """)
+        reason_frame = themed(QFrame(), role="reason")
         reason_layout = QVBoxLayout(reason_frame)
         reason_layout.setContentsMargins(18, 14, 18, 14)
         reason_layout.setSpacing(6)
 
-        reason_title = QLabel(f"AI推定年齢: {self.detected_age_text}")
-        reason_title.setFont(QFont("Segoe UI", 14, QFont.Weight.Bold))
-        reason_title.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        reason_title.setStyleSheet(
-            f"color:{COLORS['warning']}; background:transparent; border:none;")
+        self.reason_title = QLabel()
+        self.reason_title.setFont(QFont("Segoe UI", 14, QFont.Weight.Bold))
+        self.reason_title.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.reason_title.setProperty("tone", "warning")
 
-        reason_msg = QLabel(
-            "25歳未満と推定されたため、\n"
-            "本人確認書類のNFCスキャンが必要です"
-        )
-        reason_msg.setFont(QFont("Segoe UI", 12))
-        reason_msg.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        reason_msg.setWordWrap(True)
-        reason_msg.setStyleSheet(
-            f"color:{COLORS['text_dim']}; background:transparent; border:none;")
+        self.reason_msg = QLabel()
+        self.reason_msg.setFont(QFont("Segoe UI", 12))
+        self.reason_msg.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.reason_msg.setWordWrap(True)
+        self.reason_msg.setProperty("tone", "dim")
 
-        reason_layout.addWidget(reason_title)
-        reason_layout.addWidget(reason_msg)
+        reason_layout.addWidget(self.reason_title)
+        reason_layout.addWidget(self.reason_msg)
 
         # ── NFC Scan Area ──
-        self.scan_frame = QFrame()
-        self.scan_frame.setStyleSheet(f"""
-            QFrame {{
-                background: {COLORS['nfc_bg']};
-                border: 3px dashed {COLORS['nfc_blue']};
-                border-radius: 16px;
-            }}
-        """)
+        self.scan_frame = themed(QFrame(), role="scan")
         scan_layout = QVBoxLayout(self.scan_frame)
         scan_layout.setContentsMargins(24, 24, 24, 24)
         scan_layout.setSpacing(12)
 
-        self.nfc_icon = QLabel("📡")
+        self.nfc_icon = QLabel()
         self.nfc_icon.setFont(QFont("Segoe UI", 52))
         self.nfc_icon.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.nfc_icon.setStyleSheet("background:transparent; border:none;")
 
-        self.scan_status = QLabel("NFCリーダーにカードをかざしてください")
+        self.scan_status = QLabel()
         self.scan_status.setFont(QFont("Segoe UI", 14, QFont.Weight.Bold))
         self.scan_status.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.scan_status.setWordWrap(True)
-        self.scan_status.setStyleSheet(
-            f"color:{COLORS['nfc_blue']}; background:transparent; border:none;")
 
-        self.scan_sub = QLabel("Place your ID card on the NFC reader")
+        self.scan_sub = QLabel()
         self.scan_sub.setFont(QFont("Segoe UI", 11))
         self.scan_sub.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.scan_sub.setStyleSheet(
-            f"color:{COLORS['text_muted']}; background:transparent; border:none;")
+        self.scan_sub.setProperty("tone", "muted")
 
         # Simulated NFC input
         input_note = QLabel("── デモ用: カードIDを入力 ──")
         input_note.setFont(QFont("Segoe UI", 10))
         input_note.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        input_note.setStyleSheet(
-            f"color:{COLORS['text_muted']}; background:transparent; border:none;")
+        input_note.setProperty("tone", "muted")
 
         self.nfc_input = QLineEdit()
         self.nfc_input.setPlaceholderText("例: NFC-001-TANAKA")
         self.nfc_input.setFont(QFont("Segoe UI", 14))
         self.nfc_input.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.nfc_input.setStyleSheet(f"""
-            QLineEdit {{
-                background: {COLORS['bg']};
-                color: {COLORS['text']};
-                border: 2px solid {COLORS['nfc_border']};
-                border-radius: 10px;
-                padding: 14px 18px;
-                font-size: 14px;
-                letter-spacing: 1px;
-            }}
-            QLineEdit:focus {{
-                border: 2px solid {COLORS['nfc_blue']};
-                background: rgba(14, 165, 233, 0.05);
-            }}
-        """)
+        self.nfc_input.setObjectName("nfcInput")
 
         scan_layout.addWidget(self.nfc_icon)
         scan_layout.addWidget(self.scan_status)
@@ -395,15 +902,7 @@ class NFCScanDialog(QDialog):
         scan_layout.addWidget(self.nfc_input)
 
         # ── Result Area (hidden initially) ──
-        self.result_frame = QFrame()
-        self.result_frame.setVisible(False)
-        self.result_frame.setStyleSheet(f"""
-            QFrame {{
-                background: {COLORS['list_bg']};
-                border: 2px solid {COLORS['panel_border']};
-                border-radius: 12px;
-            }}
-        """)
+        self.result_frame = themed(QFrame(), role="result")
         self.result_layout = QVBoxLayout(self.result_frame)
         self.result_layout.setContentsMargins(18, 14, 18, 14)
         self.result_layout.setSpacing(6)
@@ -411,20 +910,17 @@ class NFCScanDialog(QDialog):
         self.result_icon = QLabel()
         self.result_icon.setFont(QFont("Segoe UI", 28))
         self.result_icon.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.result_icon.setStyleSheet("background:transparent; border:none;")
 
         self.result_text = QLabel()
         self.result_text.setFont(QFont("Segoe UI", 14, QFont.Weight.Bold))
         self.result_text.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.result_text.setWordWrap(True)
-        self.result_text.setStyleSheet(f"background:transparent; border:none;")
 
         self.result_detail = QLabel()
         self.result_detail.setFont(QFont("Segoe UI", 12))
         self.result_detail.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.result_detail.setWordWrap(True)
-        self.result_detail.setStyleSheet(
-            f"color:{COLORS['text_dim']}; background:transparent; border:none;")
+        self.result_detail.setProperty("tone", "dim")
 
         self.result_layout.addWidget(self.result_icon)
         self.result_layout.addWidget(self.result_text)
@@ -437,30 +933,19 @@ class NFCScanDialog(QDialog):
         cards_info.setFont(QFont("Segoe UI", 10))
         cards_info.setAlignment(Qt.AlignmentFlag.AlignCenter)
         cards_info.setWordWrap(True)
-        cards_info.setStyleSheet(
-            f"color:{COLORS['text_muted']}; background:transparent; border:none;")
+        cards_info.setProperty("tone", "muted")
 
         # ── Buttons ──
         btn_layout = QHBoxLayout()
         btn_layout.setSpacing(12)
 
-        cancel_btn = make_btn(
-            "✕  キャンセル",
-            COLORS["danger"], COLORS["danger_hover"], COLORS["danger_pressed"]
-        )
+        cancel_btn = make_btn("✕  キャンセル", "danger")
         cancel_btn.clicked.connect(self.reject)
 
-        self.scan_btn = make_btn(
-            "📡  スキャン",
-            COLORS["nfc_blue"], COLORS["nfc_blue_hover"], COLORS["nfc_blue_pressed"]
-        )
+        self.scan_btn = make_btn("", "nfc")
         self.scan_btn.clicked.connect(self._simulate_nfc_scan)
 
-        self.proceed_btn = make_btn(
-            "✓  支払いに進む",
-            COLORS["success"], COLORS["success_hover"], COLORS["success_pressed"]
-        )
-        self.proceed_btn.setVisible(False)
+        self.proceed_btn = make_btn("✓  支払いに進む", "success")
         self.proceed_btn.clicked.connect(self.accept)
 
         btn_layout.addWidget(cancel_btn)
@@ -478,10 +963,15 @@ class NFCScanDialog(QDialog):
         outer.addWidget(self.card)
 
     def _start_pulse_animation(self):
-        self.scan_animation_timer = QTimer()
-        self.scan_animation_timer.timeout.connect(self._pulse_nfc)
+        if self.scan_animation_timer is None:
+            self.scan_animation_timer = QTimer(self)
+            self.scan_animation_timer.timeout.connect(self._pulse_nfc)
         self.scan_animation_timer.start(800)
 
+    def showEvent(self, event):
+        super().showEvent(event)
+        self._start_pulse_animation()
+
     def _pulse_nfc(self):
         self.pulse_state = (self.pulse_state + 1) % 3
         icons = ["📡", "🔵", "📶"]
@@ -492,51 +982,50 @@ class NFCScanDialog(QDialog):
 
         if not card_id:
             self.scan_status.setText("❌ カードIDを入力してください")
-            self.scan_status.setStyleSheet(
-                f"color:{COLORS['danger']}; background:transparent; border:none;")
+            set_style_prop(self.scan_status, "tone", "danger")
             return
 
         # Show scanning animation
         self.scan_btn.setEnabled(False)
         self.scan_btn.setText("⏳  スキャン中...")
         self.scan_status.setText("📡  読み取り中...")
-        self.scan_status.setStyleSheet(
-            f"color:{COLORS['warning']}; background:transparent; border:none;")
+        set_style_prop(self.scan_status, "tone", "warning")
 
-        QTimer.singleShot(1500, lambda: self._process_nfc_result(card_id))
+        seq = self._scan_seq
+        QTimer.singleShot(NFC_READ_DELAY_MS,
+                          lambda: self._process_nfc_result(card_id, seq))
 
-    def _process_nfc_result(self, card_id):
+    def _process_nfc_result(self, card_id, seq):
+        if seq != self._scan_seq:
+            # Reader answered after the dialog was reset for someone else.
+            return
         self.scan_btn.setEnabled(True)
         self.scan_btn.setText("📡  再スキャン")
 
         if self.scan_animation_timer:
             self.scan_animation_timer.stop()
 
-        if card_id not in NFC_DATABASE:
+        self.card_id = card_id
+        with NFC_LOOKUP_SECONDS.time():
+            person = NFC_DATABASE.get(card_id)
+
+        if person is None:
             # Card not found
             self.nfc_icon.setText("❌")
             self.scan_status.setText("カードを認識できません")
-            self.scan_status.setStyleSheet(
-                f"color:{COLORS['danger']}; background:transparent; border:none;")
+            set_style_prop(self.scan_status, "tone", "danger")
             self.scan_sub.setText("登録されていないカードです。別のカードをお試しください。")
 
             self.result_frame.setVisible(True)
             self.result_icon.setText("⚠️")
             self.result_text.setText("カードが見つかりません")
-            self.result_text.setStyleSheet(
-                f"color:{COLORS['danger']}; background:transparent; border:none;")
+            set_style_prop(self.result_text, "tone", "danger")
             self.result_detail.setText(f"ID: {card_id}")
-            self.result_frame.setStyleSheet(f"""
-                QFrame {{
-                    background: rgba(239, 68, 68, 0.08);
-                    border: 2px solid {COLORS['danger_border']};
-                    border-radius: 12px;
-                }}
-            """)
+            set_style_prop(self.result_frame, "state", "missing")
             self.proceed_btn.setVisible(False)
+            self.card_read.emit("unknown_card")
             return
 
-        person = NFC_DATABASE[card_id]
         self.verified_name = person["name"]
         self.verified_age = person["age"]
 
@@ -546,137 +1035,151 @@ class NFCScanDialog(QDialog):
             # Age verified - OK
             self.nfc_icon.setText("✅")
             self.scan_status.setText("本人確認完了")
-            self.scan_status.setStyleSheet(
-                f"color:{COLORS['success']}; background:transparent; border:none;")
+            set_style_prop(self.scan_status, "tone", "success")
             self.scan_sub.setText("年齢確認に成功しました")
 
-            self.scan_frame.setStyleSheet(f"""
-                QFrame {{
-                    background: rgba(16, 185, 129, 0.06);
-                    border: 3px solid {COLORS['success']};
-                    border-radius: 16px;
-                }}
-            """)
+            set_style_prop(self.scan_frame, "state", "success")
 
             self.result_icon.setText("✅")
             self.result_text.setText(f"{person['name']}  ─  {person['age']}歳")
-            self.result_text.setStyleSheet(
-                f"color:{COLORS['success']}; background:transparent; border:none;")
+            set_style_prop(self.result_text, "tone", "success")
             self.result_detail.setText(
                 f"生年月日: {person['dob']}  ·  ID: {card_id}")
-            self.result_frame.setStyleSheet(f"""
-                QFrame {{
-                    background: rgba(16, 185, 129, 0.08);
-                    border: 2px solid {COLORS['success']};
-                    border-radius: 12px;
-                }}
-            """)
+            set_style_prop(self.result_frame, "state", "success")
 
             self.proceed_btn.setVisible(True)
             self.scan_btn.setVisible(False)
+            self.card_read.emit("verified")
 
         else:
             # Underage confirmed
             self.nfc_icon.setText("⛔")
             self.scan_status.setText("年齢制限: 購入不可")
-            self.scan_status.setStyleSheet(
-                f"color:{COLORS['danger']}; background:transparent; border:none;")
+            set_style_prop(self.scan_status, "tone", "danger")
             self.scan_sub.setText("20歳未満のため購入できません")
 
-            self.scan_frame.setStyleSheet(f"""
-                QFrame {{
-                    background: rgba(239, 68, 68, 0.06);
-                    border: 3px solid {COLORS['danger']};
-                    border-radius: 16px;
-                }}
-            """)
+            set_style_prop(self.scan_frame, "state", "danger")
 
             self.result_icon.setText("⛔")
             self.result_text.setText(f"{person['name']}  ─  {person['age']}歳")
-            self.result_text.setStyleSheet(
-                f"color:{COLORS['danger']}; background:transparent; border:none;")
+            set_style_prop(self.result_text, "tone", "danger")
             self.result_detail.setText(
                 f"生年月日: {person['dob']}\n"
                 f"20歳未満のお客様は年齢制限商品を購入できません"
             )
-            self.result_frame.setStyleSheet(f"""
-                QFrame {{
-                    background: rgba(239, 68, 68, 0.08);
-                    border: 2px solid {COLORS['danger']};
-                    border-radius: 12px;
-                }}
-            """)
+            set_style_prop(self.result_frame, "state", "danger")
 
             self.proceed_btn.setVisible(False)
+            self.card_read.emit("denied")
 
-    def closeEvent(self, event):
+    def _disarm(self):
+        # A read still in flight belongs to the customer who just left.
+        self._scan_seq += 1
         if self.scan_animation_timer:
             self.scan_animation_timer.stop()
+
+    def closeEvent(self, event):
+        self._disarm()
         event.accept()
 
     def reject(self):
-        if self.scan_animation_timer:
-            self.scan_animation_timer.stop()
+        self._disarm()
         super().reject()
 
     def accept(self):
-        if self.scan_animation_timer:
-            self.scan_animation_timer.stop()
+        self._disarm()
         super().accept()
 
 
 # ================= CAMERA VERIFICATION DIALOG =================
-class CameraVerificationDialog(QDialog):
+class CameraVerificationDialog(KioskDialog):
     """Camera opens only during payment for age verification."""
 
+    # Emitted once per session, when the first age verdict is shown
+    verdict_ready = pyqtSignal()
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setWindowTitle("📷 年齢確認")
         self.setFixedSize(620, 660)
-        self.setWindowFlags(
-            Qt.WindowType.Dialog | Qt.WindowType.FramelessWindowHint
-        )
-        self.setAttribute(Qt.WidgetAttribute.WA_TranslucentBackground)
 
         self.detected_age = None
         self.detected_age_text = None
+        self.detected_confidence = None
+        self.last_face = None
         self.cap = None
-        self.timer = None
-        self.face_cascade = None
+        self.detector = None
         self.age_net = None
+        self.quality = None
+        self.recording = None
+        self.verdict = face_quality.VerdictAccumulator(
+            len(AGE_LIST), VERDICT_MIN_WEIGHT)
+        self.age_cache = (age_cache.AgeCache(AGE_CACHE_SIZE)
+                          if AGE_CACHE_SIZE > 0 else None)
+        # One timer and one preview buffer for the life of the dialog:
+        # a kiosk runs for weeks, so nothing per-session or per-frame is
+        # left for the garbage collector or Qt's parent tree to catch.
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self._update_frame)
+        self._view = None
+        self._view_image = None
+        self._camera_started = None
+        self._last_face_at = None
+        self.presence = (presence.PresenceGate(PRESENCE_HOLD_SECONDS)
+                         if PRESENCE else None)
+        self._active = True
 
         self._build()
+        self.reset()
+
+    def reset(self):
+        """Clear the previous customer's verdict and preview."""
+        self._mark_open()
+        self._forget_face()
+        self.camera_label.clear()
+        self.camera_label.setText("カメラ起動中...")
+        self._show_searching()
+
+    def _forget_verdict(self):
+        self.detected_age = None
+        self.detected_age_text = None
+        self.detected_confidence = None
+        self.last_face = None
+        self.verdict.reset()
+        if self.age_cache is not None:
+            self.age_cache.clear()
+
+    def _forget_face(self):
+        """Drop the verdict along with the face it was built from."""
+        self._forget_verdict()
+        self._last_face_at = None
+
+    def face_recent(self):
+        """Whether a usable face was in view within FACE_LOST_SECONDS."""
+        return (self._last_face_at is not None and
+                time.perf_counter() - self._last_face_at <= FACE_LOST_SECONDS)
+
+    def _show_searching(self):
+        self.status_icon.setText("⏳")
+        self.status_text.setText("顔を検出しています...")
+        set_style_prop(self.status_text, "tone", "dim")
+        set_style_prop(self.status_frame, "state", "idle")
+        self.confirm_btn.setEnabled(False)
+        self.confirm_btn.setText("✓  確認完了")
 
     def _build(self):
         outer = QVBoxLayout(self)
         outer.setContentsMargins(0, 0, 0, 0)
 
-        self.main_card = QFrame()
-        self.main_card.setStyleSheet(f"""
-            QFrame {{
-                background: {COLORS['panel']};
-                border: 3px solid {COLORS['camera_border']};
-                border-radius: 20px;
-            }}
-        """)
-        self.main_card.setGraphicsEffect(make_shadow("#8B5CF660", 36, 0, 8))
+        self.main_card = themed(QFrame(), role="card", tone="camera")
+        apply_shadow(self.main_card, "#8B5CF660", 36, 0, 8)
 
         layout = QVBoxLayout(self.main_card)
         layout.setContentsMargins(28, 24, 28, 24)
         layout.setSpacing(14)
 
         # Header
-        hdr = QFrame()
-        hdr.setStyleSheet(f"""
-            QFrame {{
-                background: qlineargradient(
-                    x1:0, y1:0, x2:1, y2:0,
-                    stop:0 {COLORS['header_bg']},
-                    stop:1 {COLORS['header_bg2']}
-                );
-                border-radius: 14px; border: none;
-            }}
-        """)
+        hdr = themed(QFrame(), role="banner", tone="camera")
         hdr_layout = QVBoxLayout(hdr)
         hdr_layout.setContentsMargins(20, 16, 20, 16)
         hdr_layout.setSpacing(4)
@@ -684,58 +1187,38 @@ class CameraVerificationDialog(QDialog):
         t = QLabel("📷  年齢確認カメラ")
         t.setFont(QFont("Segoe UI", 20, QFont.Weight.Bold))
         t.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        t.setStyleSheet("color:white; background:transparent; border:none;")
+        t.setProperty("tone", "white")
 
         s = QLabel("顔をカメラに向けてください")
         s.setFont(QFont("Segoe UI", 12))
         s.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        s.setStyleSheet(
-            "color:rgba(255,255,255,0.65); background:transparent; border:none;")
+        s.setProperty("tone", "white_dim")
 
         hdr_layout.addWidget(t)
         hdr_layout.addWidget(s)
 
         # Camera
-        cam_frame = QFrame()
-        cam_frame.setStyleSheet(f"""
-            QFrame {{
-                background: #000;
-                border: 3px solid {COLORS['camera_border']};
-                border-radius: 14px;
-            }}
-        """)
+        cam_frame = themed(QFrame(), name="cameraFrame")
         cam_inner = QVBoxLayout(cam_frame)
         cam_inner.setContentsMargins(4, 4, 4, 4)
 
-        self.camera_label = QLabel("カメラ起動中...")
+        self.camera_label = themed(QLabel(), name="cameraView")
         self.camera_label.setFixedSize(540, 360)
         self.camera_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.camera_label.setFont(QFont("Segoe UI", 14))
-        self.camera_label.setStyleSheet(
-            "background:#000; border-radius:10px; border:none; color:#64748B;")
         cam_inner.addWidget(self.camera_label,
                             alignment=Qt.AlignmentFlag.AlignCenter)
 
         # Status
-        self.status_frame = QFrame()
-        self.status_frame.setStyleSheet(f"""
-            QFrame {{
-                background: {COLORS['list_bg']};
-                border: 2px solid {COLORS['panel_border']};
-                border-radius: 12px;
-            }}
-        """)
+        self.status_frame = themed(QFrame(), role="status")
         st_layout = QHBoxLayout(self.status_frame)
         st_layout.setContentsMargins(18, 14, 18, 14)
 
-        self.status_icon = QLabel("⏳")
+        self.status_icon = QLabel()
         self.status_icon.setFont(QFont("Segoe UI", 24))
-        self.status_icon.setStyleSheet("background:transparent; border:none;")
 
-        self.status_text = QLabel("顔を検出しています...")
+        self.status_text = QLabel()
         self.status_text.setFont(QFont("Segoe UI", 14, QFont.Weight.Bold))
-        self.status_text.setStyleSheet(
-            f"color:{COLORS['text_dim']}; background:transparent; border:none;")
 
         st_layout.addWidget(self.status_icon)
         st_layout.addWidget(self.status_text, 1)
@@ -744,17 +1227,10 @@ class CameraVerificationDialog(QDialog):
         btn_layout = QHBoxLayout()
         btn_layout.setSpacing(12)
 
-        cancel_btn = make_btn(
-            "✕  キャンセル",
-            COLORS["danger"], COLORS["danger_hover"], COLORS["danger_pressed"]
-        )
+        cancel_btn = make_btn("✕  キャンセル", "danger")
         cancel_btn.clicked.connect(self.reject)
 
-        self.confirm_btn = make_btn(
-            "✓  確認完了",
-            COLORS["success"], COLORS["success_hover"], COLORS["success_pressed"]
-        )
-        self.confirm_btn.setEnabled(False)
+        self.confirm_btn = make_btn("", "success")
         self.confirm_btn.clicked.connect(self.accept)
 
         btn_layout.addWidget(cancel_btn)
@@ -767,152 +1243,243 @@ class CameraVerificationDialog(QDialog):
 
         outer.addWidget(self.main_card)
 
-    def start_camera(self, face_cascade, age_net):
-        self.face_cascade = face_cascade
+    def start_camera(self, detector, age_net, cap=None, quality=None):
+        self.detector = detector
         self.age_net = age_net
+        self.quality = quality or face_quality.FaceQualityScorer()
+        self._camera_started = time.perf_counter()
 
-        self.cap = cv2.VideoCapture(0)
+        self.cap = cap if cap is not None else open_camera()
         if not self.cap.isOpened():
-            logger.error("Camera failed to open in verification")
+            camera_logger.error("Camera failed to open in verification")
             self.status_icon.setText("❌")
             self.status_text.setText("カメラを開けません")
-            self.status_text.setStyleSheet(
-                f"color:{COLORS['danger']}; background:transparent; border:none;")
+            set_style_prop(self.status_text, "tone", "danger")
             return False
 
-        self.timer = QTimer()
-        self.timer.timeout.connect(self._update_frame)
+        if self.presence is not None:
+            self.presence.reset()
+        self._active = True
+        CAMERA_ACTIVE.set(1)
         self.timer.start(CAMERA_INTERVAL_MS)
-        logger.info("Verification camera started")
+        camera_logger.info("Verification camera started")
         return True
 
     def _update_frame(self):
+        with FRAME_TICK.time():
+            self._process_frame()
+
+    def _process_frame(self):
         if not self.cap or not self.cap.isOpened():
             return
 
-        ret, frame = self.cap.read()
+        with FRAME_STAGE["capture"].time():
+            ret, frame = self.cap.read()
         if not ret:
             return
 
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = self.face_cascade.detectMultiScale(
-            gray, FACE_SCALE_FACTOR, FACE_MIN_NEIGHBORS
-        )
+        if self.presence is not None:
+            with FRAME_STAGE["presence"].time():
+                active = self.presence.update(frame)
+            if active != self._active:
+                self._set_active(active)
+            if not active:
+                self._render(frame)
+                return
 
-        detected = False
+        with FRAME_STAGE["detect"].time():
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            faces = self.detector.detect(frame, gray)
 
-        for (x, y, w, h) in faces:
-            face_roi = frame[y:y + h, x:x + w]
-            blob = cv2.dnn.blobFromImage(
-                face_roi, 1.0, (227, 227),
-                MODEL_MEAN_VALUES, swapRB=False
-            )
-            self.age_net.setInput(blob)
-            preds = self.age_net.forward()
-            age_text = AGE_LIST[preds[0].argmax()]
-
-            if age_text in ["(0-2)", "(4-6)", "(8-12)", "(15-20)"]:
-                self.detected_age = 16
-            elif age_text == "(25-32)":
-                self.detected_age = 28
-            elif age_text == "(38-43)":
-                self.detected_age = 40
-            elif age_text == "(48-53)":
-                self.detected_age = 50
-            else:
-                self.detected_age = 70
-
-            self.detected_age_text = age_text
-
-            if self.detected_age >= CONFIDENT_AGE:
-                box_color = (16, 185, 129)
-                self.status_icon.setText("🟢")
-                self.status_text.setText(f"年齢確認 OK ─ 推定: {age_text}")
-                self.status_text.setStyleSheet(
-                    f"color:{COLORS['success']}; background:transparent; border:none;")
-                self.status_frame.setStyleSheet(f"""
-                    QFrame {{
-                        background: rgba(16,185,129,0.08);
-                        border: 2px solid {COLORS['success']};
-                        border-radius: 12px;
-                    }}
-                """)
-                self.confirm_btn.setEnabled(True)
-                self.confirm_btn.setText("✓  確認完了  ─  支払いへ")
-
-            elif self.detected_age >= LEGAL_AGE:
-                # Between 20-24: might be ok but need NFC
-                box_color = (245, 158, 11)
-                self.status_icon.setText("🟡")
-                self.status_text.setText(f"推定: {age_text} ─ NFC確認が必要")
-                self.status_text.setStyleSheet(
-                    f"color:{COLORS['warning']}; background:transparent; border:none;")
-                self.status_frame.setStyleSheet(f"""
-                    QFrame {{
-                        background: rgba(245,158,11,0.08);
-                        border: 2px solid {COLORS['warning']};
-                        border-radius: 12px;
-                    }}
-                """)
-                self.confirm_btn.setEnabled(True)
-                self.confirm_btn.setText("🪪  IDカードをスキャン")
+        frame_logger.debug("Frame: %d face(s)", len(faces),
+                           extra={"faces": len(faces)})
 
-            else:
-                box_color = (239, 68, 68)
-                self.status_icon.setText("🔴")
-                self.status_text.setText(f"年齢不足 ─ 推定: {age_text}")
-                self.status_text.setStyleSheet(
-                    f"color:{COLORS['danger']}; background:transparent; border:none;")
-                self.status_frame.setStyleSheet(f"""
-                    QFrame {{
-                        background: rgba(239,68,68,0.08);
-                        border: 2px solid {COLORS['danger']};
-                        border-radius: 12px;
-                    }}
-                """)
-                self.confirm_btn.setEnabled(True)
-                self.confirm_btn.setText("🪪  IDカードをスキャン")
+        if len(faces):
+            FACES_DETECTED.inc()
+            if self.presence is not None:
+                self.presence.keep_alive()
+        box, weight, reason = self._best_face(gray, faces)
 
-            cv2.rectangle(frame, (x, y), (x + w, y + h), box_color, 3)
-            cv2.putText(frame, age_text, (x, y - 12),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.9, box_color, 2)
-            detected = True
-            break
+        if self._last_face_at is not None and not self.face_recent():
+            # Nobody usable in view for a while; the verdict belonged to
+            # whoever was, and the next face may be someone else.
+            self._forget_face()
+            self._show_searching()
 
-        if not detected:
+        if box is not None:
+            self._last_face_at = time.perf_counter()
+            x, y, w, h = box
+            face_roi = frame[y:y + h, x:x + w]
+            probs = key = None
+            if self.age_cache is not None and self.verdict.ready:
+                # A hit is the same estimate again, not new evidence, so
+                # the verdict is still built from distinct forward passes.
+                key, probs = self.age_cache.lookup(gray, box)
+                AGE_CACHE_LOOKUPS["miss" if probs is None else "hit"].inc()
+            if probs is None:
+                with FRAME_STAGE["infer"].time():
+                    blob = cv2.dnn.blobFromImage(
+                        face_roi, 1.0, (227, 227),
+                        MODEL_MEAN_VALUES, swapRB=False
+                    )
+                    self.age_net.setInput(blob)
+                    probs = self.age_net.forward()[0].copy()
+                if key is not None:
+                    self.age_cache.store(key, probs)
+                self.verdict.add(probs, weight)
+            self.last_face = face_roi.copy()
+
+        first_verdict = False
+        if not len(faces):
+            self._show_searching()
+        elif self.verdict.ready:
+            first_verdict = self.detected_age is None
+            if first_verdict and self._camera_started:
+                VERDICT_SECONDS.observe(
+                    time.perf_counter() - self._camera_started)
+            box_color, label = self._show_verdict()
+        elif box is not None:
+            box_color, label = (139, 92, 246), None
             self.status_icon.setText("⏳")
-            self.status_text.setText("顔を検出しています...")
-            self.status_text.setStyleSheet(
-                f"color:{COLORS['text_dim']}; background:transparent; border:none;")
-            self.status_frame.setStyleSheet(f"""
-                QFrame {{
-                    background: {COLORS['list_bg']};
-                    border: 2px solid {COLORS['panel_border']};
-                    border-radius: 12px;
-                }}
-            """)
-            self.confirm_btn.setEnabled(False)
-            self.confirm_btn.setText("✓  確認完了")
-
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        h, w, ch = rgb.shape
-        img = QImage(rgb.data, w, h, ch * w,
-                     QImage.Format.Format_RGB888).copy()
-        scaled = QPixmap.fromImage(img).scaled(
-            self.camera_label.size(),
-            Qt.AspectRatioMode.KeepAspectRatio,
-            Qt.TransformationMode.SmoothTransformation,
-        )
-        self.camera_label.setPixmap(scaled)
+            self.status_text.setText(
+                f"年齢を推定しています... {self.verdict.progress:.0%}")
+            set_style_prop(self.status_text, "tone", "dim")
+            set_style_prop(self.status_frame, "state", "idle")
+        else:
+            self.status_icon.setText("👤")
+            self.status_text.setText(QUALITY_HINTS[reason])
+            set_style_prop(self.status_text, "tone", "warning")
+            set_style_prop(self.status_frame, "state", "idle")
+
+        if box is not None:
+            cv2.rectangle(frame, (x, y), (x + w, y + h), box_color, 3)
+            if label:
+                cv2.putText(frame, label, (x, y - 12),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.9, box_color, 2)
+
+        if self.recording is not None:
+            self.recording.add(
+                frame, key=(self.detected_age_text, reason),
+                faces=[list(b) for b in faces], box=box,
+                weight=round(weight, 3), reason=reason,
+                verdict=self.detected_age_text,
+                progress=round(self.verdict.progress, 3))
+
+        self._render(frame)
+
+        if first_verdict:
+            self.verdict_ready.emit()
+
+    def _render(self, frame):
+        if not self.isVisible():   # hidden while verifying speculatively
+            return
+        with FRAME_STAGE["render"].time():
+            view = self._view_buffer(frame.shape)
+            h, w = view.shape[:2]
+            # Scale while still BGR, then convert into the buffer the
+            # QImage already wraps; fromImage makes the only copy.
+            cv2.cvtColor(cv2.resize(frame, (w, h),
+                                    interpolation=cv2.INTER_LINEAR),
+                         cv2.COLOR_BGR2RGB, dst=view)
+            self.camera_label.setPixmap(QPixmap.fromImage(self._view_image))
+
+    def _view_buffer(self, shape):
+        """RGB buffer fitted to the preview label, reallocated on resize."""
+        fh, fw = shape[:2]
+        size = self.camera_label.size()
+        scale = min(size.width() / fw, size.height() / fh)
+        w, h = max(1, int(fw * scale)), max(1, int(fh * scale))
+        if self._view is None or self._view.shape[:2] != (h, w):
+            self._view = np.empty((h, w, 3), np.uint8)
+            self._view_image = QImage(self._view.data, w, h, 3 * w,
+                                      QImage.Format.Format_RGB888)
+        return self._view
+
+    def _set_active(self, active):
+        """Switch between full-rate analysis and the low-power idle tick."""
+        self._active = active
+        if self.timer.isActive():
+            self.timer.setInterval(
+                CAMERA_INTERVAL_MS if active else IDLE_INTERVAL_MS)
+        CAMERA_ACTIVE.set(1 if active else 0)
+        if not active:
+            # Nobody is in front of the camera: the evidence belongs to
+            # someone who has left.
+            self._forget_face()
+            self._show_searching()
+        camera_logger.debug("Camera %s", "active" if active else "idle")
+
+    def _best_face(self, gray, faces):
+        """
+        Largest box that passes the quality gate and its weight, plus the
+        rejection reason of the largest box when none passes.
+        """
+        reason = None
+        with FRAME_STAGE["quality"].time():
+            for box in sorted(faces, key=lambda b: b[2] * b[3], reverse=True):
+                q = self.quality.score(gray, box)
+                if q.reason is None:
+                    return tuple(int(v) for v in box), q.score, reason
+                FACES_REJECTED[q.reason].inc()
+                reason = reason or q.reason
+        return None, 0.0, reason
+
+    def _show_verdict(self):
+        """Show the accumulated verdict; returns (box colour, box label)."""
+        idx, self.detected_confidence = self.verdict.best()
+        age_text = AGE_LIST[idx]
+
+        if age_text in ["(0-2)", "(4-6)", "(8-12)", "(15-20)"]:
+            self.detected_age = 16
+        elif age_text == "(25-32)":
+            self.detected_age = 28
+        elif age_text == "(38-43)":
+            self.detected_age = 40
+        elif age_text == "(48-53)":
+            self.detected_age = 50
+        else:
+            self.detected_age = 70
+
+        self.detected_age_text = age_text
+
+        if self.detected_age >= CONFIDENT_AGE:
+            box_color = (16, 185, 129)
+            self.status_icon.setText("🟢")
+            self.status_text.setText(f"年齢確認 OK ─ 推定: {age_text}")
+            set_style_prop(self.status_text, "tone", "success")
+            set_style_prop(self.status_frame, "state", "success")
+            self.confirm_btn.setEnabled(True)
+            self.confirm_btn.setText("✓  確認完了  ─  支払いへ")
+
+        elif self.detected_age >= LEGAL_AGE:
+            # Between 20-24: might be ok but need NFC
+            box_color = (245, 158, 11)
+            self.status_icon.setText("🟡")
+            self.status_text.setText(f"推定: {age_text} ─ NFC確認が必要")
+            set_style_prop(self.status_text, "tone", "warning")
+            set_style_prop(self.status_frame, "state", "warning")
+            self.confirm_btn.setEnabled(True)
+            self.confirm_btn.setText("🪪  IDカードをスキャン")
+
+        else:
+            box_color = (239, 68, 68)
+            self.status_icon.setText("🔴")
+            self.status_text.setText(f"年齢不足 ─ 推定: {age_text}")
+            set_style_prop(self.status_text, "tone", "danger")
+            set_style_prop(self.status_frame, "state", "danger")
+            self.confirm_btn.setEnabled(True)
+            self.confirm_btn.setText("🪪  IDカードをスキャン")
+
+        return box_color, age_text
 
     def _stop_camera(self):
-        if self.timer:
-            self.timer.stop()
-            self.timer = None
+        CAMERA_ACTIVE.set(0)
+        self.timer.stop()
         if self.cap:
             self.cap.release()
             self.cap = None
-        logger.info("Verification camera stopped")
+        self.camera_label.clear()   # don't keep the last frame around
+        camera_logger.info("Verification camera stopped")
 
     def closeEvent(self, event):
         self._stop_camera()
@@ -928,45 +1495,33 @@ class CameraVerificationDialog(QDialog):
 
 
 # ================= UNDERAGE ALERT DIALOG =================
-class UnderageAlertDialog(QDialog):
+class UnderageAlertDialog(KioskDialog):
     """Red-themed alert for confirmed underage after NFC scan."""
 
-    def __init__(self, name, age, parent=None):
+    def __init__(self, name="", age=0, parent=None):
         super().__init__(parent)
         self.setWindowTitle("⛔ 年齢制限")
         self.setFixedSize(560, 480)
-        self.setWindowFlags(
-            Qt.WindowType.Dialog | Qt.WindowType.FramelessWindowHint
-        )
-        self.setAttribute(Qt.WidgetAttribute.WA_TranslucentBackground)
-        self._build(name, age)
+        self._build()
+        self.reset(name, age)
+
+    def reset(self, name="", age=0):
+        self._mark_open()
+        self.info.setText(f"👤  {name}  ─  {age}歳")
 
-    def _build(self, name, age):
+    def _build(self):
         outer = QVBoxLayout(self)
         outer.setContentsMargins(0, 0, 0, 0)
 
-        card = QFrame()
-        card.setStyleSheet(f"""
-            QFrame {{
-                background: {COLORS['danger_bg']};
-                border: 3px solid {COLORS['danger']};
-                border-radius: 20px;
-            }}
-        """)
-        card.setGraphicsEffect(make_shadow("#EF444480", 40, 0, 8))
+        card = themed(QFrame(), role="card", tone="danger")
+        apply_shadow(card, "#EF444480", 40, 0, 8)
 
         layout = QVBoxLayout(card)
         layout.setContentsMargins(36, 30, 36, 30)
         layout.setSpacing(14)
 
         # Banner
-        banner = QFrame()
-        banner.setStyleSheet(f"""
-            QFrame {{
-                background: {COLORS['danger']};
-                border-radius: 14px; border: none;
-            }}
-        """)
+        banner = themed(QFrame(), role="banner", tone="danger")
         b_layout = QVBoxLayout(banner)
         b_layout.setContentsMargins(20, 18, 20, 18)
         b_layout.setSpacing(6)
@@ -974,36 +1529,29 @@ class UnderageAlertDialog(QDialog):
         icon_lbl = QLabel("⛔")
         icon_lbl.setFont(QFont("Segoe UI", 48))
         icon_lbl.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        icon_lbl.setStyleSheet(
-            "background:transparent; border:none; color:white;")
+        icon_lbl.setProperty("tone", "white")
 
         title = QLabel("購入できません")
         title.setFont(QFont("Segoe UI", 24, QFont.Weight.Bold))
         title.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        title.setStyleSheet(
-            "color:white; background:transparent; border:none; letter-spacing:2px;")
+        title.setProperty("tone", "white")
+        title.setProperty("role", "title")
 
         sub = QLabel("PURCHASE DENIED")
         sub.setFont(QFont("Segoe UI", 11, QFont.Weight.Bold))
         sub.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        sub.setStyleSheet(
-            "color:rgba(255,255,255,0.7); background:transparent; border:none; letter-spacing:3px;")
+        sub.setProperty("tone", "white_dim")
+        sub.setProperty("role", "caps")
 
         b_layout.addWidget(icon_lbl)
         b_layout.addWidget(title)
         b_layout.addWidget(sub)
 
         # Person info
-        info = QLabel(f"👤  {name}  ─  {age}歳")
-        info.setFont(QFont("Segoe UI", 16, QFont.Weight.Bold))
-        info.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        info.setStyleSheet(f"""
-            color: {COLORS['danger']};
-            background: rgba(239, 68, 68, 0.1);
-            border: 2px solid {COLORS['danger_border']};
-            border-radius: 10px;
-            padding: 14px;
-        """)
+        self.info = QLabel()
+        self.info.setFont(QFont("Segoe UI", 16, QFont.Weight.Bold))
+        self.info.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.info.setProperty("role", "person")
 
         # Message
         msg = QLabel(
@@ -1015,31 +1563,14 @@ class UnderageAlertDialog(QDialog):
         msg.setFont(QFont("Segoe UI", 14))
         msg.setAlignment(Qt.AlignmentFlag.AlignCenter)
         msg.setWordWrap(True)
-        msg.setStyleSheet(
-            f"color:{COLORS['restricted_fg']}; background:transparent; border:none; line-height:1.5;")
+        msg.setProperty("tone", "restricted")
 
         # Close button
-        close_btn = QPushButton("✕  閉じる")
-        close_btn.setCursor(Qt.CursorShape.PointingHandCursor)
-        close_btn.setFont(QFont("Segoe UI", 14, QFont.Weight.Bold))
+        close_btn = make_btn("✕  閉じる", "danger")
         close_btn.clicked.connect(self.accept)
-        close_btn.setStyleSheet(f"""
-            QPushButton {{
-                background: {COLORS['danger']};
-                color: white;
-                border: none;
-                border-radius: 12px;
-                padding: 16px 24px;
-                font-size: 15px;
-                font-weight: 700;
-            }}
-            QPushButton:hover {{ background: {COLORS['danger_hover']}; }}
-            QPushButton:pressed {{ background: {COLORS['danger_pressed']}; }}
-        """)
-        close_btn.setGraphicsEffect(make_shadow("#EF444460", 16, 0, 4))
 
         layout.addWidget(banner)
-        layout.addWidget(info)
+        layout.addWidget(self.info)
         layout.addWidget(msg)
         layout.addStretch()
         layout.addWidget(close_btn)
@@ -1047,32 +1578,142 @@ class UnderageAlertDialog(QDialog):
         outer.addWidget(card)
 
 
+# ================= PAYMENT PROGRESS DIALOG =================
+class PaymentProgressDialog(KioskDialog):
+    """
+    Shown while the card is authorised. The gateway answers on its own
+    thread, so the dialog stays live and can be cancelled at any point;
+    after a decline or an outage it explains and waits to be dismissed.
+    """
+
+    FAILURES = {
+        "declined": ("カードが承認されませんでした",
+                     "別のカードをお試しいただくか、\nスタッフにお声がけください"),
+        "failed": ("決済サービスに接続できません",
+                   "しばらくしてからもう一度お試しいただくか、\n"
+                   "スタッフにお声がけください"),
+    }
+
+    def __init__(self, total=0, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("💳 お支払い")
+        self.setFixedSize(480, 420)
+        self.failed = False
+        self._dots = 0
+        self.dots_timer = QTimer(self)
+        self.dots_timer.timeout.connect(self._tick)
+        self._build()
+        self.reset(total)
+
+    def reset(self, total=0):
+        self._mark_open()
+        self.failed = False
+        self._dots = 0
+        self.icon.setText("💳")
+        self.amount.setText(f"¥{total:,}")
+        self.status.setText("カード承認中")
+        set_style_prop(self.status, "tone", "nfc")
+        self.sub.setText("Authorising payment — please wait")
+        self.cancel_btn.setText("✕  キャンセル")
+        self.dots_timer.start(400)
+
+    def show_failure(self, outcome):
+        """`outcome` is "declined" or "failed"."""
+        self.failed = True
+        self.dots_timer.stop()
+        message, detail = self.FAILURES[outcome]
+        self.icon.setText("⚠️")
+        self.status.setText(message)
+        set_style_prop(self.status, "tone", "danger")
+        self.sub.setText(detail)
+        self.cancel_btn.setText("戻る")
+
+    def _tick(self):
+        self._dots = (self._dots + 1) % 4
+        self.status.setText("カード承認中" + "・" * self._dots)
+
+    def hideEvent(self, event):
+        self.dots_timer.stop()
+        super().hideEvent(event)
+
+    def _build(self):
+        outer = QVBoxLayout(self)
+        outer.setContentsMargins(0, 0, 0, 0)
+
+        card = themed(QFrame(), role="card", tone="nfc")
+        apply_shadow(card, "#0EA5E960", 36, 0, 8)
+
+        layout = QVBoxLayout(card)
+        layout.setContentsMargins(36, 30, 36, 30)
+        layout.setSpacing(14)
+
+        self.icon = QLabel()
+        self.icon.setFont(QFont("Segoe UI", 48))
+        self.icon.setAlignment(Qt.AlignmentFlag.AlignCenter)
+
+        self.amount = QLabel()
+        self.amount.setFont(QFont("Segoe UI", 26, QFont.Weight.Bold))
+        self.amount.setAlignment(Qt.AlignmentFlag.AlignCenter)
+
+        self.status = QLabel()
+        self.status.setFont(QFont("Segoe UI", 16, QFont.Weight.Bold))
+        self.status.setAlignment(Qt.AlignmentFlag.AlignCenter)
+
+        self.sub = QLabel()
+        self.sub.setFont(QFont("Segoe UI", 12))
+        self.sub.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.sub.setWordWrap(True)
+        self.sub.setProperty("tone", "dim")
+
+        self.cancel_btn = make_btn("", "muted")
+        self.cancel_btn.clicked.connect(self.reject)
+
+        layout.addWidget(self.icon)
+        layout.addWidget(self.amount)
+        layout.addWidget(self.status)
+        layout.addWidget(self.sub)
+        layout.addStretch()
+        layout.addWidget(self.cancel_btn)
+
+        outer.addWidget(card)
+
+
 # ================= SUCCESS DIALOG =================
-class PaymentSuccessDialog(QDialog):
+class PaymentSuccessDialog(KioskDialog):
     """Green-themed payment success dialog."""
 
-    def __init__(self, count, total, verified_name=None, parent=None):
+    def __init__(self, count=0, total=0, verified_name=None, taxes=(),
+                 parent=None):
         super().__init__(parent)
         self.setFixedSize(480, 440)
-        self.setWindowFlags(
-            Qt.WindowType.Dialog | Qt.WindowType.FramelessWindowHint
+        self._build()
+        self.reset(count, total, verified_name, taxes)
+
+    def reset(self, count=0, total=0, verified_name=None, taxes=()):
+        self._mark_open()
+        verified_text = ""
+        if verified_name:
+            verified_text = f"本人確認: {verified_name} 様\n"
+        # One line per tax rate, as on the receipt
+        tax_text = "".join(
+            f"（{t.rate}%対象 ¥{t.amount:,}  内消費税 ¥{t.tax:,}）\n"
+            for t in taxes)
+
+        self.detail.setText(
+            f"{verified_text}"
+            f"商品数：{count} 点\n"
+            f"合計金額：¥{total:,}\n"
+            f"{tax_text}\n"
+            f"ありがとうございます！\n"
+            f"またのご来店をお待ちしております。"
         )
-        self.setAttribute(Qt.WidgetAttribute.WA_TranslucentBackground)
-        self._build(count, total, verified_name)
 
-    def _build(self, count, total, verified_name):
+    def _build(self):
         outer = QVBoxLayout(self)
         outer.setContentsMargins(0, 0, 0, 0)
 
-        card = QFrame()
-        card.setStyleSheet(f"""
-            QFrame {{
-                background: {COLORS['panel']};
-                border: 3px solid {COLORS['success']};
-                border-radius: 20px;
-            }}
-        """)
-        card.setGraphicsEffect(make_shadow("#10B98160", 36, 0, 8))
+        card = themed(QFrame(), role="card", tone="success")
+        apply_shadow(card, "#10B98160", 36, 0, 8)
 
         layout = QVBoxLayout(card)
         layout.setContentsMargins(36, 30, 36, 30)
@@ -1081,46 +1722,476 @@ class PaymentSuccessDialog(QDialog):
         icon_lbl = QLabel("✅")
         icon_lbl.setFont(QFont("Segoe UI", 52))
         icon_lbl.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        icon_lbl.setStyleSheet("background:transparent; border:none;")
 
         title = QLabel("お支払い完了")
         title.setFont(QFont("Segoe UI", 24, QFont.Weight.Bold))
         title.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        title.setStyleSheet(
-            f"color:{COLORS['success']}; background:transparent; border:none;")
+        title.setProperty("tone", "success")
 
-        verified_text = ""
-        if verified_name:
-            verified_text = f"本人確認: {verified_name} 様\n"
+        self.detail = QLabel()
+        self.detail.setFont(QFont("Segoe UI", 14))
+        self.detail.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.detail.setWordWrap(True)
+        self.detail.setProperty("tone", "dim")
 
-        detail = QLabel(
-            f"{verified_text}"
-            f"商品数：{count} 点\n"
-            f"合計金額：¥{total:,}\n\n"
-            f"ありがとうございます！\n"
-            f"またのご来店をお待ちしております。"
-        )
-        detail.setFont(QFont("Segoe UI", 14))
-        detail.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        detail.setWordWrap(True)
-        detail.setStyleSheet(
-            f"color:{COLORS['text_dim']}; background:transparent; border:none; line-height:1.6;")
-
-        ok_btn = make_btn(
-            "OK", COLORS["success"], COLORS["success_hover"], COLORS["success_pressed"])
+        ok_btn = make_btn("OK", "success")
         ok_btn.clicked.connect(self.accept)
 
         layout.addWidget(icon_lbl)
         layout.addWidget(title)
-        layout.addWidget(detail)
+        layout.addWidget(self.detail)
         layout.addStretch()
         layout.addWidget(ok_btn)
 
         outer.addWidget(card)
 
 
+# ================= DIAGNOSTICS OVERLAY =================
+class DiagnosticsOverlay(QLabel):
+    """
+    Hidden metrics readout drawn over the main window (Ctrl+Shift+D).
+    Showing it turns the metrics registry on; it only refreshes while visible.
+    """
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.setObjectName("diagnostics")
+        self.setFont(QFont("Consolas", 10))
+        self.setAttribute(Qt.WidgetAttribute.WA_TransparentForMouseEvents)
+        self.hide()
+
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self._refresh)
+
+    def toggle(self):
+        if self.isVisible():
+            self.refresh_timer.stop()
+            self.hide()
+            return
+        metrics.REGISTRY.enabled = True
+        self._refresh()
+        self.move(24, 100)
+        self.show()
+        self.raise_()
+        self.refresh_timer.start(1000)
+
+    def _refresh(self):
+        lines = metrics.REGISTRY.summary_lines() or ["(no samples yet)"]
+        self.setText("\n".join(lines))
+        self.adjustSize()
+
+
+# ================= PAYMENT FLOW =================
+class PaymentFlow(QObject):
+    """
+    One checkout as an event-driven state machine, advanced by dialog
+    signals instead of nested exec() loops.
+
+    With restricted items the camera and the NFC reader are up side by
+    side: the reader is armed while the camera is still estimating and
+    the first conclusive result decides. A confident camera verdict or
+    an adult ID card passes, an underage card refuses; a camera verdict
+    under 25 closes the camera and leaves the reader waiting.
+
+    With POS_SPECULATIVE the camera already runs, hidden, while a
+    restricted item is in the cart; payment adopts it, and a verdict
+    settled by then decides without the camera dialog ever showing.
+
+    With a payment gateway configured the card is authorised before the
+    sale is recorded. The gateway answers on its worker thread through
+    `authorised`; the customer can cancel while it is in flight.
+
+        idle ─▶ verifying ─┬─▶ authorising ─┬─▶ complete ─▶ idle  ("paid")
+              │            │                ├─▶ declined ─▶ idle  ("declined"
+              │            │                │                      or "failed")
+              │            │                └─────────────▶ idle  ("cancelled")
+              │            ├─▶ alert ───────────────────▶ idle  ("denied")
+              │            └────────────────────────────▶ idle  ("cancelled")
+              └──────────────▶ authorising     (nothing restricted)
+
+    Without a gateway `authorising` is skipped.
+    """
+
+    # Emitted on the way back to idle with the checkout outcome
+    finished = pyqtSignal(str)
+    # (job, AuthResult) from the gateway worker; queued to the GUI thread
+    authorised = pyqtSignal(object, object)
+
+    def __init__(self, win):
+        super().__init__(win)
+        self.win = win
+        self.state = "idle"
+        self.camera = None          # camera dialog while its step is open
+        self.nfc = None             # NFC dialog while the reader is armed
+        self.nfc_required = False   # camera gave up on its own
+        self.count = 0
+        self.total = 0
+        self.taxes = ()
+        self.discount = 0
+        self.verified_by = None     # check that decided: "camera" or "nfc"
+        self.speculating = False
+        self.job = None             # gateway authorisation in flight
+        self.verified_name = None
+        self._failure = None
+        self._connected = False
+        self._started = self._camera_started = 0.0
+        self._nfc_started = self._complete_started = 0.0
+        self._authorise_started = 0.0
+        self.authorised.connect(self._on_authorised)
+        self._speculation_timer = QTimer(self)
+        self._speculation_timer.setSingleShot(True)
+        self._speculation_timer.timeout.connect(self._expire_speculation)
+
+    @property
+    def active(self):
+        return self.state != "idle"
+
+    def start(self):
+        win = self.win
+        self._connect()
+        self._started = time.perf_counter()
+        totals = win.pricing.totals()
+        self.count, self.total, self.taxes, self.discount = (
+            totals.count, totals.total, totals.taxes, totals.discount)
+        self.verified_by = None
+        if not any(i["restricted"] for i in win.cart):
+            self._complete()
+            return
+
+        self.state = "verifying"
+        self.nfc_required = False
+        win.header_status.setText("●  年齢確認中...")
+        set_style_prop(win.header_status, "tone", "warning")
+
+        self.nfc = win._dialog("nfc")
+        self.nfc.reset()
+        self._nfc_started = time.perf_counter()
+
+        cam = win._dialog("camera")
+        self._camera_started = time.perf_counter()
+        adopted = self.speculating
+        if adopted:
+            if cam.detected_age is not None and not cam.face_recent():
+                # Settled on someone seen while browsing who is no longer
+                # in front of the camera: whoever pays must show a face.
+                cam._forget_face()
+            self._stop_speculation(
+                "ready" if cam.detected_age is not None else "pending")
+            self.camera = cam
+        else:
+            cam.reset()
+            if cam.start_camera(win.face_detector, win.age_net,
+                                win.camera_factory(), win.quality_scorer):
+                self.camera = cam
+            else:
+                # Degrade to ID-only rather than turning the customer away.
+                cam._stop_camera()
+                win._audit_camera(cam, "unavailable")
+                self.nfc_required = True
+                self.nfc.show_camera_unavailable()
+
+        if self.camera is not None:
+            if win.recorder is not None:
+                cam.recording = win.recorder.begin(
+                    win.checkout_id, items=self.count, total=self.total)
+            if cam.detected_age is not None:
+                # Settled while the customer was still shopping.
+                self._on_verdict()
+                if self.state != "verifying":
+                    return
+            else:
+                if adopted:
+                    cam._mark_open()   # reset() marked it long ago
+                self._place(cam, -1)
+                cam.show()
+
+        self._place(self.nfc, 1 if self.camera is not None else 0)
+        self.nfc.show()
+        self.nfc.raise_()
+        self.nfc.activateWindow()
+
+    def speculate(self, wanted):
+        """
+        Start the hidden camera when the cart first holds a restricted
+        item, stop it when none is left. Only while idle.
+        """
+        if not SPECULATIVE or self.state != "idle":
+            return
+        if not wanted:
+            if self.speculating:
+                self._stop_speculation("dropped", release=True)
+            return
+        if self.speculating:
+            return
+        win = self.win
+        cam = win._dialog("camera")
+        cam.reset()
+        if not cam.start_camera(win.face_detector, win.age_net,
+                                win.camera_factory(), win.quality_scorer):
+            cam._stop_camera()
+            return
+        self._connect()
+        self.speculating = True
+        self._speculation_timer.start(int(SPECULATIVE_SECONDS * 1000))
+        camera_logger.info("Speculative verification started")
+
+    def _stop_speculation(self, result, release=False):
+        self.speculating = False
+        self._speculation_timer.stop()
+        SPECULATIONS[result].inc()
+        if release:
+            cam = self.win._dialog("camera")
+            cam._stop_camera()
+            cam.reset()
+
+    def _expire_speculation(self):
+        # The customer has wandered off; payment starts the camera afresh.
+        if self.speculating:
+            self._stop_speculation("expired", release=True)
+
+    def cancel(self):
+        """Abandon the checkout in progress, e.g. when the app closes."""
+        if self.speculating:
+            self._stop_speculation("dropped", release=True)
+        if self.state == "verifying":
+            if self.camera is not None:
+                self._end_camera("cancelled")
+            self._end_nfc("cancelled")
+            self._finish("cancelled")
+        elif self.state == "alert":
+            self.win._dialog("underage").accept()
+        elif self.state in ("authorising", "declined"):
+            self.win._dialog("progress").reject()
+        elif self.state == "complete":
+            self.win._dialog("success").accept()
+
+    def _connect(self):
+        if self._connected:
+            return
+        win = self.win
+        cam = win._dialog("camera")
+        cam.verdict_ready.connect(self._on_verdict)
+        cam.finished.connect(self._on_camera_finished)
+        nfc = win._dialog("nfc")
+        nfc.card_read.connect(self._on_card)
+        nfc.finished.connect(self._on_nfc_finished)
+        win._dialog("underage").finished.connect(self._on_alert_closed)
+        win._dialog("progress").finished.connect(self._on_progress_closed)
+        win._dialog("success").finished.connect(self._on_success_closed)
+        self._connected = True
+
+    def _place(self, dialog, side):
+        """Centre `dialog` on the window (side 0) or on its left/right half."""
+        area = self.win.frameGeometry()
+        x = area.center().x() + side * area.width() // 4 - dialog.width() // 2
+        y = area.center().y() - dialog.height() // 2
+        dialog.move(x, y)
+
+    # ── verifying ──
+    def _on_verdict(self):
+        cam = self.camera
+        if self.state != "verifying" or cam is None:
+            return
+        if not cam.face_recent():
+            # The face behind the verdict has left the camera.
+            cam._forget_face()
+            if cam.isVisible():
+                return   # keep looking
+        if cam.detected_age is not None and cam.detected_age >= CONFIDENT_AGE:
+            payment_logger.info(
+                "Age verified by camera: %s → direct payment",
+                cam.detected_age_text,
+                extra={"age_bucket": cam.detected_age_text})
+            self._end_camera("pass")
+            self._end_nfc("unused")
+            VERIFIED_BY["camera"].inc()
+            self.verified_by = "camera"
+            self._complete()
+            return
+
+        payment_logger.info(
+            "Age uncertain: %s → NFC scan required", cam.detected_age_text,
+            extra={"age_bucket": cam.detected_age_text})
+        self._end_camera("nfc_required")
+        self.nfc_required = True
+        self.nfc.show_estimate(cam.detected_age_text)
+        self.win.header_status.setText("●  NFC スキャン中...")
+        set_style_prop(self.win.header_status, "tone", "nfc")
+
+    def _on_camera_finished(self, result):
+        if self.state != "verifying" or self.camera is None:
+            return
+        if (result == QDialog.DialogCode.Accepted
+                and self.camera.detected_age is not None):
+            self._on_verdict()
+            return
+        payment_logger.info("Camera verification cancelled")
+        self._end_camera("cancelled")
+        self._end_nfc("cancelled")
+        self._finish("cancelled")
+
+    def _on_card(self, outcome):
+        if self.state != "verifying" or self.nfc is None:
+            return
+        if outcome == "unknown_card":
+            return   # the customer may try another card
+        nfc = self.nfc
+        if self.camera is not None:
+            self._end_camera("superseded")
+        self._end_nfc(outcome)
+        self.verified_by = "nfc"
+        if outcome == "verified":
+            VERIFIED_BY["nfc"].inc()
+            self._complete(nfc.verified_name)
+            return
+
+        payment_logger.warning(
+            "Underage blocked: %s (%s)", nfc.verified_name, nfc.verified_age,
+            extra={"verified_age": nfc.verified_age})
+        self.state = "alert"
+        self.win._reset_header()
+        alert = self.win._dialog("underage")
+        alert.reset(nfc.verified_name, nfc.verified_age)
+        alert.open()
+
+    def _on_nfc_finished(self, result):
+        # Accepting only follows a verified card, which moved on already.
+        if self.state != "verifying" or self.nfc is None:
+            return
+        payment_logger.info("NFC scan cancelled")
+        if self.camera is not None:
+            self._end_camera("cancelled")
+        self._end_nfc("cancelled")
+        self._finish("cancelled")
+
+    def _end_camera(self, outcome):
+        cam, self.camera = self.camera, None
+        PAYMENT_PHASE["camera"].observe(
+            time.perf_counter() - self._camera_started)
+        if cam.recording is not None:
+            cam.recording.finish(
+                outcome=outcome, verdict=cam.detected_age_text,
+                age=cam.detected_age)
+            cam.recording = None
+        self.win._audit_camera(cam, outcome)
+        cam.reject()   # also stops a camera that was never shown
+
+    def _end_nfc(self, outcome):
+        """Disarm the reader; audited only if it played a part."""
+        nfc, self.nfc = self.nfc, None
+        if nfc is None:
+            return
+        if outcome != "unused" and (self.nfc_required
+                                    or nfc.card_id is not None
+                                    or outcome != "cancelled"):
+            PAYMENT_PHASE["nfc"].observe(
+                time.perf_counter() - self._nfc_started)
+            self.win._audit_nfc(nfc, outcome)
+        if nfc.isVisible():
+            nfc.reject()
+
+    # ── authorising ──
+    def _complete(self, verified_name=None):
+        win = self.win
+        if win.gateway is None or self.total <= 0:
+            self._paid(verified_name)
+            return
+        self.state = "authorising"
+        self.verified_name = verified_name
+        self._authorise_started = time.perf_counter()
+        win.header_status.setText("●  カード承認中...")
+        set_style_prop(win.header_status, "tone", "nfc")
+        dialog = win._dialog("progress")
+        dialog.reset(self.total)
+        dialog.open()
+        self.job = win.gateway.authorise(
+            win.checkout_id, self.total, self.authorised.emit)
+
+    def _on_authorised(self, job, result):
+        if self.state != "authorising" or job is not self.job:
+            if result.status == "approved":
+                # Cancelled here while the gateway was saying yes.
+                self.win.gateway.void(job)
+            return
+        self.job = None
+        PAYMENT_PHASE["authorise"].observe(
+            time.perf_counter() - self._authorise_started)
+        dialog = self.win._dialog("progress")
+        if result.status == "approved":
+            self.state = "complete"
+            dialog.accept()
+            self._paid(self.verified_name, result.auth_code)
+            return
+
+        payment_logger.warning(
+            "Card %s: %s", result.status, result.reason,
+            extra={"auth_status": result.status, "reason": result.reason,
+                   "attempts": result.attempts})
+        self.state = "declined"
+        self._failure = "declined" if result.status == "declined" \
+            else "failed"
+        self.win.header_status.setText("●  お支払いできませんでした")
+        set_style_prop(self.win.header_status, "tone", "danger")
+        dialog.show_failure(self._failure)
+
+    def _on_progress_closed(self, _result):
+        if self.state == "authorising":
+            payment_logger.info("Payment cancelled during authorisation")
+            job, self.job = self.job, None
+            job.cancel()   # the gateway voids it if it got that far
+            PAYMENT_PHASE["authorise"].observe(
+                time.perf_counter() - self._authorise_started)
+            self._finish("cancelled")
+        elif self.state == "declined":
+            self._finish(self._failure)
+
+    # ── outcome ──
+    def _paid(self, verified_name=None, auth_code=None):
+        self.state = "complete"
+        self._complete_started = time.perf_counter()
+        win = self.win
+        win._record_sale(self.count, self.total, verified_name, auth_code)
+        win.header_status.setText("●  支払い完了!")
+        set_style_prop(win.header_status, "tone", "success")
+        dialog = win._dialog("success")
+        dialog.reset(self.count, self.total, verified_name, self.taxes)
+        dialog.open()
+
+    def _on_success_closed(self, _result):
+        if self.state != "complete":
+            return
+        self.win._empty_cart()
+        self.win._reset_header()
+        PAYMENT_PHASE["complete"].observe(
+            time.perf_counter() - self._complete_started)
+        self._finish("paid")
+
+    def _on_alert_closed(self, _result):
+        if self.state == "alert":
+            self._finish("denied")
+
+    def _finish(self, outcome):
+        self.state = "idle"
+        self.win._reset_header()
+        CHECKOUT_SECONDS.observe(time.perf_counter() - self._started)
+        CHECKOUTS[outcome].inc()
+        self.finished.emit(outcome)
+
+
 # ================= MAIN APP =================
 class MyMart(QWidget):
+    # Payment dialogs, built once after startup and reused via reset()
+    DIALOG_CLASSES = {
+        "camera": CameraVerificationDialog,
+        "nfc": NFCScanDialog,
+        "underage": UnderageAlertDialog,
+        "progress": PaymentProgressDialog,
+        "success": PaymentSuccessDialog,
+    }
+
+    # Emitted at the end of every payment attempt with its outcome
+    # ("paid", "cancelled", "denied", "declined" or "failed").
+    checkout_finished = pyqtSignal(str)
 
     def __init__(self):
         super().__init__()
@@ -1129,7 +2200,25 @@ class MyMart(QWidget):
         self.setMinimumSize(1000, 650)
 
         self.cart = []
+        self.pricing = pricing.PricingEngine(
+            CATALOGUE, self._load_promotions())
+        self.flow = PaymentFlow(self)
+        self.flow.finished.connect(self._on_checkout_finished)
+        self.flow.finished.connect(self.checkout_finished)
         self._init_error = False
+        self.camera_factory = open_camera
+        self.recorder = None
+        self.audit = None
+        self.outbox = None
+        self.inventory = None
+        self.analytics = None
+        self.basket = ()
+        self.gateway = None
+        self.printer = None
+        self.checkout_id = None
+        self._dialogs = {}
+        self.profiler = profiling.Profiler(PROFILE_DIR)
+        self._profile_run = 0
 
         if not self._check_required_files():
             self._init_error = True
@@ -1139,8 +2228,88 @@ class MyMart(QWidget):
             self._init_error = True
             return
 
+        if AUDIT_DB:
+            self.audit = audit_store.AuditStore(
+                AUDIT_DB, LANE, int(AUDIT_MAX_MB * 2**20),
+                AUDIT_RETENTION_DAYS, AUDIT_THUMBNAILS)
+            self.audit.start()
+        if OUTBOX_URL:
+            self.outbox = outbox.Outbox(OUTBOX_DB, OUTBOX_URL, LANE)
+            self.outbox.start()
+        if INVENTORY_DB:
+            self.inventory = inventory.Inventory(
+                INVENTORY_DB, INVENTORY_JOURNAL, CATALOGUE, INITIAL_STOCK,
+                LOW_STOCK_THRESHOLD, on_alert=self._on_stock_level)
+            try:
+                self.inventory.start()
+            except (OSError, sqlite3.Error, KeyError, TypeError,
+                    ValueError) as e:
+                # Selling goes on without stock tracking.
+                logger.error("Inventory unavailable, stock not tracked: %s",
+                             e, extra={"path": INVENTORY_DB})
+                self.inventory = None
+        if ANALYTICS_DIR:
+            self.analytics = analytics.Analytics(ANALYTICS_DIR)
+            self.analytics.start()
+        if GATEWAY_URL:
+            self.gateway = payment_gateway.PaymentGateway(
+                GATEWAY_URL, LANE, GATEWAY_TIMEOUT, GATEWAY_DEADLINE)
+            self.gateway.start()
+        if RECEIPT_FORMATS:
+            self.printer = self._create_printer()
+        if RECORD_SESSIONS:
+            self.recorder = session_recorder.SessionRecorder(RECORD_DIR)
+            self.recorder.start()
+
         self._build_ui()
         self._update_totals()
+        if self.inventory is not None:
+            for stock in self.inventory.low():
+                self._on_stock_level(stock.sku, stock.qty, stock.level)
+
+        QTimer.singleShot(0, self._prebuild_dialogs)
+
+    def _prebuild_dialogs(self):
+        """Build one pending dialog per idle turn of the event loop."""
+        for key in self.DIALOG_CLASSES:
+            if key not in self._dialogs:
+                self._dialog(key)
+                QTimer.singleShot(0, self._prebuild_dialogs)
+                return
+
+    def _dialog(self, key):
+        dialog = self._dialogs.get(key)
+        if dialog is None:
+            dialog = self.DIALOG_CLASSES[key](parent=self)
+            self._dialogs[key] = dialog
+        return dialog
+
+    def _load_promotions(self):
+        if not PROMOTIONS_FILE or not os.path.exists(PROMOTIONS_FILE):
+            return []
+        try:
+            rules = pricing.load_rules(PROMOTIONS_FILE)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error("Promotions not loaded from %s: %s",
+                         PROMOTIONS_FILE, e,
+                         extra={"path": PROMOTIONS_FILE})
+            return []
+        logger.info("Loaded %d promotions", len(rules),
+                    extra={"path": PROMOTIONS_FILE, "rules": len(rules)})
+        return rules
+
+    def _create_printer(self):
+        formats = [f for f in RECEIPT_FORMATS if f in receipts.FORMATS]
+        for fmt in set(RECEIPT_FORMATS) - set(formats):
+            logger.warning("Unknown receipt format %r ignored", fmt)
+        if not formats:
+            return None
+        sink = (receipts.SpoolSink(RECEIPT_SPOOL) if RECEIPT_SPOOL
+                else receipts.FileSink(RECEIPT_DIR))
+        printer = receipts.ReceiptPrinter(
+            sink, formats, STORE_NAME, INVOICE_NUMBER, pricing.REDUCED_RATE)
+        printer.start()
+        return printer
 
     def _check_required_files(self):
         required = [
@@ -1150,61 +2319,63 @@ class MyMart(QWidget):
         ]
         for f in required:
             if not os.path.exists(f):
-                logger.error(f"Missing: {f}")
+                logger.error("Missing: %s", f, extra={"path": f})
                 QMessageBox.critical(self, "Error", f"必要ファイルがありません:\n{f}")
                 return False
         return True
 
     def _init_models(self):
         try:
-            self.face_cascade = cv2.CascadeClassifier(
-                "haarcascade_frontalface_default.xml")
-            self.age_net = cv2.dnn.readNetFromCaffe(
-                "age_deploy.prototxt", "age_net.caffemodel")
+            with MODEL_LOAD_SECONDS.time():
+                self.face_detector = self._create_detector()
+                self.age_net = cv2.dnn.readNetFromCaffe(
+                    "age_deploy.prototxt", "age_net.caffemodel")
+                self.quality_scorer = face_quality.FaceQualityScorer(
+                    face_quality.default_eye_cascade())
             logger.info("Models loaded")
             return True
         except Exception as e:
-            logger.error(f"Model load failed: {e}")
+            logger.error("Model load failed: %s", e)
             QMessageBox.critical(self, "Error", f"モデル読み込み失敗:\n{e}")
             return False
 
+    def _create_detector(self):
+        try:
+            detector, backend = face_detectors.create(
+                FACE_DETECTOR, FACE_SCALE_FACTOR, FACE_MIN_NEIGHBORS)
+        except (ValueError, OSError) as e:
+            logger.warning("Face detector %r unavailable (%s); using haar",
+                           FACE_DETECTOR, e)
+            detector, backend = face_detectors.create(
+                "haar", FACE_SCALE_FACTOR, FACE_MIN_NEIGHBORS)
+        logger.info("Face detector: %s (%s)", backend, FACE_DETECTOR,
+                    extra={"detector": backend})
+        return detector
+
     # ================= UI =================
     def _build_ui(self):
-        self.setStyleSheet(GLOBAL_STYLE)
+        apply_theme()
 
         # ── HEADER ──
-        header = QFrame()
+        header = themed(QFrame(), role="header")
         header.setFixedHeight(76)
-        header.setStyleSheet(f"""
-            QFrame {{
-                background: qlineargradient(
-                    x1:0, y1:0, x2:1, y2:0,
-                    stop:0 {COLORS['header_bg']},
-                    stop:1 {COLORS['header_bg2']}
-                );
-                border-radius: 16px;
-                border: 1px solid rgba(255,255,255,0.08);
-            }}
-        """)
-        header.setGraphicsEffect(make_shadow("#7C3AED50", 24, 0, 6))
+        apply_shadow(header, "#7C3AED50", 24, 0, 6)
 
         header_layout = QHBoxLayout(header)
         header_layout.setContentsMargins(28, 0, 28, 0)
 
         title = QLabel("✦  My Mart")
         title.setFont(QFont("Segoe UI", 26, QFont.Weight.Bold))
-        title.setStyleSheet(
-            "color:white; background:transparent; border:none; letter-spacing:1px;")
+        title.setProperty("tone", "white")
+        title.setProperty("role", "title")
 
         subtitle = QLabel("AI Self Checkout POS")
         subtitle.setFont(QFont("Segoe UI", 13))
-        subtitle.setStyleSheet(
-            "color:rgba(255,255,255,0.65); background:transparent; border:none;")
+        subtitle.setProperty("tone", "white_dim")
 
         self.header_status = QLabel("●  Ready")
         self.header_status.setFont(QFont("Segoe UI", 13, QFont.Weight.Bold))
-        self.header_status.setStyleSheet(
-            f"color:{COLORS['success']}; background:transparent; border:none;")
+        self.header_status.setProperty("tone", "success")
 
         title_col = QVBoxLayout()
         title_col.setSpacing(0)
@@ -1225,10 +2396,12 @@ class MyMart(QWidget):
 
         self.product_list = QListWidget()
         self.product_list.setFont(QFont("Segoe UI", 15))
+        self._product_items = {}
 
         for name, price in PRODUCTS.items():
             item = QListWidgetItem(f"  {name}     ¥{price:,}")
             item.setData(Qt.ItemDataRole.UserRole, name)
+            self._product_items[name] = item
             item.setSizeHint(QSize(0, 52))
             if name in AGE_RESTRICTED:
                 item.setBackground(QColor(COLORS["restricted_bg"]))
@@ -1238,15 +2411,13 @@ class MyMart(QWidget):
                 item.setForeground(QColor(COLORS["normal_fg"]))
             self.product_list.addItem(item)
 
-        add_btn = make_btn(
-            "＋  カートに追加", COLORS["accent"], COLORS["accent_hover"], COLORS["accent_pressed"])
+        add_btn = make_btn("＋  カートに追加", "accent")
         add_btn.clicked.connect(self._add_item)
 
-        note = QLabel("🔴  赤い商品 = 年齢確認必要（お支払い時にカメラ＋NFC確認）")
+        note = themed(QLabel("🔴  赤い商品 = 年齢確認必要（お支払い時にカメラ＋NFC確認）"),
+                      name="note", tone="muted")
         note.setFont(QFont("Segoe UI", 11))
         note.setWordWrap(True)
-        note.setStyleSheet(
-            f"color:{COLORS['text_muted']}; padding:6px 10px; background:transparent; border:none;")
 
         left_layout.addWidget(self.product_list)
         left_layout.addWidget(note)
@@ -1264,60 +2435,47 @@ class MyMart(QWidget):
         self.cart_list.setFont(QFont("Segoe UI", 15))
 
         # Total
-        total_frame = QFrame()
-        total_frame.setStyleSheet(f"""
-            QFrame {{
-                background: {COLORS['list_bg']};
-                border: 2px solid {COLORS['panel_border']};
-                border-radius: 12px; padding: 4px;
-            }}
-        """)
+        total_frame = themed(QFrame(), role="total")
         total_lay = QHBoxLayout(total_frame)
         total_lay.setContentsMargins(18, 14, 18, 14)
 
         total_lbl = QLabel("合計")
         total_lbl.setFont(QFont("Segoe UI", 15, QFont.Weight.Bold))
-        total_lbl.setStyleSheet(
-            f"color:{COLORS['text_dim']}; background:transparent; border:none;")
+        total_lbl.setProperty("tone", "dim")
 
         self.total_value = QLabel("¥0")
         self.total_value.setFont(QFont("Segoe UI", 22, QFont.Weight.Bold))
         self.total_value.setAlignment(
             Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
-        self.total_value.setStyleSheet(
-            f"color:{COLORS['text_muted']}; background:transparent; border:none;")
+        self.total_value.setProperty("tone", "muted")
 
         self.item_count = QLabel("(0 items)")
         self.item_count.setFont(QFont("Segoe UI", 12))
-        self.item_count.setStyleSheet(
-            f"color:{COLORS['text_muted']}; background:transparent; border:none;")
+        self.item_count.setProperty("tone", "muted")
+
+        self.price_note = QLabel("")
+        self.price_note.setFont(QFont("Segoe UI", 11))
+        self.price_note.setProperty("tone", "dim")
 
         self.restricted_indicator = QLabel("")
         self.restricted_indicator.setFont(QFont("Segoe UI", 11))
-        self.restricted_indicator.setStyleSheet(
-            f"color:{COLORS['danger']}; background:transparent; border:none;")
+        self.restricted_indicator.setProperty("tone", "danger")
 
         total_lay.addWidget(total_lbl)
         total_lay.addWidget(self.item_count)
+        total_lay.addWidget(self.price_note)
         total_lay.addStretch()
         total_lay.addWidget(self.restricted_indicator)
         total_lay.addWidget(self.total_value)
 
         # ── Payment button (changes dynamically) ──
-        self.pay_btn = make_btn(
-            "💳  お支払い",
-            COLORS["success"], COLORS["success_hover"], COLORS["success_pressed"]
-        )
+        self.pay_btn = make_btn("💳  お支払い", "success")
         self.pay_btn.clicked.connect(self._process_payment)
 
-        del_btn = make_btn(
-            "✕  選択商品を削除", COLORS["danger"], COLORS["danger_hover"], COLORS["danger_pressed"])
+        del_btn = make_btn("✕  選択商品を削除", "danger")
         del_btn.clicked.connect(self._remove_item)
 
-        clear_btn = make_btn(
-            "🗑  カートを空にする",
-            COLORS["text_muted"], COLORS["text_dim"], COLORS["text_muted"], bold=False
-        )
+        clear_btn = make_btn("🗑  カートを空にする", "muted", bold=False)
         clear_btn.clicked.connect(self._clear_cart)
 
         right_layout.addWidget(self.cart_list)
@@ -1337,7 +2495,7 @@ class MyMart(QWidget):
             "Powered by OpenCV DNN · PyQt6 · Camera + NFC verification at payment")
         footer.setAlignment(Qt.AlignmentFlag.AlignCenter)
         footer.setFont(QFont("Segoe UI", 10))
-        footer.setStyleSheet(f"color:{COLORS['text_muted']}; padding:8px;")
+        footer.setObjectName("footer")
 
         root = QVBoxLayout()
         root.setContentsMargins(18, 14, 18, 10)
@@ -1347,13 +2505,24 @@ class MyMart(QWidget):
         root.addWidget(footer)
         self.setLayout(root)
 
+        # ── Hidden diagnostics ──
+        self.diagnostics = DiagnosticsOverlay(self)
+        QShortcut(QKeySequence("Ctrl+Shift+D"), self,
+                  activated=self.diagnostics.toggle)
+        QShortcut(QKeySequence("Ctrl+Shift+P"), self,
+                  activated=self.toggle_profiling)
+
     # ================= CART =================
     def _add_item(self):
+        if self.flow.active:
+            return
         item = self.product_list.currentItem()
         if not item:
             return
         name = item.data(Qt.ItemDataRole.UserRole)
-        price = PRODUCTS[name]
+        with PRICING_SECONDS.time():
+            self.pricing.add(name)
+        price = self.pricing.price(name)
 
         self.cart.append({
             "name": name,
@@ -1372,221 +2541,263 @@ class MyMart(QWidget):
 
         self.cart_list.addItem(cart_item)
         self._update_totals()
-        logger.info(f"Added: {name} ¥{price}")
+        ui_logger.info("Added: %s ¥%d", name, price,
+                       extra={"item": name, "price": price})
 
     def _remove_item(self):
         row = self.cart_list.currentRow()
-        if row >= 0:
+        if row >= 0 and not self.flow.active:
             removed = self.cart.pop(row)
             self.cart_list.takeItem(row)
+            with PRICING_SECONDS.time():
+                self.pricing.remove(removed["name"])
             self._update_totals()
-            logger.info(f"Removed: {removed['name']}")
+            ui_logger.info("Removed: %s", removed["name"],
+                           extra={"item": removed["name"]})
 
     def _clear_cart(self):
-        if not self.cart:
+        if not self.cart or self.flow.active:
             return
         reply = QMessageBox.question(
             self, "確認", "カートを空にしますか？",
             QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
         )
         if reply == QMessageBox.StandardButton.Yes:
-            self.cart.clear()
-            self.cart_list.clear()
-            self._update_totals()
+            self._empty_cart()
+
+    def _empty_cart(self):
+        self.cart.clear()
+        self.cart_list.clear()
+        self.pricing.clear()
+        self._update_totals()
+
+    def _on_stock_level(self, sku, qty, level):
+        """Flag products running low; sales are never blocked on stock."""
+        item = self._product_items.get(sku)
+        if item is not None:
+            item.setText(f"  {sku}     ¥{PRODUCTS[sku]:,}{STOCK_NOTES[level]}")
+
+    def _reprice(self):
+        """Apply markdowns that started or ended while the cart was open."""
+        if not self.pricing.refresh():
+            return
+        for row, line in enumerate(self.cart):
+            line["price"] = self.pricing.price(line["name"])
+            self.cart_list.item(row).setText(
+                f"  {line['name']}     ¥{line['price']:,}")
+        self._update_totals()
 
     def _update_totals(self):
-        total = sum(i["price"] for i in self.cart)
-        count = len(self.cart)
+        totals = self.pricing.totals()
+        total = totals.total
+        count = totals.count
         restricted_count = sum(1 for i in self.cart if i["restricted"])
 
         self.total_value.setText(f"¥{total:,}")
         self.item_count.setText(f"({count} item{'s' if count != 1 else ''})")
+        note = f"内税 ¥{sum(t.tax for t in totals.taxes):,}" if total else ""
+        if totals.discount:
+            note += f"  ·  割引 −¥{totals.discount:,}"
+        self.price_note.setText(note)
 
         if restricted_count > 0:
             self.restricted_indicator.setText(f"🔴 年齢確認 ×{restricted_count}")
         else:
             self.restricted_indicator.setText("")
 
-        color = COLORS['success'] if total > 0 else COLORS['text_muted']
-        self.total_value.setStyleSheet(
-            f"color:{color}; background:transparent; border:none;")
+        set_style_prop(self.total_value, "tone",
+                       "success" if total > 0 else "muted")
 
         # ── DYNAMIC PAYMENT BUTTON ──
         if restricted_count > 0:
             # Change to NFC scan style
             self.pay_btn.setText("🪪  IDスキャンでお支払い")
-            self.pay_btn.setStyleSheet(f"""
-                QPushButton {{
-                    background: qlineargradient(
-                        x1:0, y1:0, x2:1, y2:0,
-                        stop:0 {COLORS['nfc_blue']},
-                        stop:1 {COLORS['info']}
-                    );
-                    color: white;
-                    border: none;
-                    border-radius: 12px;
-                    padding: 16px 24px;
-                    font-size: 15px;
-                    font-weight: 700;
-                    letter-spacing: 0.5px;
-                }}
-                QPushButton:hover {{
-                    background: qlineargradient(
-                        x1:0, y1:0, x2:1, y2:0,
-                        stop:0 {COLORS['nfc_blue_hover']},
-                        stop:1 {COLORS['info_hover']}
-                    );
-                }}
-                QPushButton:pressed {{
-                    background: {COLORS['nfc_blue_pressed']};
-                }}
-                QPushButton:disabled {{
-                    background: {COLORS['text_muted']};
-                    color: {COLORS['panel']};
-                }}
-            """)
+            set_style_prop(self.pay_btn, "variant", "id_pay")
         else:
             # Normal payment button
             self.pay_btn.setText("💳  お支払い")
-            self.pay_btn.setStyleSheet(f"""
-                QPushButton {{
-                    background: {COLORS['success']};
-                    color: white;
-                    border: none;
-                    border-radius: 12px;
-                    padding: 16px 24px;
-                    font-size: 15px;
-                    font-weight: 700;
-                    letter-spacing: 0.5px;
-                }}
-                QPushButton:hover {{
-                    background: {COLORS['success_hover']};
-                }}
-                QPushButton:pressed {{
-                    background: {COLORS['success_pressed']};
-                }}
-                QPushButton:disabled {{
-                    background: {COLORS['text_muted']};
-                    color: {COLORS['panel']};
-                }}
-            """)
+            set_style_prop(self.pay_btn, "variant", "success")
+
+        self.flow.speculate(restricted_count > 0)
 
     # ================= PAYMENT FLOW =================
     def _process_payment(self):
+        if self.flow.active:
+            return
         if not self.cart:
             QMessageBox.information(self, "カート", "カートが空です")
             return
 
-        has_restricted = any(i["restricted"] for i in self.cart)
-        total = sum(i["price"] for i in self.cart)
-        count = len(self.cart)
-
-        if has_restricted:
-            # ── STEP 1: Camera age check ──
-            self.header_status.setText("●  年齢確認中...")
-            self.header_status.setStyleSheet(
-                f"color:{COLORS['warning']}; background:transparent; border:none;")
-
-            cam_dialog = CameraVerificationDialog(self)
-            cam_ok = cam_dialog.start_camera(self.face_cascade, self.age_net)
-
-            if not cam_ok:
-                QMessageBox.warning(self, "カメラエラー", "カメラを開けません")
-                self._reset_header()
-                return
-
-            result = cam_dialog.exec()
-            self._reset_header()
-
-            if result != QDialog.DialogCode.Accepted:
-                logger.info("Camera verification cancelled")
-                return
-
-            if cam_dialog.detected_age is None:
-                QMessageBox.warning(self, "エラー", "顔を認識できませんでした")
-                return
-
-            # ── STEP 2: Check if age >= 25 (confident pass) ──
-            if cam_dialog.detected_age >= CONFIDENT_AGE:
-                # Clearly adult - direct payment
-                logger.info(
-                    f"Age verified by camera: {cam_dialog.detected_age_text} → direct payment")
-                self._complete_payment(count, total)
-                return
-
-            # ── STEP 3: Under 25 → NFC ID scan required ──
-            logger.info(
-                f"Age uncertain: {cam_dialog.detected_age_text} → NFC scan required")
-
-            self.header_status.setText("●  NFC スキャン中...")
-            self.header_status.setStyleSheet(
-                f"color:{COLORS['nfc_blue']}; background:transparent; border:none;")
-
-            nfc_dialog = NFCScanDialog(cam_dialog.detected_age_text, self)
-            nfc_result = nfc_dialog.exec()
-
-            self._reset_header()
-
-            if nfc_result != QDialog.DialogCode.Accepted:
-                logger.info("NFC scan cancelled")
-                return
-
-            if nfc_dialog.verified_age is None:
-                QMessageBox.warning(self, "エラー", "カードを認識できませんでした")
-                return
-
-            if nfc_dialog.verified_age < LEGAL_AGE:
-                # Confirmed underage via NFC
-                alert = UnderageAlertDialog(
-                    nfc_dialog.verified_name,
-                    nfc_dialog.verified_age,
-                    self
-                )
-                alert.exec()
-                logger.warning(
-                    f"Underage blocked: {nfc_dialog.verified_name} ({nfc_dialog.verified_age})")
-                return
-
-            # NFC verified adult
-            self._complete_payment(count, total, nfc_dialog.verified_name)
-
-        else:
-            # No restricted items - direct payment
-            self._complete_payment(count, total)
-
-    def _complete_payment(self, count, total, verified_name=None):
-        self.header_status.setText("●  支払い完了!")
-        self.header_status.setStyleSheet(
-            f"color:{COLORS['success']}; background:transparent; border:none;")
-
-        dialog = PaymentSuccessDialog(count, total, verified_name, self)
-        dialog.exec()
-
-        self.cart.clear()
-        self.cart_list.clear()
-        self._update_totals()
-        self._reset_header()
-        logger.info(
-            f"Payment: ¥{total:,} ({count} items) verified={verified_name}")
+        self._reprice()
+        self.checkout_id = uuid.uuid4().hex[:12]
+        # (product, qty, amount at unit price); outlives the cart, which
+        # is emptied before the flow reports "paid"
+        self.basket = tuple(
+            (name, n, n * self.pricing.price(name))
+            for name, n in collections.Counter(
+                line["name"] for line in self.cart).items())
+        self.flow.start()
+
+    def _on_checkout_finished(self, outcome):
+        if self.analytics is None:
+            return
+        flow = self.flow
+        self.analytics.record(analytics.Transaction(
+            ts=time.time(), lane=LANE, total=flow.total,
+            discount=flow.discount,
+            restricted=any(name in AGE_RESTRICTED
+                           for name, _, _ in self.basket),
+            outcome=outcome, verified_by=flow.verified_by,
+            lines=self.basket))
+
+    def _audit_camera(self, dialog, outcome):
+        self._record_decision(
+            "camera", outcome, face=dialog.last_face,
+            age_bucket=dialog.detected_age_text,
+            confidence=dialog.detected_confidence)
+
+    def _audit_nfc(self, dialog, outcome):
+        self._record_decision(
+            "nfc", outcome, age_bucket=dialog.detected_age_text,
+            card_id=dialog.card_id, verified_age=dialog.verified_age)
+
+    def _record_decision(self, step, outcome, face=None, **fields):
+        """Audit store locally; a copy (without the face) for head office."""
+        if self.audit is not None:
+            self.audit.record(step, outcome, self.checkout_id, face=face,
+                              **fields)
+        if self.outbox is not None:
+            self.outbox.put(
+                "verification",
+                outbox.record_key("verification", self.checkout_id, step),
+                dict(fields, checkout_id=self.checkout_id, lane=LANE,
+                     step=step, outcome=outcome, ts=time.time()))
+
+    def _record_sale(self, count, total, verified_name=None, auth_code=None):
+        totals = self.pricing.totals()
+        if self.printer is not None:
+            # Snapshot now: the cart is emptied as soon as the customer
+            # dismisses the success dialog, printed or not.
+            self.printer.submit(
+                self._receipt(totals, verified_name, auth_code))
+        if self.inventory is not None:
+            self.inventory.sell(self.checkout_id,
+                                {name: n for name, n, _ in self.basket})
+        if self.outbox is not None:
+            self.outbox.put(
+                "sale", outbox.record_key("sale", self.checkout_id), {
+                    "checkout_id": self.checkout_id,
+                    "lane": LANE,
+                    "ts": time.time(),
+                    "items": list(self.cart),
+                    "count": count,
+                    "total": total,
+                    "tax": [t._asdict() for t in totals.taxes],
+                    "discount": totals.discount,
+                    "promotions": dict(totals.promotions),
+                    "id_verified": verified_name is not None,
+                    "auth_code": auth_code,
+                })
+        payment_logger.info(
+            "Payment: ¥%d (%d items) verified=%s",
+            total, count, verified_name,
+            extra={"total": total, "count": count})
+
+    def _receipt(self, totals, verified_name, auth_code=None):
+        qty = {}
+        for line in self.cart:
+            key = (line["name"], line["price"])
+            qty[key] = qty.get(key, 0) + 1
+        names = {rule.rule_id: rule.name for rule in self.pricing.rules}
+        return receipts.Receipt(
+            checkout_id=self.checkout_id, lane=LANE, ts=time.time(),
+            items=tuple(receipts.ReceiptItem(name, n, price,
+                                             CATALOGUE[name].rate)
+                        for (name, price), n in qty.items()),
+            total=totals.total, discount=totals.discount,
+            taxes=totals.taxes,
+            promotions=tuple((names.get(rule_id, rule_id), yen)
+                             for rule_id, yen in totals.promotions),
+            id_verified=verified_name is not None, auth_code=auth_code)
+
+    # ================= PROFILING =================
+    def toggle_profiling(self, mode=None, duration=None):
+        """Start a timed capture, or end the running one early."""
+        if self.profiler.running:
+            self.profiler.stop()
+            return
+        seconds = self.profiler.start(mode, duration)
+        self._profile_run += 1
+        run = self._profile_run
+        QTimer.singleShot(int(seconds * 1000),
+                          lambda: run == self._profile_run
+                          and self.profiler.stop())
 
     def _reset_header(self):
         self.header_status.setText("●  Ready")
-        self.header_status.setStyleSheet(
-            f"color:{COLORS['success']}; background:transparent; border:none;")
+        set_style_prop(self.header_status, "tone", "success")
 
     def closeEvent(self, event):
+        self.flow.cancel()
+        # The dialogs live as long as the window is open; release them
+        # (and the camera each may hold) rather than waiting for exit.
+        for dialog in self._dialogs.values():
+            dialog.close()
+            dialog.deleteLater()
+        self._dialogs.clear()
+        self.profiler.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.audit is not None:
+            self.audit.close()
+        if self.outbox is not None:
+            self.outbox.close()
+        if self.inventory is not None:
+            self.inventory.close()
+        if self.analytics is not None:
+            self.analytics.close()
+        if self.gateway is not None:
+            self.gateway.close()
+        if self.printer is not None:
+            self.printer.close()
         logger.info("Application closed")
         event.accept()
 
 
 # ================= RUN =================
 if __name__ == "__main__":
+    log_listener = setup_logging()
+    if RENDER_PROFILE not in RENDER_PROFILES:
+        logger.warning("Unknown render profile %r, using 'full'",
+                       RENDER_PROFILE)
+        RENDER_PROFILE = "full"
+    apply_terminal_profile(TERMINAL_PROFILE)
+    if METRICS_ENABLED or METRICS_PORT:
+        metrics.REGISTRY.enabled = True
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
+        logger.info("Metrics endpoint on 127.0.0.1:%d", METRICS_PORT)
     app = QApplication(sys.argv)
     QFontDatabase.addApplicationFont(":/fonts/NotoSansJP-Regular.otf")
 
     win = MyMart()
     if win._init_error:
+        log_listener.stop()
         sys.exit(1)
 
     win.show()
-    sys.exit(app.exec())
+
+    if PROFILE_SPEC:
+        win.toggle_profiling(*profiling.parse_spec(PROFILE_SPEC))
+    if hasattr(signal, "SIGUSR1"):
+        # Python signal handlers only run when the interpreter gets control
+        # back, so keep a cheap timer ticking while Qt sits in its loop.
+        signal.signal(signal.SIGUSR1, lambda *_: QTimer.singleShot(
+            0, win.toggle_profiling))
+        signal_pump = QTimer()
+        signal_pump.timeout.connect(lambda: None)
+        signal_pump.start(250)
+
+    code = app.exec()
+    log_listener.stop()
+    sys.exit(code)
@@ -0,0 +1,291 @@
+"""
+Lightweight in-process metrics for the POS kiosk.
+
+Counters, gauges and fixed-bucket histograms kept in a single registry,
+with an optional Prometheus-style text endpoint on localhost. While the
+registry is disabled every instrument short-circuits on one attribute
+check, so instrumented hot paths cost next to nothing in production.
+"""
+
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds; spans sub-millisecond inference up to multi-minute checkouts.
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0,
+)
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{v}"' for k, v in labels)
+    return "{" + inner + "}"
+
+
+class _Instrument:
+    kind = "untyped"
+
+    def __init__(self, registry, name, help_text, labels):
+        self._registry = registry
+        self._lock = threading.Lock()
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+
+    @property
+    def series(self):
+        return self.name + _label_text(self.labels)
+
+
+class Counter(_Instrument):
+    kind = "counter"
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.value = 0
+
+    def inc(self, amount=1):
+        if not self._registry.enabled:
+            return
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        return [(self.series, self.value)]
+
+
+class Gauge(_Instrument):
+    kind = "gauge"
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.value = 0.0
+
+    def set(self, value):
+        if not self._registry.enabled:
+            return
+        self.value = value
+
+    def inc(self, amount=1):
+        if not self._registry.enabled:
+            return
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def samples(self):
+        return [(self.series, self.value)]
+
+
+class _Timer:
+    __slots__ = ("_hist", "_start")
+
+    def __init__(self, hist):
+        self._hist = hist
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self._start
+        self._hist.observe(elapsed)
+        self._hist._registry._notify_span(self._hist, self._start, elapsed)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Histogram(_Instrument):
+    kind = "histogram"
+
+    def __init__(self, registry, name, help_text, labels,
+                 buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        if not self._registry.enabled:
+            return
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[idx] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        """Context manager observing the elapsed wall time in seconds."""
+        if self._registry.active:
+            return _Timer(self)
+        return _NULL_TIMER
+
+    def quantile(self, q):
+        """Upper bucket bound containing the q-th quantile (approximate)."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        running = 0
+        for bound, n in zip(self.buckets, self.counts):
+            running += n
+            if running >= target:
+                return bound
+        return float("inf")
+
+    def samples(self):
+        out = []
+        running = 0
+        for bound, n in zip(self.buckets, self.counts):
+            running += n
+            labels = self.labels + (("le", repr(bound)),)
+            out.append((self.name + "_bucket" + _label_text(labels), running))
+        labels = self.labels + (("le", "+Inf"),)
+        out.append((self.name + "_bucket" + _label_text(labels), self.count))
+        out.append((self.name + "_sum" + _label_text(self.labels), self.sum))
+        out.append((self.name + "_count" + _label_text(self.labels),
+                    self.count))
+        return out
+
+
+class Registry:
+    """Holds every instrument; instruments are created once and reused."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._instruments = {}
+        self._span_listeners = []
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        """True when timers need to run at all (metrics or span listeners)."""
+        return self.enabled or bool(self._span_listeners)
+
+    def _get(self, cls, name, help_text, labels, **kwargs):
+        labels = tuple(sorted((labels or {}).items()))
+        key = (name, labels)
+        with self._lock:
+            inst = self._instruments.get(key)
+            if inst is None:
+                inst = cls(self, name, help_text, labels, **kwargs)
+                self._instruments[key] = inst
+        return inst
+
+    def counter(self, name, help_text="", labels=None):
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text="", labels=None):
+        return self._get(Gauge, name, help_text, labels)
+
+    def histogram(self, name, help_text="", labels=None,
+                  buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+
+    def add_span_listener(self, listener):
+        """Call `listener(instrument, start, elapsed)` for every timed span."""
+        self._span_listeners.append(listener)
+
+    def remove_span_listener(self, listener):
+        if listener in self._span_listeners:
+            self._span_listeners.remove(listener)
+
+    def _notify_span(self, inst, start, elapsed):
+        for listener in self._span_listeners:
+            listener(inst, start, elapsed)
+
+    def instruments(self):
+        with self._lock:
+            return list(self._instruments.values())
+
+    def exposition(self):
+        """Render all instruments in the Prometheus text format."""
+        lines = []
+        seen = set()
+        for inst in sorted(self.instruments(), key=lambda i: i.name):
+            if inst.name not in seen:
+                seen.add(inst.name)
+                if inst.help:
+                    lines.append(f"# HELP {inst.name} {inst.help}")
+                lines.append(f"# TYPE {inst.name} {inst.kind}")
+            for series, value in inst.samples():
+                lines.append(f"{series} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary_lines(self):
+        """Short human-readable lines for the on-screen overlay."""
+        lines = []
+        for inst in sorted(self.instruments(), key=lambda i: i.series):
+            if isinstance(inst, Histogram):
+                if not inst.count:
+                    continue
+                mean = inst.sum / inst.count
+                lines.append(
+                    f"{inst.series}: n={inst.count} "
+                    f"mean={mean * 1000:.1f}ms "
+                    f"p95≤{inst.quantile(0.95) * 1000:.1f}ms")
+            else:
+                lines.append(f"{inst.series}: {inst.value:g}")
+        return lines
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help_text="", labels=None):
+    return REGISTRY.counter(name, help_text, labels)
+
+
+def gauge(name, help_text="", labels=None):
+    return REGISTRY.gauge(name, help_text, labels)
+
+
+def histogram(name, help_text="", labels=None, buckets=DEFAULT_BUCKETS):
+    return REGISTRY.histogram(name, help_text, labels, buckets)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.exposition().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def serve(port, host="127.0.0.1", registry=REGISTRY):
+    """Start the scrape endpoint on a daemon thread and return the server."""
+    handler = type("Handler", (_MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(
+        target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    return server
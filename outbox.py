@@ -0,0 +1,304 @@
+"""
+Offline-first outbox for shipping records to the head-office service.
+
+Completed sales and verification decisions are put() by the GUI thread
+and land in a local SQLite table first; a sender thread ships them in
+gzip-compressed JSON batches over a reused keep-alive HTTP connection.
+Checkout never waits on the network: when head office is slow or
+unreachable records simply stay on disk and go out later, oldest first,
+including after a restart.
+
+Delivery is at-least-once. Every record carries an idempotency key and
+every batch an ``Idempotency-Key`` header derived from its record keys,
+so the service can drop repeats after a lost response. Failed batches
+are retried with capped exponential backoff and jitter (honouring
+``Retry-After``); a batch the service rejects outright (4xx other than
+408/409/429) is parked as dead rather than retried forever.
+
+Backpressure: past ``max_rows`` pending rows, sheddable kinds (the
+verification copies, which also live in the audit store) are refused and
+counted; sales are always kept.
+"""
+
+import gzip
+import hashlib
+import http.client
+import json
+import logging
+import queue
+import random
+import sqlite3
+import threading
+import time
+import urllib.parse
+import uuid
+
+import metrics
+
+logger = logging.getLogger("pos.outbox")
+
+PENDING = metrics.gauge("pos_outbox_pending", "Records waiting to be sent")
+SENT = metrics.counter("pos_outbox_sent_total", "Records acknowledged")
+REFUSED = metrics.counter(
+    "pos_outbox_refused_total", "Records refused by backpressure")
+FAILURES = {
+    reason: metrics.counter(
+        "pos_outbox_failures_total", "Failed batch uploads",
+        {"reason": reason})
+    for reason in ("network", "server", "rejected")
+}
+BATCH_SECONDS = metrics.histogram(
+    "pos_outbox_batch_seconds", "One batch upload, request to response")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id       INTEGER PRIMARY KEY,
+    key      TEXT NOT NULL UNIQUE,
+    kind     TEXT NOT NULL,
+    created  REAL NOT NULL,
+    payload  TEXT NOT NULL,
+    dead     INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (dead, id);
+"""
+
+RETRYABLE = (408, 409, 429)
+
+
+def record_key(kind, *parts):
+    """Stable idempotency key for a record, e.g. ("sale", checkout_id)."""
+    return ":".join((kind,) + tuple(str(p) for p in parts))
+
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections to one origin, reused LIFO."""
+
+    def __init__(self, url, size=2, timeout=10.0):
+        parts = urllib.parse.urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path or "/"
+        if parts.query:
+            self.path += "?" + parts.query
+        self.size = size
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        cls = (http.client.HTTPSConnection if self.scheme == "https"
+               else http.client.HTTPConnection)
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def put(self, conn):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class Outbox:
+    """Local queue plus sender thread; put() from the GUI thread."""
+
+    def __init__(self, path, url, lane, batch_size=100, flush_seconds=2.0,
+                 max_rows=100000, sheddable=("verification",),
+                 backoff=(1.0, 300.0), timeout=10.0):
+        self.path = path
+        self.url = url
+        self.lane = lane
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_rows = max_rows
+        self.sheddable = frozenset(sheddable)
+        self.backoff_base, self.backoff_max = backoff
+        self.pool = ConnectionPool(url, timeout=timeout)
+        self.pending = 0    # stored plus queued; both threads, under _lock
+        self._queued = 0    # put() but not yet stored
+        self._lock = threading.Lock()
+        self._incoming = queue.SimpleQueue()
+        self._thread = None
+        self._failures = 0
+        self._retry_at = 0.0
+        self._oldest = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="outbox-sender", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout=5.0):
+        """Persist what was put() and stop; unsent rows stay on disk."""
+        if self._thread is None:
+            return
+        self._incoming.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+        self.pool.close()
+
+    def put(self, kind, key, data):
+        """
+        Queue a record for head office; returns False when refused by
+        backpressure. `key` must be unique per record (see record_key).
+        """
+        if self._thread is None:
+            return False
+        with self._lock:
+            if self.pending >= self.max_rows and kind in self.sheddable:
+                REFUSED.inc()
+                return False
+            self.pending += 1
+            self._queued += 1
+        self._incoming.put((key, kind, time.time(),
+                            json.dumps(data, ensure_ascii=False,
+                                       default=str)))
+        return True
+
+    # ── sender thread ──
+    def _run(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.executescript(SCHEMA)
+        self._refresh(conn)
+        running = True
+        while running:
+            running = self._take_incoming(conn)
+            if running and self._due():
+                self._send_batch(conn)
+        conn.close()
+
+    def _refresh(self, conn, stored=0):
+        """Recount pending rows; `stored` records just left the queue."""
+        count, self._oldest = conn.execute(
+            "SELECT COUNT(*), MIN(created) FROM outbox WHERE dead = 0"
+        ).fetchone()
+        with self._lock:
+            self._queued -= stored
+            self.pending = count + self._queued
+            PENDING.set(self.pending)
+
+    def _take_incoming(self, conn):
+        """
+        Wait for records or the next send time and store what arrived;
+        returns False once close() has been called.
+        """
+        rows = []
+        running = True
+        try:
+            item = self._incoming.get(timeout=self._next_wake())
+            while item is not None:
+                rows.append(item)
+                item = self._incoming.get_nowait()
+            running = False
+        except queue.Empty:
+            pass
+        if rows:
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO outbox (key, kind, created, "
+                    "payload) VALUES (?, ?, ?, ?)", rows)
+            self._refresh(conn, len(rows))
+        return running
+
+    def _next_wake(self):
+        now = time.time()
+        if not self.pending:
+            return None
+        if now < self._retry_at:
+            return self._retry_at - now
+        if self.pending >= self.batch_size or self._oldest is None:
+            return 0
+        return max(0.0, self._oldest + self.flush_seconds - now)
+
+    def _due(self):
+        now = time.time()
+        if not self.pending or self._oldest is None or now < self._retry_at:
+            return False
+        return (self.pending >= self.batch_size
+                or self._oldest + self.flush_seconds <= now)
+
+    def _send_batch(self, conn):
+        rows = conn.execute(
+            "SELECT id, key, kind, created, payload FROM outbox "
+            "WHERE dead = 0 ORDER BY id LIMIT ?", (self.batch_size,)
+        ).fetchall()
+        if not rows:
+            return
+        keys = [r[1] for r in rows]
+        body = gzip.compress(json.dumps({
+            "lane": self.lane,
+            "batch": str(uuid.uuid4()),
+            "records": [
+                {"key": key, "kind": kind, "created": created,
+                 "data": json.loads(payload)}
+                for _, key, kind, created, payload in rows],
+        }, ensure_ascii=False).encode("utf-8"))
+        batch_key = hashlib.sha256("\n".join(keys).encode()).hexdigest()
+
+        status, retry_after = self._post(body, batch_key)
+        ids = [(r[0],) for r in rows]
+        if status is not None and 200 <= status < 300:
+            with conn:
+                conn.executemany("DELETE FROM outbox WHERE id = ?", ids)
+            SENT.inc(len(rows))
+            self._failures = 0
+            self._retry_at = 0.0
+        elif status is not None and 400 <= status < 500 \
+                and status not in RETRYABLE:
+            FAILURES["rejected"].inc()
+            logger.error("Head office rejected batch (%d); parking %d "
+                         "records", status, len(rows),
+                         extra={"status": status, "batch_key": batch_key})
+            with conn:
+                conn.executemany("UPDATE outbox SET dead = 1 WHERE id = ?",
+                                 ids)
+        else:
+            FAILURES["network" if status is None else "server"].inc()
+            self._failures += 1
+            delay = min(self.backoff_max,
+                        self.backoff_base * 2 ** (self._failures - 1))
+            delay = max(retry_after or 0.0, delay * random.uniform(0.5, 1.0))
+            self._retry_at = time.time() + delay
+            logger.warning("Upload failed (%s); retrying in %.1fs",
+                           status or "network", delay,
+                           extra={"pending": self.pending})
+        self._refresh(conn)
+
+    def _post(self, body, batch_key):
+        """POST one batch; returns (status or None, Retry-After seconds)."""
+        headers = {
+            "Content-Type": "application/json",
+            "Content-Encoding": "gzip",
+            "Idempotency-Key": batch_key,
+            "Connection": "keep-alive",
+        }
+        conn = self.pool.get()
+        try:
+            with BATCH_SECONDS.time():
+                conn.request("POST", self.pool.path, body, headers)
+                resp = conn.getresponse()
+                resp.read()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            logger.debug("Upload error: %s", e)
+            return None, None
+        if resp.will_close:
+            conn.close()
+        else:
+            self.pool.put(conn)
+        retry_after = resp.getheader("Retry-After")
+        try:
+            retry_after = float(retry_after) if retry_after else None
+        except ValueError:
+            retry_after = None
+        return resp.status, retry_after
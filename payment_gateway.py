@@ -0,0 +1,265 @@
+"""
+Card payment authorisation against the acquirer's gateway.
+
+The GUI thread calls authorise() and gets a handle back at once; a
+worker thread makes the HTTP calls over a reused keep-alive connection
+(see outbox.ConnectionPool) and hands the AuthResult to a callback on
+that thread, so the kiosk keeps painting while a slow gateway thinks.
+
+Every authorisation carries an ``Idempotency-Key`` derived from the
+checkout id, so a request repeated after a timeout or a dropped
+connection is answered with the original decision instead of charging
+the card twice. Network errors, 5xx and 408/409/429 are retried with
+capped exponential backoff and jitter (honouring ``Retry-After``),
+bounded by both an attempt count and a deadline for the whole
+authorisation. A request that fails on a pooled connection the server
+has since closed is repeated once, straight away, on a fresh one.
+
+A cancelled or unanswered authorisation may still have been approved
+at the gateway, so it is voided. An authorisation that is never
+captured lapses at the acquirer anyway; the void only releases the
+customer's funds sooner, so voids the gateway does not acknowledge are
+retried while the line is idle, a bounded number of times. Idle
+periods also ping /health, keeping the connection warm for the next
+customer.
+"""
+
+import collections
+import http.client
+import json
+import logging
+import queue
+import random
+import threading
+import time
+
+import metrics
+import outbox
+
+logger = logging.getLogger("pos.gateway")
+
+CALLS = ("authorize", "void", "health")
+STATUSES = ("approved", "declined", "unavailable", "cancelled")
+
+CALL_SECONDS = {
+    call: metrics.histogram(
+        "pos_gateway_call_seconds", "One gateway request, request to "
+        "response", {"call": call})
+    for call in CALLS
+}
+AUTHORISATIONS = {
+    status: metrics.counter(
+        "pos_gateway_authorisations_total", "Finished authorisations",
+        {"status": status})
+    for status in STATUSES
+}
+RETRIES = metrics.counter(
+    "pos_gateway_retries_total", "Gateway requests repeated after a failure")
+GATEWAY_UP = metrics.gauge(
+    "pos_gateway_up", "1 when the last gateway request got an answer")
+
+# `status` is one of STATUSES; `reason` explains anything but "approved"
+AuthResult = collections.namedtuple(
+    "AuthResult", "status auth_code reason attempts seconds")
+
+
+class Authorisation:
+    """Handle for one authorisation in flight; cancel() from any thread."""
+
+    def __init__(self, checkout_id, amount, callback):
+        self.checkout_id = checkout_id
+        self.amount = amount
+        self.callback = callback
+        self.cancelled = threading.Event()
+        self.sent = False   # the gateway may have seen it
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+class PaymentGateway:
+    """Worker thread plus keep-alive connection to one gateway."""
+
+    def __init__(self, url, lane, timeout=5.0, deadline=20.0, retries=3,
+                 backoff=(0.25, 2.0), keepalive=30.0, void_attempts=10):
+        self.lane = lane
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff_base, self.backoff_max = backoff
+        self.keepalive = keepalive
+        self.void_attempts = void_attempts
+        self.pool = outbox.ConnectionPool(url, timeout=timeout)
+        self._base = self.pool.path.rstrip("/")
+        self._jobs = queue.SimpleQueue()
+        self._voids = []    # [job, attempts] the gateway has not confirmed
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="payment-gateway", daemon=True)
+        self._thread.start()
+        self._jobs.put((self._health, None))   # open the connection early
+
+    def close(self, timeout=5.0):
+        if self._thread is None:
+            return
+        self._jobs.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+        self.pool.close()
+        if self._voids:
+            logger.warning("%d voids unconfirmed at shutdown",
+                           len(self._voids),
+                           extra={"voids": len(self._voids)})
+
+    def authorise(self, checkout_id, amount, callback):
+        """
+        Start authorising `amount` yen; callback(job, AuthResult) is
+        called on the worker thread. Returns the job handle.
+        """
+        job = Authorisation(checkout_id, amount, callback)
+        self._jobs.put((self._authorise, job))
+        return job
+
+    def void(self, job):
+        """Reverse an authorisation the checkout no longer wants."""
+        self._jobs.put((self._void, job))
+
+    # ── worker thread ──
+    def _run(self):
+        while True:
+            try:
+                item = self._jobs.get(timeout=(
+                    self.backoff_max if self._voids else self.keepalive))
+            except queue.Empty:
+                self._idle()
+                continue
+            if item is None:
+                return
+            handler, job = item
+            handler(job)
+
+    def _idle(self):
+        if not self._voids:
+            self._health(None)
+            return
+        pending, self._voids = self._voids, []
+        for job, attempts in pending:
+            self._void(job, attempts)
+
+    def _authorise(self, job):
+        started = time.perf_counter()
+        key = outbox.record_key("auth", job.checkout_id)
+        payload = {"checkout_id": job.checkout_id, "lane": self.lane,
+                   "amount": job.amount, "currency": "JPY"}
+        attempts = 0
+        status = retry_after = None
+        body = {}
+        while not job.cancelled.is_set():
+            attempts += 1
+            job.sent = True
+            status, body, retry_after = self._call(
+                "authorize", "/authorize", payload, key)
+            if status is not None and status < 500 \
+                    and status not in outbox.RETRYABLE:
+                break
+            delay = min(self.backoff_max,
+                        self.backoff_base * 2 ** (attempts - 1))
+            delay = max(retry_after or 0.0, delay * random.uniform(0.5, 1.0))
+            if attempts > self.retries or \
+                    time.perf_counter() + delay - started > self.deadline:
+                break
+            RETRIES.inc()
+            logger.warning("Authorisation attempt %d failed (%s); retrying "
+                           "in %.2fs", attempts, status or "network", delay,
+                           extra={"checkout_id": job.checkout_id,
+                                  "status": status})
+            job.cancelled.wait(delay)
+
+        result = self._result(job, status, body, attempts,
+                              time.perf_counter() - started)
+        AUTHORISATIONS[result.status].inc()
+        logger.info("Authorisation %s after %d attempts (%.2fs)",
+                    result.status, attempts, result.seconds,
+                    extra={"checkout_id": job.checkout_id,
+                           "auth_status": result.status,
+                           "reason": result.reason})
+        if result.status in ("cancelled", "unavailable") and job.sent:
+            self._void(job)
+        job.callback(job, result)
+
+    def _result(self, job, status, body, attempts, seconds):
+        if job.cancelled.is_set():
+            return AuthResult("cancelled", None, "cancelled", attempts,
+                              seconds)
+        if status is None or status >= 500 or status in outbox.RETRYABLE:
+            return AuthResult("unavailable", None,
+                              f"http {status}" if status else "network",
+                              attempts, seconds)
+        if 200 <= status < 300 and body.get("status") == "approved" \
+                and body.get("auth_code"):
+            return AuthResult("approved", body["auth_code"], None, attempts,
+                              seconds)
+        return AuthResult("declined", None,
+                          body.get("reason") or f"http {status}", attempts,
+                          seconds)
+
+    def _void(self, job, attempts=0):
+        status, _, _ = self._call(
+            "void", "/void", {"checkout_id": job.checkout_id,
+                              "lane": self.lane},
+            outbox.record_key("void", job.checkout_id))
+        if status is not None and 200 <= status < 300 or status == 404:
+            return   # 404: the gateway never authorised it
+        attempts += 1
+        if attempts < self.void_attempts:
+            self._voids.append([job, attempts])
+            return
+        logger.error("Void for %s not confirmed after %d attempts",
+                     job.checkout_id, attempts,
+                     extra={"checkout_id": job.checkout_id})
+
+    def _health(self, _job):
+        self._call("health", "/health", method="GET")
+
+    def _call(self, call, path, payload=None, key=None, method="POST"):
+        """One request; returns (status or None, JSON body, Retry-After)."""
+        headers = {"Connection": "keep-alive"}
+        body = None
+        if payload is not None:
+            body = json.dumps(payload).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        if key:
+            headers["Idempotency-Key"] = key
+        while True:
+            conn = self.pool.get()
+            reused = conn.sock is not None
+            try:
+                with CALL_SECONDS[call].time():
+                    conn.request(method, self._base + path, body, headers)
+                    resp = conn.getresponse()
+                    data = resp.read()
+                break
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                if reused and not isinstance(e, TimeoutError):
+                    continue   # closed while idle; the pool is bounded
+                logger.debug("Gateway %s error: %s", call, e)
+                GATEWAY_UP.set(0)
+                return None, {}, None
+        GATEWAY_UP.set(1)
+        if resp.will_close:
+            conn.close()
+        else:
+            self.pool.put(conn)
+        try:
+            reply = json.loads(data) if data else {}
+        except ValueError:
+            reply = {}
+        retry_after = resp.getheader("Retry-After")
+        try:
+            retry_after = float(retry_after) if retry_after else None
+        except ValueError:
+            retry_after = None
+        return resp.status, reply if isinstance(reply, dict) else {}, \
+            retry_after
@@ -0,0 +1,139 @@
+"""
+Non-blocking logging backend for the POS kiosk.
+
+Records are handed to a QueueHandler on the calling thread (no formatting,
+no I/O) and written out as one JSON object per line by a QueueListener on
+its own thread, so a slow disk or terminal never stalls a camera frame or
+a button press.
+"""
+
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+# Attributes every LogRecord carries; anything else came in via `extra=`
+# and is emitted as a structured field.
+_RESERVED = frozenset(vars(logging.LogRecord(
+    "", logging.INFO, "", 0, "", (), None)).keys()) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, including any `extra=` fields."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that skips the default prepare() step.
+
+    The stock implementation merges args into the message on the calling
+    thread; deferring that to the listener keeps `%`-formatting off the
+    UI thread entirely.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per (logger, message template).
+
+    Meant for per-frame diagnostics: at most `rate` records per `per`
+    seconds get through, and the next record let through carries a
+    `suppressed` count of what was dropped in between.
+    """
+
+    def __init__(self, rate=5, per=1.0):
+        super().__init__()
+        self.rate = rate
+        self.per = per
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            tokens, stamp, dropped = self._buckets.get(
+                key, (self.rate, now, 0))
+            tokens = min(self.rate,
+                         tokens + (now - stamp) * self.rate / self.per)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, dropped + 1)
+                return False
+            self._buckets[key] = (tokens - 1, now, 0)
+        if dropped:
+            record.suppressed = dropped
+        return True
+
+
+def parse_levels(spec):
+    """Parse `"pos.camera=DEBUG,pos.payment=WARNING"` into a dict."""
+    levels = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, level = part.partition("=")
+        if not level:
+            continue
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(level=None, levels=None, log_file=None,
+                  rate_limited=("pos.camera.frame",)):
+    """
+    Install the queue-based backend on the root logger.
+
+    Returns the started QueueListener; call stop() on it at shutdown to
+    flush whatever is still queued.
+    """
+    level = level or os.environ.get("POS_LOG_LEVEL", "INFO")
+    if levels is None:
+        levels = parse_levels(os.environ.get("POS_LOG_LEVELS", ""))
+    log_file = log_file or os.environ.get("POS_LOG_FILE")
+
+    formatter = JsonFormatter()
+    sinks = [logging.StreamHandler(sys.stderr)]
+    if log_file:
+        sinks.append(logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=5 * 1024 * 1024, backupCount=3,
+            encoding="utf-8"))
+    for sink in sinks:
+        sink.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(
+        log_queue, *sinks, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_LazyQueueHandler(log_queue))
+    root.setLevel(level.upper())
+
+    for name, lvl in levels.items():
+        logging.getLogger(name).setLevel(lvl)
+    for name in rate_limited:
+        logging.getLogger(name).addFilter(RateLimitFilter())
+
+    listener.start()
+    return listener
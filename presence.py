@@ -0,0 +1,58 @@
+"""
+Cheap presence gate for the verification camera.
+
+Face detection and age inference are only worth their cost while someone
+is at the terminal. PresenceGate looks at a tiny grey thumbnail of each
+frame, compares it with a running average of the scene and reports the
+camera as active while enough of it changes, or while the caller keeps
+it alive (e.g. because a face was found), plus a hold time. An empty
+lane costs one resize and one absdiff per idle tick.
+
+The background keeps learning in both states, so lighting drifts and
+objects left in view fade into it within a few seconds; a customer
+standing still is kept active by their face, not by motion.
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+
+class PresenceGate:
+    def __init__(self, hold=3.0, size=(64, 48), threshold=25,
+                 min_fraction=0.02, learn=0.05):
+        self.hold = hold
+        self.size = size
+        self.threshold = threshold
+        self.learn = learn
+        self._min_pixels = max(1, int(size[0] * size[1] * min_fraction))
+        self._background = None
+        self._until = 0.0
+
+    def reset(self, active=True):
+        """Forget the scene; start active (someone just asked for us)."""
+        self._background = None
+        self._until = time.monotonic() + self.hold if active else 0.0
+
+    @property
+    def active(self):
+        return time.monotonic() < self._until
+
+    def keep_alive(self):
+        self._until = time.monotonic() + self.hold
+
+    def update(self, frame):
+        """Feed a BGR frame; returns whether the camera should be active."""
+        small = cv2.cvtColor(
+            cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA),
+            cv2.COLOR_BGR2GRAY).astype(np.float32)
+        if self._background is None:
+            self._background = small
+            return self.active
+        moved = np.count_nonzero(
+            cv2.absdiff(small, self._background) > self.threshold)
+        cv2.accumulateWeighted(small, self._background, self.learn)
+        if moved >= self._min_pixels:
+            self.keep_alive()
+        return self.active
@@ -0,0 +1,332 @@
+"""
+Cart pricing: consumption tax and promotions, kept current per line.
+
+Shelf prices are tax-included, as Japanese retail displays them. Every
+product carries its consumption tax rate: the reduced 8% for food and
+non-alcoholic drinks, the standard 10% for everything else (alcohol and
+tobacco included). Totals report, per rate, the amount charged and the
+tax contained in it, rounded down once per rate rather than per line, as
+invoice-compliant receipts require.
+
+Promotions come in three kinds:
+
+- Markdown: so many yen or percent off each unit while the time of day
+  is inside a window ("bread 20% off from 20:00"). The best active
+  markdown sets a product's unit price.
+- MultiBuy: any `qty` units from a group of products for `price` yen,
+  mix and match. The dearest units are grouped first.
+- SetDiscount: `off` yen off each complete set of products.
+
+A unit goes towards at most one MultiBuy or SetDiscount. When several
+rules could claim it the lower `priority` wins, ties going to the rule
+listed first. A rule's discount is split across tax rates in proportion
+to the value of the units it claims.
+
+PricingEngine keeps unit counts, each rule's claim and discount, and
+running totals per tax rate. A line change re-evaluates the rules indexed
+under that product, then any lower-priority rule that gains or loses
+units as a result, so its cost depends on neither the size of the cart
+nor the number of promotions for products that are not in it.
+"""
+
+import collections
+import heapq
+import json
+import time
+
+STANDARD_RATE = 10
+REDUCED_RATE = 8
+
+Product = collections.namedtuple("Product", "sku price rate")
+RateTotal = collections.namedtuple("RateTotal", "rate amount tax")
+# `discount` is the saving against shelf prices (markdowns included);
+# `promotions` holds (rule_id, yen) for every rule currently applied.
+Totals = collections.namedtuple(
+    "Totals", "count total discount taxes promotions")
+
+
+def tax_included(amount, rate):
+    """Consumption tax contained in a tax-included amount, rounded down."""
+    return amount * rate // (100 + rate)
+
+
+def minute_of_day(now=None):
+    t = time.localtime(now)
+    return t.tm_hour * 60 + t.tm_min
+
+
+def _parse_clock(text):
+    hours, minutes = text.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def _split(amount, weights):
+    """Split `amount` yen across keys in proportion to `weights`."""
+    total = sum(weights.values())
+    if len(weights) == 1 or not total:
+        return {next(iter(weights)): amount} if weights else {}
+    shares = {k: amount * w // total for k, w in weights.items()}
+    # Whole yen left over by rounding down go to the heaviest key.
+    heaviest = max(weights, key=weights.get)
+    shares[heaviest] += amount - sum(shares.values())
+    return shares
+
+
+# ================= RULES =================
+class Markdown:
+    """Per-unit reduction while the time of day is in [start, end)."""
+
+    kind = "markdown"
+
+    def __init__(self, rule_id, skus, start="00:00", end="24:00",
+                 off=0, percent=0, priority=0, name=None):
+        self.rule_id = rule_id
+        self.name = name or rule_id
+        self.skus = tuple(skus)
+        self.start = _parse_clock(start)
+        self.end = _parse_clock(end)
+        self.off = int(off)
+        self.percent = int(percent)
+        self.priority = priority
+
+    def active(self, minute):
+        if self.start <= self.end:
+            return self.start <= minute < self.end
+        return minute >= self.start or minute < self.end   # past midnight
+
+    def unit_price(self, price):
+        return max(0, price - self.off - price * self.percent // 100)
+
+
+class MultiBuy:
+    """Any `qty` units from `skus` for `price` yen."""
+
+    kind = "multibuy"
+
+    def __init__(self, rule_id, skus, qty, price, priority=0, name=None):
+        self.rule_id = rule_id
+        self.name = name or rule_id
+        self.skus = tuple(skus)
+        self.qty = int(qty)
+        self.price = int(price)
+        self.priority = priority
+
+    def evaluate(self, available, prices):
+        """Return ({sku: units claimed}, discount in yen)."""
+        units = sorted(((prices[s], s) for s in self.skus if available[s]),
+                       reverse=True)
+        groups = sum(available[s] for _, s in units) // self.qty
+        need = groups * self.qty
+        claim, value = {}, 0
+        for price, sku in units:
+            if not need:
+                break
+            n = min(need, available[sku])
+            claim[sku] = n
+            value += n * price
+            need -= n
+        discount = value - groups * self.price
+        return (claim, discount) if discount > 0 else ({}, 0)
+
+
+class SetDiscount:
+    """`off` yen off each set; a product listed twice is needed twice."""
+
+    kind = "set"
+
+    def __init__(self, rule_id, skus, off, priority=0, name=None):
+        self.rule_id = rule_id
+        self.name = name or rule_id
+        self.units = collections.Counter(skus)
+        self.skus = tuple(self.units)
+        self.off = int(off)
+        self.priority = priority
+
+    def evaluate(self, available, prices):
+        sets = min(available[s] // n for s, n in self.units.items())
+        if not sets:
+            return {}, 0
+        value = sum(prices[s] * n for s, n in self.units.items())
+        return ({s: sets * n for s, n in self.units.items()},
+                sets * min(self.off, value))
+
+
+RULE_KINDS = {cls.kind: cls for cls in (Markdown, MultiBuy, SetDiscount)}
+
+
+def rule_from_spec(spec):
+    """
+    Build a rule from its JSON form: {"type": ..., "id": ..., ...}, with
+    an optional customer-facing "name" for receipts.
+    """
+    spec = dict(spec)
+    kind = spec.pop("type")
+    if kind not in RULE_KINDS:
+        raise ValueError(f"unknown promotion type {kind!r}")
+    return RULE_KINDS[kind](spec.pop("id"), **spec)
+
+
+def load_rules(path):
+    with open(path, encoding="utf-8") as f:
+        return [rule_from_spec(spec) for spec in json.load(f)]
+
+
+# ================= ENGINE =================
+class PricingEngine:
+    """
+    Totals for one cart, updated as units are added and removed.
+
+    `products` maps sku -> Product; `clock` returns the minute of the day
+    markdowns are judged by. Not thread-safe: the UI thread owns it.
+    """
+
+    def __init__(self, products, rules=(), clock=minute_of_day):
+        self.products = products
+        self.rules = list(rules)
+        self.clock = clock
+        self._markdowns = collections.defaultdict(list)
+        self._rules = collections.defaultdict(list)   # sku -> by rank
+        self._rank = {}
+        for order, rule in enumerate(self.rules):
+            if isinstance(rule, Markdown):
+                for sku in rule.skus:
+                    self._markdowns[sku].append(rule)
+                continue
+            self._rank[rule] = (rule.priority, order)
+            for sku in rule.skus:
+                self._rules[sku].append(rule)
+        for rules_for_sku in self._rules.values():
+            rules_for_sku.sort(key=self._rank.get)
+        self.clear()
+
+    def clear(self):
+        self._count = collections.Counter()
+        self._price = {}            # unit price of each sku in the cart
+        self._claims = {}           # rule -> {sku: units}
+        self._claimants = collections.defaultdict(dict)   # sku -> {rule: n}
+        self._rule_discount = {}    # rule -> {rate: yen}
+        self._amount = collections.Counter()     # rate -> unit prices
+        self._discount = collections.Counter()   # rate -> rule discounts
+        self._markdown_saving = 0
+
+    def price(self, sku):
+        """Current unit price of `sku` (shelf price less any markdown)."""
+        if sku in self._price:
+            return self._price[sku]
+        return self._unit_price(sku, self.clock())
+
+    def add(self, sku, qty=1):
+        product = self.products[sku]
+        if sku not in self._price:
+            self._price[sku] = self._unit_price(sku, self.clock())
+        price = self._price[sku]
+        self._count[sku] += qty
+        self._amount[product.rate] += qty * price
+        self._markdown_saving += qty * (product.price - price)
+        self._reevaluate(self._rules.get(sku, ()))
+
+    def remove(self, sku, qty=1):
+        qty = min(qty, self._count[sku])
+        if not qty:
+            return
+        product = self.products[sku]
+        price = self._price[sku]
+        self._count[sku] -= qty
+        self._amount[product.rate] -= qty * price
+        self._markdown_saving -= qty * (product.price - price)
+        if not self._count[sku]:
+            del self._count[sku]
+            del self._price[sku]
+        self._reevaluate(self._rules.get(sku, ()))
+
+    def refresh(self, now=None):
+        """
+        Re-price products whose markdown started or ended since they were
+        added. Returns whether any price changed.
+        """
+        minute = minute_of_day(now) if now is not None else self.clock()
+        changed, touched = False, []
+        for sku in self._markdowns.keys() & self._price.keys():
+            old, new = self._price[sku], self._unit_price(sku, minute)
+            if old == new:
+                continue
+            count = self._count[sku]
+            self._price[sku] = new
+            self._amount[self.products[sku].rate] += count * (new - old)
+            self._markdown_saving -= count * (new - old)
+            touched.extend(self._rules.get(sku, ()))
+            changed = True
+        self._reevaluate(touched)
+        return changed
+
+    def totals(self):
+        taxes = []
+        for rate in sorted(self._amount):
+            amount = self._amount[rate] - self._discount[rate]
+            if amount or self._amount[rate]:
+                taxes.append(RateTotal(rate, amount,
+                                       tax_included(amount, rate)))
+        promotions = tuple(
+            (rule.rule_id, sum(split.values()))
+            for rule, split in self._rule_discount.items())
+        return Totals(
+            count=sum(self._count.values()),
+            total=sum(t.amount for t in taxes),
+            discount=self._markdown_saving + sum(self._discount.values()),
+            taxes=tuple(taxes),
+            promotions=promotions)
+
+    # ── internals ──
+    def _unit_price(self, sku, minute):
+        price = self.products[sku].price
+        for rule in self._markdowns.get(sku, ()):
+            if rule.active(minute):
+                price = min(price, rule.unit_price(self.products[sku].price))
+        return price
+
+    def _available(self, sku, rank):
+        """Units of `sku` not claimed by rules ranked ahead of `rank`."""
+        count = self._count.get(sku)
+        if not count:
+            return 0    # most rules indexed under a sku span absent ones
+        claimants = self._claimants.get(sku)
+        if claimants:
+            count -= sum(n for rule, n in claimants.items()
+                         if self._rank[rule] < rank)
+        return count
+
+    def _reevaluate(self, rules):
+        # Rules only ever displace lower-ranked ones, so evaluating in rank
+        # order settles each rule at most once per change.
+        heap = [(self._rank[r], r) for r in set(rules)]
+        heapq.heapify(heap)
+        queued = {r for _, r in heap}
+        while heap:
+            rank, rule = heapq.heappop(heap)
+            available = {s: self._available(s, rank) for s in rule.skus}
+            claim, discount = rule.evaluate(available, self._price)
+            old = self._claims.pop(rule, {})
+            for sku in claim.keys() | old.keys():
+                if claim.get(sku, 0) == old.get(sku, 0):
+                    continue
+                if claim.get(sku):
+                    self._claimants[sku][rule] = claim[sku]
+                else:
+                    del self._claimants[sku][rule]
+                    if not self._claimants[sku]:
+                        del self._claimants[sku]
+                for other in self._rules[sku]:
+                    if self._rank[other] > rank and other not in queued:
+                        queued.add(other)
+                        heapq.heappush(heap, (self._rank[other], other))
+            old_split = self._rule_discount.pop(rule, None)
+            if old_split:
+                self._discount.subtract(old_split)
+            if claim:
+                self._claims[rule] = claim
+                value = collections.Counter()
+                for sku, n in claim.items():
+                    value[self.products[sku].rate] += n * self._price[sku]
+                split = _split(discount, value)
+                self._rule_discount[rule] = split
+                self._discount.update(split)
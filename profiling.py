@@ -0,0 +1,188 @@
+"""
+On-demand profiling for the running kiosk.
+
+A capture runs for a fixed number of seconds and writes, into the profile
+directory:
+
+* ``profile-<stamp>.prof`` / ``.txt`` — cProfile of the GUI thread, or
+  ``samples-<stamp>.folded`` — sampled GUI-thread stacks in collapsed
+  flamegraph format;
+* ``trace-<stamp>.json`` — every timed metrics span (camera tick stages,
+  payment phases, ...) as Chrome trace events, viewable in
+  chrome://tracing or Perfetto.
+
+The module is Qt-free; the caller schedules ``stop()`` on its own event
+loop because cProfile must be disabled from the thread that enabled it.
+"""
+
+import cProfile
+import collections
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger("pos.profiling")
+
+MODES = ("cprofile", "sampling")
+
+
+def parse_spec(spec):
+    """Parse ``"cprofile:30"`` / ``"sampling"`` into ``(mode, seconds)``."""
+    mode, _, seconds = spec.strip().lower().partition(":")
+    if mode not in MODES:
+        raise ValueError(f"unknown profiling mode: {mode!r}")
+    return mode, float(seconds) if seconds else None
+
+
+class TraceRecorder:
+    """Collects metrics spans as Chrome ``X`` (complete) trace events."""
+
+    def __init__(self, registry=metrics.REGISTRY):
+        self._registry = registry
+        self._events = []
+        self._origin = 0.0
+
+    def start(self):
+        self._events = []
+        self._origin = time.perf_counter()
+        self._registry.add_span_listener(self._on_span)
+
+    def stop(self):
+        self._registry.remove_span_listener(self._on_span)
+
+    def _on_span(self, inst, start, elapsed):
+        self._events.append({
+            "name": inst.series,
+            "cat": inst.name,
+            "ph": "X",
+            "ts": round((start - self._origin) * 1e6, 1),
+            "dur": round(elapsed * 1e6, 1),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+        })
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": self._events,
+                       "displayTimeUnit": "ms"}, f)
+        return len(self._events)
+
+
+class StackSampler:
+    """Samples one thread's Python stack at a fixed interval."""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.stacks.clear()
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            parts = []
+            while frame is not None:
+                code = frame.f_code
+                parts.append(f"{os.path.basename(code.co_filename)}:"
+                             f"{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(parts))] += 1
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Profiler:
+    """One capture at a time; start() on the GUI thread, stop() likewise."""
+
+    def __init__(self, out_dir, mode="cprofile", duration=10.0):
+        self.out_dir = out_dir
+        self.mode = mode
+        self.duration = duration
+        self.running = False
+        self._profile = None
+        self._sampler = None
+        self._tracer = TraceRecorder()
+        self._stamp = None
+
+    def start(self, mode=None, duration=None):
+        """Begin a capture; returns its duration in seconds."""
+        if self.running:
+            return 0.0
+        mode = mode or self.mode
+        if mode not in MODES:
+            raise ValueError(f"unknown profiling mode: {mode!r}")
+        self._stamp = time.strftime("%Y%m%d-%H%M%S")
+        self._tracer.start()
+        if mode == "cprofile":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._sampler = StackSampler(threading.get_ident())
+            self._sampler.start()
+        self.running = True
+        duration = duration or self.duration
+        logger.warning("Profiling started: %s for %.0fs", mode, duration)
+        return duration
+
+    def stop(self):
+        """End the capture and write its files; returns the written paths."""
+        if not self.running:
+            return []
+        self.running = False
+        self._tracer.stop()
+        os.makedirs(self.out_dir, exist_ok=True)
+        base = os.path.join(self.out_dir, "{}-" + self._stamp + "{}")
+        paths = []
+
+        if self._profile is not None:
+            self._profile.disable()
+            path = base.format("profile", ".prof")
+            self._profile.dump_stats(path)
+            buf = io.StringIO()
+            pstats.Stats(self._profile, stream=buf).sort_stats(
+                "cumulative").print_stats(40)
+            with open(base.format("profile", ".txt"), "w",
+                      encoding="utf-8") as f:
+                f.write(buf.getvalue())
+            paths.append(path)
+            self._profile = None
+
+        if self._sampler is not None:
+            self._sampler.stop()
+            path = base.format("samples", ".folded")
+            self._sampler.write(path)
+            paths.append(path)
+            self._sampler = None
+
+        trace_path = base.format("trace", ".json")
+        events = self._tracer.write(trace_path)
+        paths.append(trace_path)
+        logger.warning("Profiling finished: %d trace events → %s",
+                       events, self.out_dir)
+        return paths
@@ -0,0 +1,454 @@
+"""
+Receipts for finished sales, rendered and printed off the GUI thread.
+
+The GUI thread only snapshots the sale into a Receipt and queues it;
+laying it out, rendering each format and writing the result happen on
+one background thread, so a slow printer or disk never holds up clearing
+the cart for the next customer. Unlike recorded frames receipts are
+never dropped: the queue is unbounded and close() drains it.
+
+Formats:
+
+- text: UTF-8, padded for a monospace font (East Asian wide characters
+  count as two columns, as they print).
+- escpos: ESC/POS byte stream for a Japanese thermal printer, with Kanji
+  mode and Shift-JIS text, double-size total and a partial cut.
+- png / pdf: 576-dot-wide (80 mm at 203 dpi) image or vector page,
+  painted with Qt so no imaging dependency is needed.
+
+The layout is the simplified invoice a convenience store hands out: the
+issuer's registration number, reduced-rate items marked ※, and the
+amount and consumption tax per rate. Fonts, the ESC/POS preamble and the
+store header (as bytes, text and a pre-rendered image) are built once
+per printer and reused for every receipt.
+
+Output goes to a directory, or as print jobs to a spool directory that a
+printer daemon drains; `python receipts.py spooler DIR` stands in for
+one:
+
+    POS_RECEIPTS=escpos,png POS_RECEIPT_SPOOL=spool python main.py
+    python receipts.py spooler spool --lines-per-second 40
+"""
+
+import argparse
+import collections
+import itertools
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import unicodedata
+
+from PyQt6.QtCore import (
+    QBuffer, QByteArray, QIODevice, QMarginsF, QRect, QSizeF, Qt
+)
+from PyQt6.QtGui import (
+    QFont, QFontMetrics, QImage, QPageLayout, QPageSize, QPainter, QPdfWriter
+)
+
+import metrics
+
+logger = logging.getLogger("pos.receipts")
+
+FORMATS = ("text", "escpos", "png", "pdf")
+EXTENSIONS = {"text": "txt", "escpos": "bin", "png": "png", "pdf": "pdf"}
+
+WIDTH_CHARS = 42        # Font B columns on an 80 mm printer
+WIDTH_DOTS = 576        # printable width at 203 dpi
+DPI = 203
+
+RECEIPTS = {
+    result: metrics.counter(
+        "pos_receipts_total", "Receipts handed to the printer worker",
+        {"result": result})
+    for result in ("written", "failed")
+}
+RENDER_SECONDS = {
+    fmt: metrics.histogram(
+        "pos_receipt_render_seconds", "Render one receipt", {"format": fmt})
+    for fmt in FORMATS
+}
+RECEIPT_LAG = metrics.histogram(
+    "pos_receipt_lag_seconds", "Sale to every format written")
+
+ReceiptItem = collections.namedtuple("ReceiptItem", "name qty price rate")
+# `taxes` is a sequence of pricing.RateTotal, `promotions` of (name, yen);
+# `auth_code` is the card authorisation code, None for unsettled payment
+Receipt = collections.namedtuple(
+    "Receipt", "checkout_id lane ts items total discount taxes promotions "
+               "id_verified auth_code", defaults=(None,))
+# One printed line; `style` is "normal", "bold", "big", "center" or "rule"
+Line = collections.namedtuple("Line", "left right style")
+
+
+def display_width(text):
+    return sum(2 if unicodedata.east_asian_width(c) in "WFA" else 1
+               for c in text)
+
+
+def printable(text):
+    """Drop emoji and other pictographs thermal printers cannot print."""
+    return "".join(c for c in text
+                   if unicodedata.category(c) not in ("So", "Mn", "Cf")
+                   ).strip()
+
+
+def _yen(amount):
+    return f"-¥{-amount:,}" if amount < 0 else f"¥{amount:,}"
+
+
+def _fit(left, right, width):
+    """Pad between `left` and `right`, truncating `left` if needed."""
+    room = width - display_width(right) - (1 if right else 0)
+    while display_width(left) > room:
+        left = left[:-1]
+    if not right:
+        return left
+    return left + " " * (width - display_width(left) - display_width(right)) \
+        + right
+
+
+def layout(receipt, reduced_rate):
+    """Everything below the cached store header, as Lines."""
+    stamp = time.strftime("%Y-%m-%d %H:%M", time.localtime(receipt.ts))
+    lines = [Line(stamp, f"レーン {receipt.lane}", "normal"),
+             Line(f"No. {receipt.checkout_id}", "", "normal"),
+             Line("", "", "rule")]
+    for item in receipt.items:
+        mark = " ※" if item.rate == reduced_rate else ""
+        lines.append(Line(printable(item.name) + mark,
+                          _yen(item.qty * item.price), "normal"))
+        if item.qty > 1:
+            lines.append(Line(f"  {item.qty}点 × @{item.price:,}", "",
+                              "normal"))
+    if receipt.promotions:
+        lines.append(Line("", "", "rule"))
+        for name, yen in receipt.promotions:
+            lines.append(Line(f"割引 {name}", _yen(-yen), "normal"))
+    lines += [Line("", "", "rule"),
+              Line("合計", _yen(receipt.total), "big")]
+    for t in receipt.taxes:
+        lines.append(Line(f"({t.rate}%対象 {_yen(t.amount)}",
+                          f"内消費税 {_yen(t.tax)})", "normal"))
+    if receipt.discount:
+        lines.append(Line("お値引き合計", _yen(receipt.discount), "normal"))
+    if any(item.rate == reduced_rate for item in receipt.items):
+        lines.append(Line("※は軽減税率対象商品です", "", "normal"))
+    if receipt.auth_code:
+        lines.append(Line("クレジット", f"承認番号 {receipt.auth_code}",
+                          "normal"))
+    if receipt.id_verified:
+        lines.append(Line("年齢確認済み", "", "normal"))
+    lines.append(Line("ありがとうございました", "", "center"))
+    return lines
+
+
+def header_lines(store, invoice_number):
+    lines = [Line(store, "", "big")]
+    if invoice_number:
+        lines.append(Line(f"登録番号 {invoice_number}", "", "center"))
+    lines.append(Line("領収書", "", "center"))
+    return lines
+
+
+# ================= TEXT / ESC-POS =================
+def text_lines(lines, width=WIDTH_CHARS):
+    out = []
+    for line in lines:
+        if line.style == "rule":
+            out.append("-" * width)
+        elif line.style == "center" or (line.style == "big"
+                                        and not line.right):
+            pad = max(0, width - display_width(line.left)) // 2
+            out.append(" " * pad + line.left)
+        else:
+            out.append(_fit(line.left, line.right, width))
+    return out
+
+
+ESC_INIT = b"\x1b@"
+ESC_JAPAN = b"\x1bR\x08"            # international set: 0x5C prints ¥
+FS_KANJI = b"\x1cC\x01\x1c&"        # Shift-JIS, Kanji mode on
+ESC_CENTER, ESC_LEFT = b"\x1ba\x01", b"\x1ba\x00"
+ESC_BOLD, ESC_NOBOLD = b"\x1bE\x01", b"\x1bE\x00"
+GS_BIG, GS_NORMAL = b"\x1d!\x11", b"\x1d!\x00"
+FEED_CUT = b"\x1bd\x04\x1dVB\x00"   # feed 4 lines, partial cut
+
+
+def _sjis(text):
+    return text.replace("¥", "\\").encode("cp932", errors="replace")
+
+
+def escpos_bytes(lines, width=WIDTH_CHARS):
+    out = bytearray()
+    for line in lines:
+        if line.style == "big":
+            # Double width halves the columns; a lone title is centred.
+            text = (line.left if not line.right
+                    else _fit(line.left, line.right, width // 2))
+            out += (ESC_CENTER if not line.right else b"") + GS_BIG
+            out += _sjis(text) + b"\n" + GS_NORMAL + ESC_LEFT
+        elif line.style == "center":
+            out += ESC_CENTER + _sjis(line.left) + b"\n" + ESC_LEFT
+        elif line.style == "rule":
+            out += b"-" * width + b"\n"
+        else:
+            text = _sjis(_fit(line.left, line.right, width))
+            if line.style == "bold":
+                text = ESC_BOLD + text + ESC_NOBOLD
+            out += text + b"\n"
+    return bytes(out)
+
+
+# ================= IMAGE / PDF =================
+class _QtRenderer:
+    """
+    Paints Lines with QPainter. Built lazily on the worker thread (Qt
+    allows painting on QImage and QPdfWriter off the GUI thread); holds
+    the fonts and the pre-rendered header image.
+    """
+
+    MARGIN = 8
+
+    def __init__(self, header):
+        self.fonts = {}
+        for style, px, bold in (("normal", 22, False), ("bold", 22, True),
+                                ("center", 22, False), ("big", 40, True),
+                                ("rule", 22, False)):
+            font = QFont("Noto Sans JP")
+            font.setStyleHint(QFont.StyleHint.SansSerif)
+            font.setPixelSize(px)
+            font.setBold(bold)
+            self.fonts[style] = (font, QFontMetrics(font).height() + 4)
+        self.header = self._image(header)
+
+    def height(self, lines):
+        return sum(self.fonts[line.style][1] for line in lines)
+
+    def paint(self, painter, lines, y=0):
+        left = Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter
+        right = Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
+        width = WIDTH_DOTS - 2 * self.MARGIN
+        for line in lines:
+            font, h = self.fonts[line.style]
+            rect = QRect(self.MARGIN, y, width, h)
+            if line.style == "rule":
+                painter.drawLine(self.MARGIN, y + h // 2,
+                                 WIDTH_DOTS - self.MARGIN, y + h // 2)
+            else:
+                painter.setFont(font)
+                if line.style == "center" or not line.right and \
+                        line.style == "big":
+                    painter.drawText(rect, Qt.AlignmentFlag.AlignCenter,
+                                     line.left)
+                else:
+                    painter.drawText(rect, left, line.left)
+                    painter.drawText(rect, right, line.right)
+            y += h
+        return y
+
+    def _image(self, lines):
+        img = QImage(WIDTH_DOTS, max(1, self.height(lines)),
+                     QImage.Format.Format_Grayscale8)
+        img.fill(Qt.GlobalColor.white)
+        painter = QPainter(img)
+        self.paint(painter, lines)
+        painter.end()
+        return img
+
+    def png(self, lines):
+        img = QImage(WIDTH_DOTS, self.header.height() + self.height(lines),
+                     QImage.Format.Format_Grayscale8)
+        img.fill(Qt.GlobalColor.white)
+        painter = QPainter(img)
+        painter.drawImage(0, 0, self.header)
+        self.paint(painter, lines, self.header.height())
+        painter.end()
+        data = QByteArray()
+        buf = QBuffer(data)
+        buf.open(QIODevice.OpenModeFlag.WriteOnly)
+        img.save(buf, "PNG")
+        return bytes(data)
+
+    def pdf(self, header, lines):
+        height = self.height(header) + self.height(lines)
+        data = QByteArray()
+        buf = QBuffer(data)
+        buf.open(QIODevice.OpenModeFlag.WriteOnly)
+        writer = QPdfWriter(buf)
+        writer.setResolution(DPI)
+        writer.setPageSize(QPageSize(
+            QSizeF(80.0, height * 25.4 / DPI + 8.0),
+            QPageSize.Unit.Millimeter))
+        writer.setPageMargins(QMarginsF(0, 0, 0, 0),
+                              QPageLayout.Unit.Millimeter)
+        painter = QPainter(writer)
+        # Vector text: the header is painted, not blitted from the image.
+        self.paint(painter, lines, self.paint(painter, header))
+        painter.end()
+        return bytes(data)
+
+
+# ================= OUTPUT =================
+def _write_atomic(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class FileSink:
+    """One file per receipt and format: <dir>/<stamp>-<checkout>.<ext>."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, receipt, fmt, data):
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(receipt.ts))
+        name = f"{stamp}-{receipt.checkout_id}.{EXTENSIONS[fmt]}"
+        _write_atomic(os.path.join(self.directory, name), data)
+
+
+class SpoolSink:
+    """
+    Print jobs for a directory spooler: files appear whole (written
+    aside, then renamed) and their names sort in submission order.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._seq = itertools.count(int(time.time() * 1000))
+
+    def write(self, receipt, fmt, data):
+        name = (f"{next(self._seq):015d}-{receipt.checkout_id}"
+                f".{EXTENSIONS[fmt]}")
+        _write_atomic(os.path.join(self.directory, name), data)
+
+
+# ================= WORKER =================
+class ReceiptPrinter:
+    """Owns the render caches and the printer thread."""
+
+    def __init__(self, sink, formats=("text",), store="", invoice_number="",
+                 reduced_rate=8, width=WIDTH_CHARS):
+        unknown = set(formats) - set(FORMATS)
+        if unknown:
+            raise ValueError(f"unknown receipt formats: {sorted(unknown)}")
+        self.sink = sink
+        self.formats = tuple(formats)
+        self.reduced_rate = reduced_rate
+        self.width = width
+        self._header = header_lines(store, invoice_number)
+        self._text_header = "\n".join(text_lines(self._header, width)) + "\n"
+        self._escpos_header = (ESC_INIT + ESC_JAPAN + FS_KANJI
+                               + escpos_bytes(self._header, width))
+        self._qt = None
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="receipt-printer", daemon=True)
+        self._thread.start()
+
+    def submit(self, receipt):
+        """Queue a receipt; returns at once (GUI thread)."""
+        self._queue.put((receipt, time.perf_counter()))
+
+    def close(self, timeout=10.0):
+        """Print what is queued and stop the worker."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def render(self, receipt, fmt, lines=None):
+        if lines is None:
+            lines = layout(receipt, self.reduced_rate)
+        with RENDER_SECONDS[fmt].time():
+            if fmt == "text":
+                return (self._text_header
+                        + "\n".join(text_lines(lines, self.width))
+                        + "\n").encode("utf-8")
+            if fmt == "escpos":
+                return (self._escpos_header
+                        + escpos_bytes(lines, self.width) + FEED_CUT)
+            if self._qt is None:
+                self._qt = _QtRenderer(self._header)
+            if fmt == "png":
+                return self._qt.png(lines)
+            return self._qt.pdf(self._header, lines)
+
+    def _run(self):
+        try:
+            # Linux nices individual threads: the kiosk UI goes first when
+            # both want the CPU, and a receipt waits a few ms instead.
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        except (AttributeError, OSError):
+            pass
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            receipt, queued = item
+            try:
+                lines = layout(receipt, self.reduced_rate)
+                for fmt in self.formats:
+                    self.sink.write(receipt, fmt,
+                                    self.render(receipt, fmt, lines))
+            except Exception:
+                RECEIPTS["failed"].inc()
+                logger.exception("Receipt not printed",
+                                 extra={"checkout_id": receipt.checkout_id})
+                continue
+            RECEIPTS["written"].inc()
+            RECEIPT_LAG.observe(time.perf_counter() - queued)
+
+
+# ================= SPOOLER STAND-IN =================
+def run_spooler(directory, lines_per_second=40.0, poll=0.2, once=False):
+    """
+    Drain print jobs in name order, taking as long as a printer of the
+    given speed would, and delete them. Returns the number printed.
+    """
+    printed = 0
+    while True:
+        jobs = sorted(n for n in os.listdir(directory)
+                      if not n.endswith(".tmp"))
+        for name in jobs:
+            path = os.path.join(directory, name)
+            with open(path, "rb") as f:
+                data = f.read()
+            lines = max(1, data.count(b"\n"))
+            time.sleep(lines / lines_per_second)
+            os.remove(path)
+            printed += 1
+            print(f"printed {name} ({len(data)} bytes, {lines} lines)",
+                  flush=True)
+        if once and not jobs:
+            return printed
+        time.sleep(poll)
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    sub = p.add_subparsers(dest="cmd", required=True)
+    sp = sub.add_parser("spooler", help="stand-in printer draining a "
+                                        "spool directory")
+    sp.add_argument("directory")
+    sp.add_argument("--lines-per-second", type=float, default=40.0)
+    sp.add_argument("--once", action="store_true",
+                    help="exit once the spool is empty")
+    args = p.parse_args()
+    os.makedirs(args.directory, exist_ok=True)
+    try:
+        n = run_spooler(args.directory, args.lines_per_second,
+                        once=args.once)
+        print(f"{n} jobs printed", file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,98 @@
+"""
+Repaint-time benchmark for the render profiles.
+
+Builds the main window and each dialog under every profile and times
+synchronous repaints. The camera dialog gets a fresh preview pixmap before
+each repaint, which is what it does on every tick during verification.
+
+    python render_bench.py --repeats 200
+    QT_QPA_PLATFORM=xcb python render_bench.py   # on the real display
+"""
+
+import os
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from PyQt6.QtGui import QImage, QPixmap
+from PyQt6.QtWidgets import QApplication
+
+import main
+
+
+def _preview_pixmaps(size, count=8):
+    rng = np.random.default_rng(0)
+    pixmaps = []
+    for _ in range(count):
+        frame = rng.integers(0, 255, (480, 640, 3), dtype=np.uint8)
+        img = QImage(frame.data, 640, 480, 640 * 3,
+                     QImage.Format.Format_RGB888).copy()
+        pixmaps.append(QPixmap.fromImage(img).scaled(size))
+    return pixmaps
+
+
+def time_repaints(app, widget, repeats, before=None):
+    widget.show()
+    app.processEvents()
+    samples = []
+    for i in range(repeats):
+        if before:
+            before(i)
+        start = time.perf_counter()
+        widget.repaint()
+        samples.append(time.perf_counter() - start)
+    widget.hide()
+    app.processEvents()
+    arr = np.asarray(samples) * 1000.0
+    return {
+        "mean_ms": round(float(arr.mean()), 3),
+        "p50_ms": round(float(np.percentile(arr, 50)), 3),
+        "p95_ms": round(float(np.percentile(arr, 95)), 3),
+    }
+
+
+def bench_profile(app, profile, repeats):
+    main.RENDER_PROFILE = profile
+    win = main.MyMart()
+    if win._init_error:
+        raise SystemExit(1)
+    for row in range(win.product_list.count()):
+        win.product_list.setCurrentRow(row)
+        win._add_item()
+
+    cam = main.CameraVerificationDialog(win)
+    pixmaps = _preview_pixmaps(cam.camera_label.size())
+    results = {
+        "MyMart": time_repaints(app, win, repeats),
+        "CameraVerificationDialog": time_repaints(
+            app, cam, repeats,
+            lambda i: cam.camera_label.setPixmap(pixmaps[i % len(pixmaps)])),
+        "NFCScanDialog": time_repaints(
+            app, main.NFCScanDialog("(15-20)", win), repeats),
+        "UnderageAlertDialog": time_repaints(
+            app, main.UnderageAlertDialog("鈴木花子", 17, win), repeats),
+        "PaymentSuccessDialog": time_repaints(
+            app, main.PaymentSuccessDialog(3, 1200, None, win), repeats),
+    }
+    win.close()
+    win.deleteLater()
+    app.processEvents()
+    return results
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Repaint time per render profile")
+    p.add_argument("--repeats", type=int, default=100)
+    p.add_argument("--profiles", nargs="*", default=list(main.RENDER_PROFILES))
+    args = p.parse_args()
+
+    app = QApplication(sys.argv[:1])
+    report = {profile: bench_profile(app, profile, args.repeats)
+              for profile in args.profiles}
+    print(json.dumps(report, indent=2))
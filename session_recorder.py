@@ -0,0 +1,188 @@
+"""
+Optional recording of camera verification sessions.
+
+Each session becomes a directory under the recording root holding
+downscaled JPEG key frames and ``session.jsonl``: one line per kept frame
+with the detector boxes, quality and running verdict, then a closing
+summary line with the outcome. That is enough to replay what the kiosk
+saw when a refusal is disputed.
+
+The GUI thread only hands frames over; resizing, JPEG encoding and disk
+writes happen on one background thread. At most ``max_pending`` frames
+may wait for it: beyond that new frames are dropped (and counted), so a
+slow disk costs recorded frames, never live ones.
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import cv2
+
+import metrics
+
+logger = logging.getLogger("pos.recording")
+
+FRAMES = {
+    result: metrics.counter(
+        "pos_recording_frames_total", "Verification frames offered to the "
+        "recorder", {"result": result})
+    for result in ("written", "dropped")
+}
+ENCODE_SECONDS = metrics.histogram(
+    "pos_recording_encode_seconds", "Resize, encode and write one frame")
+
+
+class Recording:
+    """One verification session; add() and finish() on the GUI thread."""
+
+    def __init__(self, recorder, session_id, path):
+        self.session_id = session_id
+        self.path = path
+        self.frames = 0
+        self.kept = 0
+        self.dropped = 0
+        self._recorder = recorder
+        self._started = time.monotonic()
+        self._last_key = None
+
+    def add(self, frame, key=None, **meta):
+        """
+        Offer a frame. It is kept if it is every `every`-th frame, if
+        `key` (e.g. the verdict text) changed since the last kept frame,
+        and while the session is under its frame cap.
+
+        The recorder holds on to `frame` without copying; don't draw on
+        it afterwards.
+        """
+        self.frames += 1
+        rec = self._recorder
+        changed = key != self._last_key
+        if self.kept >= rec.max_frames or not (
+                changed or (self.frames - 1) % rec.every == 0):
+            return
+        meta["t"] = round(time.monotonic() - self._started, 3)
+        meta["frame"] = self.frames
+        if rec._offer(("frame", self, self.kept, frame, meta)):
+            self.kept += 1
+            self._last_key = key
+        else:
+            self.dropped += 1
+
+    def finish(self, **summary):
+        summary.update(
+            session=self.session_id, frames=self.frames, kept=self.kept,
+            dropped=self.dropped,
+            seconds=round(time.monotonic() - self._started, 3))
+        self._recorder._control(("end", self, summary))
+
+
+class SessionRecorder:
+    """Owns the recording root and the encoder thread."""
+
+    def __init__(self, root, scale=0.5, every=3, max_frames=200,
+                 max_pending=16, jpeg_quality=80):
+        self.root = root
+        self.scale = scale
+        self.every = max(1, every)
+        self.max_frames = max_frames
+        self.jpeg_quality = jpeg_quality
+        self._queue = queue.SimpleQueue()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._files = {}
+        self._thread = None
+
+    def start(self):
+        os.makedirs(self.root, exist_ok=True)
+        self._thread = threading.Thread(
+            target=self._run, name="session-recorder", daemon=True)
+        self._thread.start()
+
+    def begin(self, session_id, **meta):
+        """Open a new session directory and return its Recording."""
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self.root, f"{stamp}-{session_id}")
+        recording = Recording(self, session_id, path)
+        meta.update(session=session_id, started=time.time())
+        self._control(("begin", recording, meta))
+        return recording
+
+    def close(self, timeout=5.0):
+        """Flush what is queued and stop the encoder thread."""
+        if self._thread is None:
+            return
+        self._control(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    # ── GUI side ──
+    def _offer(self, item):
+        if self._thread is None or not self._slots.acquire(blocking=False):
+            FRAMES["dropped"].inc()
+            return False
+        self._queue.put(item)
+        return True
+
+    def _control(self, item):
+        # Begin/end markers bypass the frame budget; they are tiny and a
+        # session must always be closed.
+        self._queue.put(item)
+
+    # ── encoder thread ──
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            kind, recording = item[0], item[1]
+            try:
+                if kind == "frame":
+                    try:
+                        self._write_frame(recording, *item[2:])
+                    finally:
+                        self._slots.release()
+                elif kind == "begin":
+                    os.makedirs(recording.path, exist_ok=True)
+                    f = open(os.path.join(recording.path, "session.jsonl"),
+                             "a", encoding="utf-8")
+                    self._files[recording] = f
+                    self._write_line(f, {"type": "begin", **item[2]})
+                else:
+                    f = self._files.pop(recording, None)
+                    if f is not None:
+                        self._write_line(f, {"type": "end", **item[2]})
+                        f.close()
+            except OSError:
+                logger.exception("Recording write failed",
+                                 extra={"session": recording.session_id})
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+    def _write_frame(self, recording, index, frame, meta):
+        f = self._files.get(recording)
+        if f is None:
+            return
+        with ENCODE_SECONDS.time():
+            if self.scale != 1.0:
+                frame = cv2.resize(frame, None, fx=self.scale, fy=self.scale,
+                                   interpolation=cv2.INTER_AREA)
+            ok, buf = cv2.imencode(
+                ".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+            if not ok:
+                return
+            name = f"{index:05d}.jpg"
+            with open(os.path.join(recording.path, name), "wb") as out:
+                out.write(buf.tobytes())
+        meta["file"] = name
+        meta["scale"] = self.scale
+        self._write_line(f, {"type": "frame", **meta})
+        FRAMES["written"].inc()
+
+    @staticmethod
+    def _write_line(f, entry):
+        f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+        f.flush()